@@ -1,6 +1,6 @@
 import argparse
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--wandb-project', type=str, default=None)
     parser.add_argument('--environment', type=str, default='HalfCheetah-v3')
@@ -9,7 +9,76 @@ def parse_args():
     parser.add_argument('--load', type=str, default=None)
     parser.add_argument('--save', type=str, default=None)
     parser.add_argument('--save-every', type=int, default=100)
-    args = parser.parse_args()
+    parser.add_argument('--keep-checkpoints', type=int, default=3,
+        help='number of newest checkpoints `{save}-{update}` kept on disk')
+    parser.add_argument('--log-csv', type=str, default=None,
+        help='also write metrics to this csv file (`step,name,value` rows)')
+    parser.add_argument('--log-jsonl', type=str, default=None,
+        help='also write metrics to this file, one json record per line')
+    parser.add_argument('--profile', action='store_true',
+        help='time the phases of the training loop, log them with the metrics and print a summary at exit')
+    parser.add_argument('--profile-fence', action='store_true',
+        help='block on jax results at the end of every profiled phase, see jax_a2c/profiling.py')
+    parser.add_argument('--profile-trace-dir', type=str, default=None,
+        help='write a jax.profiler trace of the updates given by --profile-trace-updates to this directory')
+    parser.add_argument('--profile-trace-updates', type=int, nargs=2, default=None, metavar=('START', 'STOP'),
+        help='updates [START, STOP) covered by the trace')
+    parser.add_argument('--num-seeds', type=int, default=1,
+        help='number of independent runs trained together in one process with vmapped updates')
+    parser.add_argument('--num-devices', type=int, default=1,
+        help='data-parallel updates over this many local devices, gradients are averaged between them')
+    parser.add_argument('--env-backend', type=str, default='subproc', choices=['subproc', 'jax'],
+        help='`jax` trains on a pure-JAX environment (see jax_a2c/jax_envs.py) with fully compiled updates')
+    parser.add_argument('--shared-memory', action='store_true',
+        help='exchange env steps through shared memory instead of pipes')
+    parser.add_argument('--envs-per-worker', type=int, default=1,
+        help='number of environments stepped by every worker process')
+    parser.add_argument('--num-groups', type=int, default=1,
+        help='split envs into groups and overlap policy inference of one group with stepping of the others '
+             '(not with --num-seeds)')
+    parser.add_argument('--gae-method', type=str, default='scan', choices=['scan', 'associative'],
+        help='`associative` computes GAE with a parallel prefix scan, for long rollouts on accelerators')
+    parser.add_argument('--compilation-cache-dir', type=str, default=None,
+        help='persistent XLA compilation cache, shared by all runs pointed at the same directory')
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false',
+        help='do not compile the hot functions before the first update')
+    parser.add_argument('--async-eval', action='store_true',
+        help='evaluate parameter snapshots in a background thread instead of pausing training')
+    parser.add_argument('--eval-episodes', type=int, default=None,
+        help='number of evaluation episodes, one per evaluation env by default')
+    parser.add_argument('--reset-states', type=str, default=None,
+        help='.npy of flat env states (see env_utils.get_flat_state), training episodes start from states drawn from it')
+    parser.add_argument('--eval-start-states', type=str, default=None,
+        help='.npy of flat env states, evaluation episodes start from them so every evaluation sees the same starts')
+    parser.add_argument('--learner-address', type=str, default=None,
+        help='actor-learner training, the learner listens on this address: HOST:PORT or unix:PATH (jax_a2c/distributed.py)')
+    parser.add_argument('--local-actors', type=int, default=2,
+        help='actor processes the learner starts on this machine')
+    parser.add_argument('--actor', type=int, default=None, metavar='ID',
+        help='run actor ID (unique, not below --local-actors) for the learner at --learner-address, with its flags')
+    parser.add_argument('--max-staleness', type=int, default=4,
+        help='rollouts collected with params more than this many updates old are not trained on')
+    parser.add_argument('--record', type=str, default=None, metavar='DIR',
+        help='append the raw rollouts and advantages to memory-mapped files in DIR, see jax_a2c/recording.py '
+             '(single seed and actor-learner training, not --num-seeds or --env-backend jax)')
+    parser.add_argument('--record-every', type=int, default=1,
+        help='record every this many updates')
+    parser.add_argument('--pin-cpus', action='store_true',
+        help='pin the trainer to --learner-cpus cpus and every env worker and actor process to one of the others')
+    parser.add_argument('--learner-cpus', type=int, default=1,
+        help='cpus kept for the trainer (policy inference, XLA threads) with --pin-cpus')
+    parser.add_argument('--autotune', action='store_true',
+        help='pick num_envs, num_steps, --envs-per-worker and --num-groups by a calibration sweep, see jax_a2c/autotune.py')
+    parser.add_argument('--autotune-cache', type=str, default='~/.cache/jax_a2c/autotune.json',
+        help='calibration results of earlier runs, a run with the same settings on the same machine reuses them')
+    parser.add_argument('--autotune-updates', type=int, default=20,
+        help='timed updates per calibrated layout')
+    parser.add_argument('--policy', type=str, default='separate', choices=['separate', 'fused', 'shared-trunk'],
+        help='`fused` runs both towers with one matmul per layer, `shared-trunk` puts both heads on one tower')
+    parser.add_argument('--compute-dtype', type=str, default='float32', choices=['float32', 'bfloat16'],
+        help='dtype of the policy forward passes (and of the stored rollout observations with --env-backend jax), '
+             'params stay float32')
+    args = parser.parse_args(argv)
     return args
 
 
@@ -17,6 +86,13 @@ args = dict(
         seed=777,
         gamma=.99,
         lambda_=1., # gae lambda coef
+        gae_method='scan', # see utils.gae_advantages
+        compilation_cache_dir=None, # see jax_a2c/compilation.py
+        warmup=True, # compile the hot functions before the first update
+        async_eval=False, # evaluate in a background thread, see evaluation.AsyncEvaluator
+        eval_episodes=None, # episodes per evaluation, None: one per env
+        reset_states=None, # .npy of env states training episodes start from, see env_utils.SubprocVecEnv.set_reset_pool
+        eval_start_states=None, # .npy of env states evaluation episodes start from
         lr=2e-3,
         linear_decay=True,
         value_loss_coef=.4,
@@ -24,6 +100,8 @@ args = dict(
         eval_every=50,
         wb_flag=True, # log to wandb or not
         hidden_sizes=(64, 64,),
+        policy='separate', # see policy.make_policy
+        compute_dtype='float32', # 'bfloat16': mixed precision with float32 params and optimizer state
         env_name='HalfCheetah-v3',
         num_envs=4,
         num_steps=32,
@@ -38,11 +116,27 @@ args = dict(
         device='0',
         allocate_memory='.15', 
         wandb_proj_name='test_jax_a2c',
-        log_freq=50,
+        log_freq=50, # updates per logged window of training metrics, see jax_a2c/metrics.py
+        num_seeds=1, # independent runs trained together, see jax_a2c/multi_seed.py
+        num_devices=1, # data-parallel update over local devices, see jax_a2c/data_parallel.py
+        env_backend='subproc', # 'subproc': gym envs in worker processes, 'jax': jax_a2c.jax_envs
+        shared_memory=False, # shared memory transport for env workers
+        envs_per_worker=1, # environments stepped sequentially by one worker process
+        num_groups=1, # >1 pipelines policy inference with env stepping
+        learner_address=None, # actor-learner training, see jax_a2c/distributed.py
+        local_actors=2, # actor processes started by the learner
+        actor=None, # id of this process when it is an actor
+        max_staleness=4, # learner updates a rollout's params may be behind, staler ones are dropped
+        record=None, # directory of the trajectory recording, see jax_a2c/recording.py
+        record_every=1, # updates between recorded rollouts
+        pin_cpus=False, # pin the trainer and the env workers to disjoint cpus
+        learner_cpus=1, # cpus of the trainer when pinned
+        worker_cpus=None, # cpus env workers are pinned to, set by run_a2c_train.py with --pin-cpus
+        autotune=False, # calibrate the rollout layout, see jax_a2c/autotune.py
+        autotune_cache='~/.cache/jax_a2c/autotune.json', # calibration results reused by later runs
+        autotune_updates=20, # timed updates per calibrated layout
     )
 
-cmd_args = parse_args()
-
 def update(args, cmd_args):
     args['wandb_proj_name'] = cmd_args.wandb_project
     
@@ -58,6 +152,41 @@ def update(args, cmd_args):
     args['load'] = cmd_args.load
     args['save'] = cmd_args.save
     args['save_every'] = cmd_args.save_every
+    args['keep_checkpoints'] = cmd_args.keep_checkpoints
+    args['log_csv'] = cmd_args.log_csv
+    args['log_jsonl'] = cmd_args.log_jsonl
+    args['profile'] = cmd_args.profile
+    args['profile_fence'] = cmd_args.profile_fence
+    args['profile_trace_dir'] = cmd_args.profile_trace_dir
+    args['profile_trace_updates'] = cmd_args.profile_trace_updates
+    args['num_seeds'] = cmd_args.num_seeds
+    args['num_devices'] = cmd_args.num_devices
+    args['env_backend'] = cmd_args.env_backend
+    args['shared_memory'] = cmd_args.shared_memory
+    args['envs_per_worker'] = cmd_args.envs_per_worker
+    args['num_groups'] = cmd_args.num_groups
+    args['gae_method'] = cmd_args.gae_method
+    args['compilation_cache_dir'] = cmd_args.compilation_cache_dir
+    args['warmup'] = cmd_args.warmup
+    args['async_eval'] = cmd_args.async_eval
+    args['eval_episodes'] = cmd_args.eval_episodes
+    args['reset_states'] = cmd_args.reset_states
+    args['eval_start_states'] = cmd_args.eval_start_states
+    args['policy'] = cmd_args.policy
+    args['compute_dtype'] = cmd_args.compute_dtype
+    args['learner_address'] = cmd_args.learner_address
+    args['local_actors'] = cmd_args.local_actors
+    args['actor'] = cmd_args.actor
+    args['max_staleness'] = cmd_args.max_staleness
+    args['record'] = cmd_args.record
+    args['record_every'] = cmd_args.record_every
+    args['pin_cpus'] = cmd_args.pin_cpus
+    args['learner_cpus'] = cmd_args.learner_cpus
+    args['autotune'] = cmd_args.autotune
+    args['autotune_cache'] = cmd_args.autotune_cache
+    args['autotune_updates'] = cmd_args.autotune_updates
     return args
 
-args = update(args, cmd_args)
\ No newline at end of file
+def get_args(argv=None):
+    """ defaults of `args` updated with the command line, nothing is parsed on import """
+    return update(dict(args), parse_args(argv))
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Actor-learner training (`jax_a2c/distributed.py`): checks that frames round-trip every dtype and large arrays (partial
+sends), and the protocol of `ExperienceServer` with a scripted actor. Then trains on the stand-in env with `A` local
+actor processes of `--num-envs` envs each and compares env steps/s with the single-process loop (`train.main`) on
+`A * num_envs` envs, and reports learner utilization and rollout staleness, from the logged metrics after the first
+logging window (compilation).
+
+    python benchmarks/bench_actor_learner.py --num-actors 1 2 4 --max-staleness 4
+"""
+import argparse
+import json
+import os
+import socket
+import tempfile
+import threading
+
+import jax.numpy as jnp
+import numpy as np
+
+from common import POINT_MASS_SLOW
+from args import get_args
+from jax_a2c.distributed import (HELLO, PARAMS, ROLLOUT, STOP,
+                                 ExperienceServer, connect, recv_message,
+                                 send_message)
+from jax_a2c.train import main, main_distributed
+
+
+def check_framing():
+    arrays = [
+        np.float32(3.), np.arange(12, dtype=np.int64).reshape(3, 4), np.zeros((0, 5), np.float32),
+        np.array([True, False]), np.arange(6, dtype=np.float64)[::2], np.asarray(jnp.arange(4, dtype=jnp.bfloat16)),
+        # larger than the socket buffers, sent in several parts
+        np.random.RandomState(0).randn(1 << 21).astype(np.float32)]
+    left, right = socket.socketpair()
+    sender = threading.Thread(target=send_message, args=(left, ROLLOUT, -7, arrays))
+    sender.start()
+    kind, tag, received = recv_message(right)
+    sender.join()
+    left.close()
+    right.close()
+    assert (kind, tag, len(received)) == (ROLLOUT, -7, len(arrays))
+    for array, copy in zip(arrays, received):
+        assert array.dtype == copy.dtype and array.shape == copy.shape
+        np.testing.assert_array_equal(np.asarray(array, np.float64), np.asarray(copy, np.float64))
+
+
+def check_server(directory):
+    server = ExperienceServer(f'unix:{os.path.join(directory, "learner.sock")}', max_queued=1)
+    params = [np.ones((2, 3), np.float32), np.zeros(3, np.float32)]
+    server.publish(0, params)
+    actor = connect(server.address)
+    send_message(actor, HELLO, 5)
+    kind, version, leaves = recv_message(actor)
+    assert (kind, version) == (PARAMS, 0) and all(np.array_equal(a, b) for a, b in zip(params, leaves))
+    experience = [np.full((2, 3), i, np.float32) for i in range(5)]
+    send_message(actor, ROLLOUT, version, experience)
+    # nothing new: the reply only carries the version
+    assert recv_message(actor)[:2] == (PARAMS, 0)
+    rollout = server.get(timeout=10)
+    assert (rollout.actor, rollout.version) == (5, 0)
+    assert all(np.array_equal(a, b) for a, b in zip(experience, rollout.experience))
+    server.publish(1, [2 * p for p in params])
+    send_message(actor, ROLLOUT, 0, experience)
+    kind, version, leaves = recv_message(actor)
+    assert (kind, version) == (PARAMS, 1) and np.array_equal(leaves[0], 2 * params[0])
+    server.close()
+    send_message(actor, ROLLOUT, 1, experience)
+    assert recv_message(actor)[0] == STOP
+    actor.close()
+
+
+def run(directory, name, argv, num_envs, num_updates, distributed):
+    log = os.path.join(directory, f'{name}.jsonl')
+    args = get_args(argv + ['--log-jsonl', log])
+    args.update(
+        num_envs=num_envs, log_freq=20, eval_every=10**9, num_timesteps=num_updates * num_envs * args['num_steps'])
+    (main_distributed if distributed else main)(args)
+    with open(log) as handle:
+        windows = [record for record in map(json.loads, handle) if 'time/updates' in record][1:]
+    return {key: float(np.median([w[key] for w in windows if key in w])) for key in windows[0]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-actors', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--num-envs', type=int, default=4, help='envs per actor')
+    parser.add_argument('--num-updates', type=int, default=200)
+    parser.add_argument('--max-staleness', type=int, default=4)
+    cmd_args = parser.parse_args()
+
+    check_framing()
+    with tempfile.TemporaryDirectory() as directory:
+        check_server(directory)
+    print('framing and server protocol checks passed')
+
+    common_argv = ['--environment', POINT_MASS_SLOW, '--max-staleness', str(cmd_args.max_staleness)]
+    results = []
+    for num_actors in cmd_args.num_actors:
+        with tempfile.TemporaryDirectory() as directory:
+            serial = run(
+                directory, 'serial', common_argv + ['--profile'], num_actors * cmd_args.num_envs,
+                cmd_args.num_updates, distributed=False)
+            actor_learner = run(
+                directory, 'actor_learner', common_argv + [
+                    '--local-actors', str(num_actors),
+                    '--learner-address', f'unix:{os.path.join(directory, "learner.sock")}'],
+                cmd_args.num_envs, cmd_args.num_updates, distributed=True)
+        results.append((num_actors, serial, actor_learner))
+    for num_actors, serial, actor_learner in results:
+        print(f'actors={num_actors}  single process ({num_actors * cmd_args.num_envs} envs): '
+              f'{serial["profile/env_steps_per_sec"]:7.0f} steps/s  '
+              f'actor-learner: {actor_learner["actor_learner/env_steps_per_sec"]:7.0f} steps/s  '
+              f'learner utilization {actor_learner["actor_learner/learner_utilization"]:5.1%}  '
+              f'staleness mean {actor_learner.get("actor_learner/staleness_mean", float("nan")):4.1f} '
+              f'max {actor_learner.get("actor_learner/staleness_max", float("nan")):2.0f}  '
+              f'dropped/window {actor_learner["actor_learner/dropped_rollouts"]:4.1f}')
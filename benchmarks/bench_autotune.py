@@ -0,0 +1,98 @@
+"""
+Rollout autotuning (`jax_a2c/autotune.py`) and cpu pinning (`env_utils.split_cpus` / `pin_process`): checks that
+workers run on the cpus they are given, that every candidate layout keeps the transitions per update and divides
+into workers and groups, and that a calibration is cached and reused. Then calibrates `--num-envs x --num-steps` on
+the stand-in env with a simulated step cost and compares env steps/s of the configured layout (one env per worker)
+with the chosen one, re-measured with more updates, and with the chosen one pinned if there are cpus to split.
+
+    python benchmarks/bench_autotune.py --num-envs 16 --num-steps 32
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from common import POINT_MASS, POINT_MASS_SLOW
+from args import get_args
+from jax_a2c.autotune import (LAYOUT_KEYS, autotune, cache_key,
+                              candidate_layouts, measure_layout)
+from jax_a2c.env_utils import make_vec_env, pin_process, split_cpus
+
+
+def check_pinning():
+    cpus = split_cpus()
+    if cpus is None:
+        print(f'only {len(os.sched_getaffinity(0))} cpu available, pinning check skipped')
+        return
+    _, worker_cpus = cpus
+    envs = make_vec_env(POINT_MASS, num=6, seed=0, norm_obs=False, norm_r=False, envs_per_worker=2,
+                        worker_cpus=worker_cpus)
+    try:
+        for worker, process in enumerate(envs.processes):
+            assert os.sched_getaffinity(process.pid) == {worker_cpus[worker % len(worker_cpus)]}
+    finally:
+        envs.close()
+
+
+def check_candidates():
+    for num_envs, num_steps, envs_per_worker in [(4, 32, 1), (16, 32, 4), (6, 5, 3), (1, 1, 1)]:
+        args = get_args([])
+        args.update(num_envs=num_envs, num_steps=num_steps, envs_per_worker=envs_per_worker)
+        layouts = candidate_layouts(args, max_workers=8)
+        assert layouts[0] == {key: args[key] for key in LAYOUT_KEYS}
+        for layout in layouts:
+            assert layout['num_envs'] * layout['num_steps'] == num_envs * num_steps
+            assert layout['num_envs'] % layout['envs_per_worker'] == 0
+            assert (layout['num_envs'] // layout['envs_per_worker']) % layout['num_groups'] == 0
+        assert len(layouts) == len({tuple(layout.values()) for layout in layouts})
+
+
+def check_cache(directory):
+    path = os.path.join(directory, 'autotune.json')
+    args = get_args(['--environment', POINT_MASS])
+    args.update(num_envs=2, num_steps=8)
+    tuned = autotune(args, path, num_updates=2)
+    with open(path) as handle:
+        cached = json.load(handle)[cache_key(args)]
+    assert {key: tuned[key] for key in LAYOUT_KEYS} == cached['layout']
+    assert len(cached['measurements']) == len(candidate_layouts(args))
+    # the second run only reads the cache
+    os.chmod(path, 0o444)
+    assert autotune(args, path, num_updates=2) == tuned
+    # other settings are calibrated separately
+    assert cache_key(dict(args, num_steps=16)) != cache_key(args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, default=16)
+    parser.add_argument('--num-steps', type=int, default=32)
+    parser.add_argument('--calibration-updates', type=int, default=10)
+    parser.add_argument('--num-updates', type=int, default=50)
+    cmd_args = parser.parse_args()
+
+    check_pinning()
+    check_candidates()
+    with tempfile.TemporaryDirectory() as directory:
+        check_cache(directory)
+    print('pinning, candidate layout and cache checks passed')
+
+    args = get_args(['--environment', POINT_MASS_SLOW, '--shared-memory'])
+    args.update(num_envs=cmd_args.num_envs, num_steps=cmd_args.num_steps)
+    with tempfile.TemporaryDirectory() as directory:
+        tuned = autotune(args, os.path.join(directory, 'autotune.json'), num_updates=cmd_args.calibration_updates)
+    layouts = {'configured': args, 'autotuned': tuned}
+    results = {name: measure_layout(layout, {}, cmd_args.num_updates) for name, layout in layouts.items()}
+    cpus = split_cpus()
+    if cpus is not None:
+        learner_cpus, worker_cpus = cpus
+        all_cpus = os.sched_getaffinity(0)
+        pin_process(learner_cpus)
+        layouts['autotuned, pinned'] = dict(tuned, worker_cpus=worker_cpus)
+        results['autotuned, pinned'] = measure_layout(layouts['autotuned, pinned'], {}, cmd_args.num_updates)
+        pin_process(all_cpus)
+    for name, result in results.items():
+        layout = ' '.join(f'{key}={layouts[name][key]}' for key in LAYOUT_KEYS)
+        print(f'{name:18s} {layout:60s} {result["env_steps_per_sec"]:8.0f} steps/s  '
+              f'rollout {result["rollout_ms"]:7.2f} ms  update {result["update_ms"]:6.2f} ms  '
+              f'speedup {result["env_steps_per_sec"] / results["configured"]["env_steps_per_sec"]:.2f}x')
@@ -0,0 +1,89 @@
+"""
+Checkpoint cost seen by the training loop: the previous synchronous pickling of the state dict (kept here as the
+reference) vs `CheckpointManager.save`, which hands the state to an idle background writer, and load times of
+pickled vs memory-mapped checkpoints. Both formats are first checked to round-trip the state exactly.
+
+    python benchmarks/bench_checkpoint.py --hidden-sizes 64 64 --hidden-sizes 1024 1024
+"""
+import argparse
+import os
+import pickle
+import tempfile
+
+import flax
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from common import timeit
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.saving import CheckpointManager, latest_checkpoint, load_state, save_state
+from jax_a2c.utils import create_train_state
+
+
+def pickle_state(path, state, additional):
+    state_dict = flax.serialization.to_state_dict(state)
+    with open(path, 'wb') as handle:
+        pickle.dump((additional, state_dict), handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class _Envs:
+    def reset(self):
+        return np.zeros((1, 17), np.float32)
+
+
+def make_state(hidden_sizes, seed=0):
+    model = DiagGaussianPolicy(hidden_sizes=hidden_sizes, action_dim=6, init_log_std=0.)
+    state = create_train_state(
+        jax.random.PRNGKey(seed), model, _Envs(), learning_rate=1e-3, decaying_lr=True, max_norm=.5, decay=.99, eps=1e-5,
+        train_steps=100)
+    # non-trivial optimizer statistics and step
+    grads = jax.tree_map(jnp.ones_like, state.params)
+    return state.apply_gradients(grads=grads)
+
+
+def check_roundtrip(directory, hidden_sizes):
+    state = make_state(hidden_sizes)
+    template = make_state(hidden_sizes, seed=1)
+    for name, write in (('binary', save_state), ('pickle', pickle_state)):
+        path = os.path.join(directory, f'roundtrip.{name}')
+        write(path, state, {'wandb_run_id': 'abc'})
+        loaded, additional = load_state(path, template)
+        assert additional == {'wandb_run_id': 'abc'} and loaded.step == state.step
+        jax.tree_map(np.testing.assert_array_equal, flax.serialization.to_state_dict(loaded),
+                     flax.serialization.to_state_dict(state))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hidden-sizes', type=int, nargs='+', action='append')
+    parser.add_argument('--saves', type=int, default=20)
+    cmd_args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for hidden_sizes in cmd_args.hidden_sizes or [[64, 64], [1024, 1024]]:
+            hidden_sizes = tuple(hidden_sizes)
+            check_roundtrip(directory, hidden_sizes)
+            state = make_state(hidden_sizes)
+            template = make_state(hidden_sizes, seed=1)
+            prefix = os.path.join(directory, 'run')
+            pickled = os.path.join(directory, 'run.pkl')
+
+            def pickle_saves():
+                for _ in range(cmd_args.saves):
+                    pickle_state(pickled, state, {})
+            sync = timeit(pickle_saves) / cmd_args.saves
+
+            # saves are `--save-every` updates apart, the writer is idle when the next one comes
+            on_loop = 0.
+            for step in range(cmd_args.saves):
+                checkpoints = CheckpointManager(prefix, keep=2)
+                on_loop += timeit(lambda: checkpoints.save(step, state, {})) / cmd_args.saves
+                checkpoints.close()
+
+            pickle_load = timeit(lambda: jax.block_until_ready(load_state(pickled, template)), 5)
+            binary_load = timeit(lambda: jax.block_until_ready(load_state(latest_checkpoint(prefix), template)), 5)
+            size = os.path.getsize(latest_checkpoint(prefix))
+            print(f'hidden={hidden_sizes}  size {size / 2**20:.2f} MiB  '
+                  f'save on the training thread: pickle {sync * 1e3:.2f} ms, async {on_loop * 1e3:.3f} ms '
+                  f'load: pickle {pickle_load * 1e3:.2f} ms, memmap {binary_load * 1e3:.2f} ms')
@@ -0,0 +1,97 @@
+"""
+Data-parallel update (`jax_a2c.data_parallel`) on synthetic rollouts: first checks that an update on several devices
+gives the same parameters (and normalization statistics) as the single-device `normalize_experience` +
+`process_experience` + `a2c.step` on the whole batch,
+then measures update throughput with a fixed number of envs per device (weak scaling).
+Host devices are emulated with `--xla_force_host_platform_device_count`, so on CPU every device shares the same cores.
+
+    python benchmarks/bench_data_parallel.py --num-devices 1 2 4 --envs-per-device 16
+"""
+import argparse
+import os
+
+import numpy as np
+
+from common import timeit
+
+
+def make_experience(num_steps, num_envs, obs_dim, action_dim, seed=0):
+    rng = np.random.RandomState(seed)
+    return (
+        rng.randn(num_steps, num_envs, obs_dim).astype(np.float32),
+        rng.uniform(-1, 1, (num_steps, num_envs, action_dim)).astype(np.float32),
+        rng.randn(num_steps, num_envs).astype(np.float32),
+        rng.randn(num_steps + 1, num_envs).astype(np.float32),
+        rng.uniform(size=(num_steps + 1, num_envs)) < .05)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-devices', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--envs-per-device', type=int, default=16)
+    parser.add_argument('--num-steps', type=int, default=32)
+    parser.add_argument('--obs-dim', type=int, default=17)
+    parser.add_argument('--action-dim', type=int, default=6)
+    parser.add_argument('--repeats', type=int, default=5)
+    cmd_args = parser.parse_args()
+    # must be set before the first jax computation
+    os.environ['XLA_FLAGS'] = (
+        os.environ.get('XLA_FLAGS', '') + f' --xla_force_host_platform_device_count={max(cmd_args.num_devices)}')
+
+    import jax
+    import jax.numpy as jnp
+
+    from jax_a2c import data_parallel
+    from jax_a2c.a2c import step
+    from jax_a2c.policy import DiagGaussianPolicy
+    from jax_a2c.utils import (create_train_state, normalize_experience,
+                               process_experience)
+
+    num_devices = max(cmd_args.num_devices)
+
+    class _Envs:
+        def reset(self):
+            return np.zeros((num_devices * cmd_args.envs_per_device, cmd_args.obs_dim), np.float32)
+
+    model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=cmd_args.action_dim, init_log_std=0.)
+    state = create_train_state(
+        jax.random.PRNGKey(0), model, _Envs(), learning_rate=1e-3, decaying_lr=False, max_norm=.5, decay=.99, eps=1e-5)
+    hyperparams = dict(gamma=.99, lambda_=.95, value_loss_coef=.5, entropy_coef=.01, normalize_advantages=True)
+
+    experience = make_experience(cmd_args.num_steps, num_devices * cmd_args.envs_per_device,
+                                 cmd_args.obs_dim, cmd_args.action_dim)
+    # raw observations off zero mean and unit scale, so that normalizing them matters
+    experience = (3 * experience[0] + 1,) + experience[1:]
+    for normalize in (False, True):
+        reference, normalized = state, tuple(map(jnp.asarray, experience))
+        if normalize:
+            reference, normalized = normalize_experience(state, normalized)
+        reference, (reference_loss, _) = step(reference, process_experience(normalized, .99, .95), .5, .01, True)
+        update = data_parallel.make_update_fn(num_devices, **hyperparams, norm_obs=normalize, norm_r=normalize)
+        parallel, (parallel_loss, _) = update(data_parallel.replicate_state(state, num_devices), experience)
+        np.testing.assert_allclose(parallel_loss, reference_loss, rtol=1e-5)
+        jax.tree_map(lambda a, b: np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-6),
+                     (data_parallel.host_state(parallel).params, data_parallel.host_state(parallel).norm_state),
+                     (reference.params, reference.norm_state))
+
+    print(f'{cmd_args.envs_per_device} envs x {cmd_args.num_steps} steps per device')
+    for num_devices in cmd_args.num_devices:
+        experience = make_experience(cmd_args.num_steps, num_devices * cmd_args.envs_per_device,
+                                     cmd_args.obs_dim, cmd_args.action_dim)
+        if num_devices == 1:
+            def update(state, experience):
+                return step(state, process_experience(experience, .99, .95), .5, .01, True)
+            replicated = state
+        else:
+            update = data_parallel.make_update_fn(num_devices, **hyperparams)
+            replicated = data_parallel.replicate_state(state, num_devices)
+        experience = tuple(map(jnp.asarray, experience))
+        jax.block_until_ready(update(replicated, experience))
+
+        def run(calls=20):
+            for _ in range(calls):
+                loss = update(replicated, experience)[1][0]
+            loss.block_until_ready()
+        seconds = timeit(run, cmd_args.repeats) / 20
+        batch = num_devices * cmd_args.envs_per_device * cmd_args.num_steps
+        print(f'devices={num_devices}  batch={batch:6d}  {seconds * 1e3:7.2f} ms/update  {batch / seconds:10.0f} samples/s')
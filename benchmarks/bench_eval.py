@@ -0,0 +1,74 @@
+"""
+Evaluation wall time: the previous lockstep `evaluation.eval` (kept here as the reference: all envs stepped
+until every env finished, rewards stacked and masked afterwards) vs the episode-streaming `evaluate_episodes`,
+on a stand-in env with random episode lengths. Parity is checked on fixed-length episodes first.
+
+    python benchmarks/bench_eval.py --num-envs 8 --num-episodes 8 32
+"""
+import argparse
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from common import POINT_MASS, POINT_MASS_VARIABLE, timeit
+from jax_a2c.env_utils import make_vec_env
+from jax_a2c.evaluation import deterministic_policy, evaluate_episodes
+from jax_a2c.policy import DiagGaussianPolicy
+
+
+def lockstep_eval(apply_fn, params, env):
+    env.training = False
+    observation = env.reset()
+    total_reward = []
+    cumdones = jnp.zeros(shape=(observation.shape[0],))
+    dones = [np.array(observation.shape[0]*[False])]
+    for _ in range(1000):
+        action_means = deterministic_policy(apply_fn, params, observation)
+        observation, reward, done, info = env.step(action_means)
+        cumdones += done
+        total_reward.append(env.old_reward)
+        dones.append(done)
+        if cumdones.all():
+            break
+    masks = jnp.cumprod(1-jnp.array(dones), axis=0)[:-1]
+    return (jnp.array(total_reward)*masks).sum(axis=0).mean().item()
+
+
+def _make(env_name, num_envs, envs_per_worker=1):
+    env = make_vec_env(env_name, num=num_envs, norm_r=False, seed=0, envs_per_worker=envs_per_worker)
+    model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=env.action_space.shape[0], init_log_std=0.)
+    params = model.init(jax.random.PRNGKey(0), env.reset())['params']
+    return env, model.apply, params
+
+
+def check_parity(num_envs, envs_per_worker):
+    reference_env, apply_fn, params = _make(POINT_MASS, num_envs, envs_per_worker)
+    streaming_env, _, _ = _make(POINT_MASS, num_envs, envs_per_worker)
+    reference = lockstep_eval(apply_fn, params, reference_env)
+    streamed = evaluate_episodes(apply_fn, params, streaming_env).mean
+    reference_env.close()
+    streaming_env.close()
+    assert np.isclose(reference, streamed, rtol=1e-5), f'streaming eval {streamed} != lockstep eval {reference}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, default=8)
+    parser.add_argument('--envs-per-worker', type=int, default=1)
+    parser.add_argument('--num-episodes', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--repeats', type=int, default=3)
+    cmd_args = parser.parse_args()
+
+    check_parity(cmd_args.num_envs, cmd_args.envs_per_worker)
+    env, apply_fn, params = _make(POINT_MASS_VARIABLE, cmd_args.num_envs, cmd_args.envs_per_worker)
+    lockstep = timeit(lambda: lockstep_eval(apply_fn, params, env), cmd_args.repeats)
+    print(f'lockstep eval, {cmd_args.num_envs} episodes: {lockstep:.2f}s')
+    for num_episodes in cmd_args.num_episodes:
+        result = {}
+        seconds = timeit(lambda: result.update(r=evaluate_episodes(apply_fn, params, env, num_episodes)),
+                         cmd_args.repeats)
+        r = result['r']
+        print(f'streaming eval, {len(r.returns)} episodes: {seconds:.2f}s  '
+              f'return {r.mean:.1f} [{r.ci_low:.1f}, {r.ci_high:.1f}]  mean length {r.lengths.mean():.0f}')
+    env.close()
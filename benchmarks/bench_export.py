@@ -0,0 +1,157 @@
+"""
+Exported policies (`jax_a2c/export.py`): parity of the NumPy forward pass and of the StableHLO artifact with
+`deterministic_policy` on the flax model for every policy layout, then the cold start of a fresh process that loads
+a policy and computes one action, through the training stack (flax `TrainState` with optimizer state and
+`load_state`) vs the exported .npz with `jax_a2c.inference` (NumPy only). Reports import and load time,
+peak memory (max RSS) and file sizes.
+
+    python benchmarks/bench_export.py --hidden-sizes 256 256
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+import jax
+import numpy as np
+
+from common import ROOT
+from jax_a2c.evaluation import deterministic_policy
+from jax_a2c.export import export_policy, export_stablehlo, load_stablehlo
+from jax_a2c.inference import load_exported, save_exported
+from jax_a2c.normalization import RunningMeanStd
+from jax_a2c.policy import POLICIES, make_policy
+from jax_a2c.saving import save_state
+from jax_a2c.utils import create_train_state
+
+
+class _Envs:
+    def __init__(self, obs_dim):
+        self.obs_dim = obs_dim
+
+    def reset(self):
+        return np.zeros((4, self.obs_dim), np.float32)
+
+
+def write_checkpoint(path, model, obs_dim, seed=0):
+    state = create_train_state(
+        jax.random.PRNGKey(seed), model, _Envs(obs_dim), learning_rate=1e-3, decaying_lr=False, max_norm=.5,
+        decay=.99, eps=1e-5)
+    rng = np.random.RandomState(seed)
+    obs_rms = RunningMeanStd(
+        mean=rng.randn(obs_dim).astype(np.float32), var=rng.uniform(.5, 2, obs_dim).astype(np.float32),
+        count=np.float32(1e4))
+    # non-trivial biases, freshly initialized ones are zero
+    params = jax.tree_map(lambda x: x + .1 * rng.randn(*x.shape).astype(np.float32), state.params)
+    state = state.replace(params=params, norm_state=state.norm_state.replace(obs_rms=obs_rms))
+    save_state(path, state, {})
+    return state
+
+
+def check_parity(directory, hidden_sizes, obs_dim, action_dim):
+    # observations far from the statistics, so the clipping of the normalization is exercised too
+    observations = 5 * np.random.RandomState(1).randn(33, obs_dim).astype(np.float32)
+    for kind in POLICIES:
+        model = make_policy(kind, hidden_sizes, action_dim, 0.)
+        checkpoint = os.path.join(directory, f'{kind}.ckpt')
+        state = write_checkpoint(checkpoint, model, obs_dim)
+        for norm_obs in (True, False):
+            obs_rms = state.norm_state.obs_rms if norm_obs else None
+            expected = np.asarray(deterministic_policy(state.apply_fn, state.params, observations, obs_rms))
+            path = os.path.join(directory, f'{kind}.npz')
+            save_exported(path, export_policy(checkpoint, norm_obs))
+            policy = load_exported(path)
+            np.testing.assert_allclose(policy.forward(observations), expected, rtol=1e-5, atol=1e-5)
+            np.testing.assert_allclose(policy.forward(observations[0]), expected[0], rtol=1e-5, atol=1e-5)
+            np.testing.assert_allclose(policy.log_stds, state.params['Action_log_stds'])
+            export_stablehlo(policy, path + '.stablehlo')
+            forward = load_stablehlo(path + '.stablehlo')
+            for batch in (1, 33):
+                np.testing.assert_allclose(forward(observations[:batch]), expected[:batch], rtol=1e-5, atol=1e-5)
+        print(f'{kind:12s}  numpy and stablehlo match deterministic_policy')
+
+
+TRAIN_STATE = """
+import jax
+from jax_a2c.evaluation import deterministic_policy
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.saving import load_state
+from jax_a2c.utils import create_train_state
+imported = time.perf_counter()
+
+class Envs:
+    def reset(self):
+        return np.zeros((1, {obs_dim}), np.float32)
+
+model = DiagGaussianPolicy(hidden_sizes={hidden_sizes}, action_dim={action_dim}, init_log_std=0.)
+state = create_train_state(
+    jax.random.PRNGKey(0), model, Envs(), learning_rate=1e-3, decaying_lr=False, max_norm=.5, decay=.99, eps=1e-5)
+state, _ = load_state({path!r}, state)
+action = np.asarray(deterministic_policy(state.apply_fn, state.params, observation, state.norm_state.obs_rms))
+"""
+
+EXPORTED = """
+from jax_a2c.inference import load_exported
+imported = time.perf_counter()
+action = load_exported({path!r}).forward(observation)
+"""
+
+
+def cold_start(snippet: str, obs_dim: int, **kwargs) -> dict:
+    """ Runs `snippet` in a fresh interpreter, seconds to import, seconds to the first action and max RSS """
+    code = textwrap.dedent(f"""
+        import time
+        start = time.perf_counter()
+        import json, resource, sys
+        import numpy as np
+        observation = np.zeros((1, {obs_dim}), np.float32)
+
+        def peak_rss_mb():
+            # ru_maxrss is inherited from the forking parent on Linux, the high-water mark of this address space is not
+            try:
+                with open('/proc/self/status') as status:
+                    return next(int(l.split()[1]) for l in status if l.startswith('VmHWM')) / 1024
+            except OSError:
+                return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        """) + textwrap.dedent(snippet.format(obs_dim=obs_dim, **kwargs)) + textwrap.dedent("""
+        done = time.perf_counter()
+        print(json.dumps(dict(
+            import_seconds=imported - start, first_action_seconds=done - start,
+            max_rss_mb=peak_rss_mb(),
+            jax_loaded='jax' in sys.modules, flax_loaded='flax' in sys.modules, optax_loaded='optax' in sys.modules)))
+        """)
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hidden-sizes', type=int, nargs='+', default=[64, 64])
+    parser.add_argument('--obs-dim', type=int, default=17)
+    parser.add_argument('--action-dim', type=int, default=6)
+    parser.add_argument('--repeats', type=int, default=3)
+    cmd_args = parser.parse_args()
+    hidden_sizes = tuple(cmd_args.hidden_sizes)
+
+    with tempfile.TemporaryDirectory() as directory:
+        check_parity(directory, hidden_sizes, cmd_args.obs_dim, cmd_args.action_dim)
+
+        checkpoint = os.path.join(directory, 'model.ckpt')
+        write_checkpoint(checkpoint, make_policy('separate', hidden_sizes, cmd_args.action_dim, 0.), cmd_args.obs_dim)
+        exported = os.path.join(directory, 'policy.npz')
+        save_exported(exported, export_policy(checkpoint))
+        export_stablehlo(load_exported(exported), exported + '.stablehlo')
+        print(f'checkpoint {os.path.getsize(checkpoint) / 1024:8.1f} KiB  exported {os.path.getsize(exported) / 1024:8.1f} KiB  '
+              f'stablehlo {os.path.getsize(exported + ".stablehlo") / 1024:8.1f} KiB')
+
+        for name, snippet, path in (('train state', TRAIN_STATE, checkpoint), ('exported', EXPORTED, exported)):
+            runs = [cold_start(snippet, cmd_args.obs_dim, path=path, hidden_sizes=hidden_sizes,
+                               action_dim=cmd_args.action_dim) for _ in range(cmd_args.repeats)]
+            best = {k: min(r[k] for r in runs) for k in ('import_seconds', 'first_action_seconds', 'max_rss_mb')}
+            print(f'{name:12s}  import {best["import_seconds"]:6.2f}s  first action {best["first_action_seconds"]:6.2f}s  '
+                  f'max rss {best["max_rss_mb"]:7.1f} MiB  jax/flax/optax loaded: '
+                  f'{runs[0]["jax_loaded"]}/{runs[0]["flax_loaded"]}/{runs[0]["optax_loaded"]}')
@@ -0,0 +1,89 @@
+"""
+Compile time and runtime of `utils.gae_advantages` vs `num_steps`: the previous Python-unrolled loop
+(kept here as the reference) against the `lax.scan` and `lax.associative_scan` kernels.
+Every kernel is first checked against the reference on random rollouts with episode ends.
+
+    python benchmarks/bench_gae.py --num-steps 32 256 2048
+"""
+import argparse
+import functools
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from common import timeit
+from jax_a2c.utils import gae_advantages
+
+
+@jax.jit
+@functools.partial(jax.vmap, in_axes=(1, 1, 1, None, None), out_axes=1)
+def unrolled_gae_advantages(rewards, terminal_masks, values, discount, gae_param):
+    assert rewards.shape[0] + 1 == values.shape[0]
+    advantages = []
+    gae = 0.
+    for t in reversed(range(len(rewards))):
+        value_diff = discount * values[t + 1] * terminal_masks[t + 1] - values[t]
+        delta = rewards[t] + value_diff
+        gae = delta + discount * gae_param * terminal_masks[t + 1] * gae
+        advantages.append(gae)
+    advantages = advantages[::-1]
+    return jnp.array(advantages)
+
+
+KERNELS = dict(
+    unrolled=unrolled_gae_advantages,
+    scan=functools.partial(gae_advantages, method='scan'),
+    associative=functools.partial(gae_advantages, method='associative'),
+)
+
+
+def random_rollout(num_steps, num_envs, seed=0):
+    rng = np.random.default_rng(seed)
+    rewards = rng.normal(size=(num_steps, num_envs)).astype(np.float32)
+    values = rng.normal(size=(num_steps + 1, num_envs)).astype(np.float32)
+    masks = (rng.random((num_steps + 1, num_envs)) > .05).astype(np.float32)
+    return jnp.asarray(rewards), jnp.asarray(masks), jnp.asarray(values)
+
+
+def check_parity(num_steps, num_envs, discount=.99, gae_param=.95, atol=1e-4):
+    rollout = random_rollout(num_steps, num_envs, seed=1)
+    reference = np.asarray(unrolled_gae_advantages(*rollout, discount, gae_param))
+    for name in ('scan', 'associative'):
+        advantages = np.asarray(KERNELS[name](*rollout, discount, gae_param))
+        max_diff = np.abs(advantages - reference).max()
+        assert max_diff < atol, f'{name} differs from the unrolled loop by {max_diff} at num_steps={num_steps}'
+
+
+def compile_seconds(kernel, rollout) -> float:
+    start = time.perf_counter()
+    jax.jit(kernel).lower(*rollout, .99, .95).compile()
+    return time.perf_counter() - start
+
+
+def run_seconds(kernel, rollout, repeats) -> float:
+    jax.block_until_ready(kernel(*rollout, .99, .95))
+    return timeit(lambda: jax.block_until_ready(kernel(*rollout, .99, .95)), repeats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-steps', type=int, nargs='+', default=[32, 256, 2048])
+    parser.add_argument('--num-envs', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--skip-unrolled-above', type=int, default=256,
+        help='the unrolled loop takes minutes to compile for long rollouts')
+    cmd_args = parser.parse_args()
+
+    for num_steps in cmd_args.num_steps:
+        # a different env count, so the timed compilations below are not cache hits
+        check_parity(min(num_steps, cmd_args.skip_unrolled_above), cmd_args.num_envs + 1)
+        rollout = random_rollout(num_steps, cmd_args.num_envs)
+        for name, kernel in KERNELS.items():
+            if name == 'unrolled' and num_steps > cmd_args.skip_unrolled_above:
+                continue
+            compile_time = compile_seconds(kernel, rollout)
+            run_time = run_seconds(kernel, rollout, cmd_args.repeats)
+            print(f'num_steps={num_steps:5d}  {name:11s}  compile: {compile_time * 1e3:9.1f} ms  '
+                  f'run: {run_time * 1e6:9.1f} us')
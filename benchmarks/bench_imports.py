@@ -0,0 +1,122 @@
+"""
+Startup cost of the trainer and of its env workers. Import time of the entry points with `python -X importtime`
+(sum of the cumulative times of the top-level imports, best of `--repeats` fresh interpreters) and which heavy
+dependencies they load, then the wall time until `make_vec_env` has its workers up and reset, run from a main
+module laid out like `run_a2c_train.py` (forkserver and spawn workers import `__main__` again).
+With `--baseline-rev` the same is measured on a git revision of this repository, e.g. the one before a change.
+
+    python benchmarks/bench_imports.py --baseline-rev HEAD~1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Optional
+
+from common import ROOT
+
+IMPORTS = {
+    'args': 'import args',
+    'entry point': 'import run_a2c_train',
+    # the training loops, in `run_a2c_train` itself in trees before `jax_a2c/train.py`
+    'trainer': 'try:\n    import jax_a2c.train\nexcept ImportError:\n    import run_a2c_train',
+    'env worker': 'import jax_a2c.env_utils',
+    'checkpoints': 'import jax_a2c.saving',
+}
+HEAVY = ('jax', 'flax', 'optax', 'wandb', 'gym', 'mujoco_py', 'stable_baselines3', 'scipy')
+
+WORKER_START = """
+import sys
+import time
+sys.path.insert(0, {root!r})
+import run_a2c_train
+
+if __name__ == '__main__':
+    try:
+        import jax_a2c.train
+    except ImportError:
+        pass
+    from jax_a2c import env_utils
+    if hasattr(env_utils, 'preload_worker_modules'):
+        # what `run_a2c_train.py` does before creating its envs, trees before it have no such function
+        env_utils.preload_worker_modules({env!r})
+    start = time.perf_counter()
+    envs = env_utils.make_vec_env({env!r}, num={num_envs}, seed=0, norm_obs=False, norm_r=False)
+    envs.reset()
+    print(time.perf_counter() - start)
+    envs.close()
+"""
+
+
+def import_seconds(statement: str, root: str) -> float:
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement], cwd=root, capture_output=True, text=True,
+        check=True).stderr
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # top-level imports are not indented
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return total / 1e6
+
+
+def loaded_modules(statement: str, root: str):
+    code = f'{statement}\nimport json, sys\nprint(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))'
+    stdout = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True).stdout
+    return json.loads(stdout.strip().splitlines()[-1])
+
+
+def worker_start_seconds(root: str, env: str, num_envs: int) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        script = os.path.join(directory, 'worker_start.py')
+        with open(script, 'w') as handle:
+            handle.write(WORKER_START.format(root=root, env=env, num_envs=num_envs))
+        stdout = subprocess.run([sys.executable, script], cwd=root, capture_output=True, text=True, check=True).stdout
+    return float(stdout.strip().splitlines()[-1])
+
+
+def measure(root: str, env: str, num_envs: int, repeats: int) -> Dict[str, tuple]:
+    results = {}
+    for name, statement in IMPORTS.items():
+        seconds = min(import_seconds(statement, root) for _ in range(repeats))
+        results[f'import {name}'] = (seconds, ','.join(loaded_modules(statement, root)))
+    results[f'{num_envs} workers up'] = (min(worker_start_seconds(root, env, num_envs) for _ in range(repeats)), '')
+    return results
+
+
+def checkout(rev: str, directory: str) -> str:
+    archive = subprocess.run(['git', 'archive', rev], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+    return directory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baseline-rev', type=str, default=None, help='git revision to compare with')
+    parser.add_argument('--env', type=str, default='Pendulum-v1', help='gym env of the worker startup measurement')
+    parser.add_argument('--num-envs', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    cmd_args = parser.parse_args()
+
+    current = measure(ROOT, cmd_args.env, cmd_args.num_envs, cmd_args.repeats)
+    baseline: Optional[Dict[str, tuple]] = None
+    if cmd_args.baseline_rev:
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = measure(
+                checkout(cmd_args.baseline_rev, directory), cmd_args.env, cmd_args.num_envs, cmd_args.repeats)
+
+    for name, (seconds, modules) in current.items():
+        line = f'{name:22s}{seconds:8.2f}s'
+        if baseline is not None:
+            reference, reference_modules = baseline[name]
+            line += f'  {cmd_args.baseline_rev}: {reference:6.2f}s ({reference / seconds:.1f}x)'
+            if reference_modules != modules:
+                line += f'  loaded {reference_modules or "-"} -> {modules or "-"}'
+        elif modules:
+            line += f'  loads {modules}'
+        print(line)
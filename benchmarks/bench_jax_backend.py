@@ -0,0 +1,72 @@
+"""
+Training throughput (env steps/sec) on a pure-JAX environment: the host loop of `train.main`
+driving `JaxVecEnv` through `collect_experience` vs whole updates compiled into one scan (`jax_rollout.train`).
+
+    python benchmarks/bench_jax_backend.py --num-envs 16 256
+"""
+import argparse
+import functools
+
+import jax
+import numpy as np
+
+from common import make_policy_fn, timeit
+from jax_a2c.a2c import step
+from jax_a2c.jax_envs import JaxVecEnv
+from jax_a2c.jax_rollout import RolloutConfig, init_runner, train
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.utils import (RolloutBuffer, collect_experience,
+                           create_train_state, process_experience)
+
+
+def _create(env_name, num_envs, hidden_sizes):
+    envs = JaxVecEnv(env_name, num=num_envs, seed=0)
+    model = DiagGaussianPolicy(hidden_sizes=hidden_sizes, action_dim=envs.action_space.shape[0], init_log_std=0.)
+    state = create_train_state(
+        jax.random.PRNGKey(0), model, envs, learning_rate=1e-3, decaying_lr=False, max_norm=.5, decay=.99, eps=1e-5)
+    return envs, state
+
+
+def host_loop_steps_per_second(env_name, num_envs, num_steps, num_updates, hidden_sizes=(64, 64)) -> float:
+    envs, state = _create(env_name, num_envs, hidden_sizes)
+    _policy_fn = make_policy_fn(state.apply_fn)
+    buffer = RolloutBuffer.from_envs(envs, num_steps)
+    carry = dict(state=state, next_obs_and_dones=(envs.reset(), np.zeros(num_envs, dtype=bool)))
+
+    def run():
+        for _ in range(num_updates):
+            policy_fn = functools.partial(_policy_fn, params=carry['state'].params)
+            carry['next_obs_and_dones'], experience = collect_experience(
+                jax.random.PRNGKey(0), carry['next_obs_and_dones'], envs, num_steps, policy_fn, buffer=buffer)
+            carry['state'], (loss, _) = step(carry['state'], process_experience(experience, .99, .95))
+        loss.block_until_ready()
+
+    run()
+    return num_envs * num_steps * num_updates / timeit(run)
+
+
+def scan_steps_per_second(env_name, num_envs, num_steps, num_updates, hidden_sizes=(64, 64)) -> float:
+    envs, state = _create(env_name, num_envs, hidden_sizes)
+    runner = init_runner(jax.random.PRNGKey(0), envs.env, state, num_envs)
+    config = RolloutConfig(num_steps=num_steps)
+
+    def run():
+        jax.block_until_ready(train(runner, envs.env, config, num_updates))
+
+    run()
+    return num_envs * num_steps * num_updates / timeit(run)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default='Pendulum')
+    parser.add_argument('--num-envs', type=int, nargs='+', default=[16, 256])
+    parser.add_argument('--num-steps', type=int, default=32)
+    parser.add_argument('--num-updates', type=int, default=20)
+    cmd_args = parser.parse_args()
+
+    for num_envs in cmd_args.num_envs:
+        host = host_loop_steps_per_second(cmd_args.env, num_envs, cmd_args.num_steps, cmd_args.num_updates)
+        scan = scan_steps_per_second(cmd_args.env, num_envs, cmd_args.num_steps, cmd_args.num_updates)
+        print(f'num_envs={num_envs:5d}  host loop: {host:12.0f} steps/s  compiled scan: {scan:12.0f} steps/s  '
+              f'speedup: {scan / host:.1f}x')
@@ -0,0 +1,119 @@
+"""
+Training-loop cost of logging: the previous per-update `.item()` syncs and synchronous writes (kept here as the
+reference, on a JSONL file instead of wandb) vs `MetricsAccumulator` + `MetricsLogger` with one record per window.
+The loop runs `a2c.step` on a fixed synthetic batch. The logged window means are first checked against host means.
+
+    python benchmarks/bench_metrics.py --updates 500 --log-freq 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from common import timeit
+from jax_a2c.a2c import step
+from jax_a2c.metrics import JSONLSink, MemorySink, MetricsAccumulator, MetricsLogger
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.utils import create_train_state
+
+
+class _Envs:
+    def reset(self):
+        return np.zeros((1, 17), np.float32)
+
+
+def make_loop(batch_size):
+    model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=6, init_log_std=0.)
+    state = create_train_state(
+        jax.random.PRNGKey(0), model, _Envs(), learning_rate=1e-4, decaying_lr=False, max_norm=.5, decay=.99, eps=1e-5)
+    keys = jax.random.split(jax.random.PRNGKey(1), 4)
+    trajectories = (
+        jax.random.normal(keys[0], (batch_size, 17)), jnp.tanh(jax.random.normal(keys[1], (batch_size, 6))),
+        jax.random.normal(keys[2], (batch_size,)), jax.random.normal(keys[3], (batch_size,)))
+    return state, trajectories
+
+
+def no_logging(state, trajectories, updates):
+    for _ in range(updates):
+        state, _ = step(state, trajectories)
+    return state
+
+
+def synchronous_logging(state, trajectories, updates, log_freq, path):
+    with open(path, 'w') as handle:
+        for update in range(updates):
+            state, (loss, loss_dict) = step(state, trajectories)
+            if update % log_freq:
+                record = jax.tree_map(lambda x: x.item(), loss_dict)
+                record['loss'] = loss.item()
+                handle.write(json.dumps(dict(step=update, **record)) + '\n')
+                handle.flush()
+    return state
+
+
+def accumulated_logging(state, trajectories, updates, log_freq, sinks):
+    logger = MetricsLogger(sinks)
+    losses = MetricsAccumulator(dict(advantages_max='max', min_std='min'))
+    for update in range(updates):
+        state, (loss, loss_dict) = step(state, trajectories)
+        losses.add(dict(loss=loss, **loss_dict))
+        if (update + 1) % log_freq == 0:
+            logger.log(update, losses.flush())
+    jax.block_until_ready(state)
+    loop_done = time.perf_counter()
+    logger.close()
+    return state, loop_done
+
+
+def check_window_means(state, trajectories, log_freq):
+    sink = MemorySink()
+    accumulated_logging(state, trajectories, 2 * log_freq, log_freq, [sink])
+    history = []
+    for _ in range(2 * log_freq):
+        state, (loss, loss_dict) = step(state, trajectories)
+        history.append(dict(jax.device_get(loss_dict), loss=loss.item()))
+    for window, (_, record) in enumerate(sink.records):
+        values = history[window * log_freq:(window + 1) * log_freq]
+        np.testing.assert_allclose(record['loss'], np.mean([v['loss'] for v in values]), rtol=1e-5)
+        np.testing.assert_allclose(record['advantages_max'], np.max([v['advantages_max'] for v in values]), rtol=1e-6)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--log-freq', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--repeats', type=int, default=3)
+    cmd_args = parser.parse_args()
+
+    state, trajectories = make_loop(cmd_args.batch_size)
+    check_window_means(state, trajectories, cmd_args.log_freq)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'metrics.jsonl')
+        synchronous_logging(state, trajectories, cmd_args.log_freq, cmd_args.log_freq, path)
+        accumulated_logging(state, trajectories, cmd_args.log_freq, cmd_args.log_freq, [JSONLSink(path)])
+
+        baseline = timeit(
+            lambda: jax.block_until_ready(no_logging(state, trajectories, cmd_args.updates)),
+            cmd_args.repeats) / cmd_args.updates
+        sync = timeit(
+            lambda: jax.block_until_ready(synchronous_logging(
+                state, trajectories, cmd_args.updates, cmd_args.log_freq, path)), cmd_args.repeats) / cmd_args.updates
+        result = {}
+
+        def accumulated():
+            start = time.perf_counter()
+            _, loop_done = accumulated_logging(state, trajectories, cmd_args.updates, cmd_args.log_freq, [JSONLSink(path)])
+            result['loop'] = min(result.get('loop', float('inf')), loop_done - start)
+        timeit(accumulated, cmd_args.repeats)
+        accumulated_loop = result['loop'] / cmd_args.updates
+
+    print(f'no logging:                            {baseline * 1e6:8.1f} us/update')
+    print(f'per-update item() + write (previous):  {sync * 1e6:8.1f} us/update')
+    print(f'accumulator + background logger:       {accumulated_loop * 1e6:8.1f} us/update '
+          f'(one record per {cmd_args.log_freq} updates)')
@@ -0,0 +1,104 @@
+"""
+Observation and reward normalization: stable_baselines3's `VecNormalize` on the host every step (the previous setup
+of the trainer, kept here as the reference) vs raw envs, the policy normalizing on device and
+`utils.normalize_experience` merging the rollout into the statistics of the `TrainState` once per update.
+Wall time of an update (rollout + normalization + GAE + gradient step). The batch statistics are first checked
+against VecNormalize's per-step running statistics on the same stream of steps.
+
+    python benchmarks/bench_normalization.py --num-envs 4 16 --shared-memory
+"""
+import argparse
+import functools
+
+import jax
+import numpy as np
+
+from common import POINT_MASS, make_policy_fn, timeit
+from jax_a2c.a2c import step
+from jax_a2c.env_utils import make_vec_env
+from jax_a2c.normalization import (RETURNS_GAMMA, NormalizationState,
+                                   normalize_obs, normalize_rollout)
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.utils import (RolloutBuffer, collect_experience,
+                           create_train_state, normalize_experience,
+                           process_experience)
+
+
+def check_statistics(num_steps=64, num_envs=8, obs_dim=17, num_rollouts=3):
+    from stable_baselines3.common.running_mean_std import RunningMeanStd
+
+    rng = np.random.RandomState(0)
+    obs_rms, ret_rms, returns = RunningMeanStd(shape=(obs_dim,)), RunningMeanStd(shape=()), np.zeros(num_envs)
+    state = NormalizationState.create((obs_dim,), num_envs)
+    for _ in range(num_rollouts):
+        observations = (3 * rng.randn(num_steps, num_envs, obs_dim) + 1).astype(np.float32)
+        rewards = rng.randn(num_steps, num_envs).astype(np.float32)
+        dones = rng.uniform(size=(num_steps, num_envs)) < .02
+        for t in range(num_steps):
+            # VecNormalize.step_wait
+            obs_rms.update(observations[t])
+            returns = returns * RETURNS_GAMMA + rewards[t]
+            ret_rms.update(returns)
+            returns[dones[t]] = 0
+        state, _, _ = normalize_rollout(state, observations, rewards, dones)
+    for rms, reference in ((state.obs_rms, obs_rms), (state.ret_rms, ret_rms)):
+        np.testing.assert_allclose(rms.mean, reference.mean, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(rms.var, reference.var, rtol=1e-4)
+        np.testing.assert_allclose(rms.count, reference.count)
+    np.testing.assert_allclose(state.returns, returns, rtol=1e-4, atol=1e-5)
+
+
+def seconds_per_update(
+        env_name: str, num_envs: int, num_steps: int, native: bool, shared_memory: bool = False,
+        num_updates: int = 10) -> float:
+    envs = make_vec_env(
+        name=env_name, num=num_envs, seed=0, shared_memory=shared_memory, norm_obs=not native, norm_r=not native)
+    try:
+        model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=envs.action_space.shape[0], init_log_std=0.)
+        state = create_train_state(
+            jax.random.PRNGKey(0), model, envs, learning_rate=1e-3, decaying_lr=False, max_norm=.5, decay=.99, eps=1e-5)
+        sample = make_policy_fn(state.apply_fn)
+
+        @jax.jit
+        def normalized_policy_fn(prngkey, observation, params, obs_rms):
+            return sample(prngkey, normalize_obs(obs_rms, observation), params)
+
+        buffer = RolloutBuffer.from_envs(envs, num_steps)
+        carry = dict(state=state, next_obs_and_dones=(envs.reset(), np.zeros(num_envs, dtype=bool)))
+
+        def update():
+            state = carry['state']
+            if native:
+                policy_fn = functools.partial(
+                    normalized_policy_fn, params=state.params, obs_rms=state.norm_state.obs_rms)
+            else:
+                policy_fn = functools.partial(sample, params=state.params)
+            carry['next_obs_and_dones'], experience = collect_experience(
+                jax.random.PRNGKey(0), carry['next_obs_and_dones'], envs, num_steps=num_steps, policy_fn=policy_fn,
+                buffer=buffer)
+            if native:
+                state, experience = normalize_experience(state, experience)
+            trajectories = process_experience(experience, gamma=.99, lambda_=.95)
+            carry['state'], (loss, _) = step(state, trajectories)
+            loss.block_until_ready()
+
+        update()
+        return timeit(lambda: [update() for _ in range(num_updates)], 3) / num_updates
+    finally:
+        envs.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default=POINT_MASS)
+    parser.add_argument('--num-envs', type=int, nargs='+', default=[4, 16])
+    parser.add_argument('--num-steps', type=int, default=32)
+    parser.add_argument('--shared-memory', action='store_true')
+    cmd_args = parser.parse_args()
+
+    check_statistics()
+    for num_envs in cmd_args.num_envs:
+        host = seconds_per_update(cmd_args.env, num_envs, cmd_args.num_steps, False, cmd_args.shared_memory)
+        native = seconds_per_update(cmd_args.env, num_envs, cmd_args.num_steps, True, cmd_args.shared_memory)
+        print(f'num_envs={num_envs:3d}  VecNormalize: {host * 1e3:7.2f} ms/update  '
+              f'in the train state: {native * 1e3:7.2f} ms/update  speedup: {host / native:.2f}x')
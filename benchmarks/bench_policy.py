@@ -0,0 +1,60 @@
+"""
+Policy inference latency vs batch size for the default two-tower `DiagGaussianPolicy`,
+the fused variant (one matmul per layer, log stds not repeated) and the shared-trunk variant.
+The fused policy is first checked to reproduce the default one with converted parameters.
+
+    python benchmarks/bench_policy.py --batch-sizes 1 4 16 64 256 1024
+"""
+import argparse
+
+import jax
+import numpy as np
+
+from common import timeit
+from jax_a2c.policy import POLICIES, fuse_params, make_policy
+
+
+def check_parity(hidden_sizes, obs_dim, action_dim):
+    observations = jax.random.normal(jax.random.PRNGKey(1), (32, obs_dim))
+    default = make_policy('separate', hidden_sizes, action_dim, 0.)
+    fused = make_policy('fused', hidden_sizes, action_dim, 0.)
+    params = default.init(jax.random.PRNGKey(0), observations)['params']
+    values, (means, log_stds) = default.apply({'params': params}, observations)
+    fused_values, (fused_means, fused_log_stds) = fused.apply(
+        {'params': fuse_params(params, len(hidden_sizes))}, observations)
+    np.testing.assert_allclose(fused_values, values, atol=1e-5)
+    np.testing.assert_allclose(fused_means, means, atol=1e-5)
+    np.testing.assert_allclose(np.broadcast_to(fused_log_stds, log_stds.shape), log_stds)
+
+
+def latency(kind, hidden_sizes, obs_dim, action_dim, batch_size, repeats, calls=100) -> float:
+    """ Seconds per jitted forward pass, including the transfer of a numpy batch like in the rollout loop """
+    model = make_policy(kind, hidden_sizes, action_dim, 0.)
+    observations = np.random.randn(batch_size, obs_dim).astype(np.float32)
+    params = model.init(jax.random.PRNGKey(0), observations)['params']
+    apply_fn = jax.jit(model.apply)
+    jax.block_until_ready(apply_fn({'params': params}, observations))
+
+    def run():
+        for _ in range(calls):
+            jax.block_until_ready(apply_fn({'params': params}, observations))
+    return timeit(run, repeats) / calls
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16, 64, 256, 1024])
+    parser.add_argument('--hidden-sizes', type=int, nargs='+', default=[64, 64])
+    parser.add_argument('--obs-dim', type=int, default=17)
+    parser.add_argument('--action-dim', type=int, default=6)
+    parser.add_argument('--repeats', type=int, default=5)
+    cmd_args = parser.parse_args()
+    hidden_sizes = tuple(cmd_args.hidden_sizes)
+
+    check_parity(hidden_sizes, cmd_args.obs_dim, cmd_args.action_dim)
+    print('batch  ' + ''.join(f'{kind:>16s}' for kind in POLICIES))
+    for batch_size in cmd_args.batch_sizes:
+        times = [
+            latency(kind, hidden_sizes, cmd_args.obs_dim, cmd_args.action_dim, batch_size, cmd_args.repeats)
+            for kind in POLICIES]
+        print(f'{batch_size:5d}  ' + ''.join(f'{t * 1e6:13.1f} us' for t in times))
@@ -0,0 +1,88 @@
+"""
+Mixed precision on a pure-JAX environment: learning curves and training throughput of float32 vs bfloat16
+compute (`--compute-dtype`). Parameters, RMSprop statistics, log probs and entropies stay float32 in both runs,
+only the forward passes and the rollout observations stored by the scan change dtype.
+
+    python benchmarks/bench_precision.py --env Pendulum --num-envs 64 --num-updates 500
+"""
+import argparse
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from common import timeit
+from jax_a2c.jax_envs import JaxVecEnv
+from jax_a2c.jax_rollout import RolloutConfig, evaluate, init_runner, train
+from jax_a2c.policy import make_policy
+from jax_a2c.utils import create_train_state
+
+
+def _create(env_name, num_envs, num_steps, compute_dtype, hidden_sizes, seed):
+    envs = JaxVecEnv(env_name, num=num_envs, seed=seed)
+    model = make_policy(
+        'separate', hidden_sizes, envs.action_space.shape[0], init_log_std=0., dtype=jnp.dtype(compute_dtype))
+    state = create_train_state(
+        jax.random.PRNGKey(seed), model, envs, learning_rate=7e-4, decaying_lr=False, max_norm=.5, decay=.99, eps=1e-5)
+    runner = init_runner(jax.random.PRNGKey(seed + 1), envs.env, state, num_envs)
+    return envs, runner, RolloutConfig(num_steps=num_steps, compute_dtype=compute_dtype)
+
+
+def learning_curve(env_name, num_envs, num_steps, num_updates, eval_every, compute_dtype, hidden_sizes, seed):
+    envs, runner, config = _create(env_name, num_envs, num_steps, compute_dtype, hidden_sizes, seed)
+    curve = []
+    for update in range(0, num_updates + 1, eval_every):
+        score = evaluate(
+            runner.train_state.apply_fn, envs.env, runner.train_state.params, runner.norm_state.obs_rms,
+            jax.random.PRNGKey(update), num_envs)
+        curve.append((update, score.item()))
+        if update < num_updates:
+            runner, _ = train(runner, envs.env, config, eval_every)
+    return curve
+
+
+def steps_per_second(env_name, num_envs, num_steps, num_updates, compute_dtype, hidden_sizes) -> float:
+    envs, runner, config = _create(env_name, num_envs, num_steps, compute_dtype, hidden_sizes, 0)
+
+    def run():
+        jax.block_until_ready(train(runner, envs.env, config, num_updates))
+
+    run()
+    return num_envs * num_steps * num_updates / timeit(run, 3)
+
+
+def rollout_observation_bytes(obs_dim, num_envs, num_steps, compute_dtype) -> int:
+    """ Observations of one rollout as stored by the scan (`jax_rollout.RolloutConfig.compute_dtype`) """
+    return num_steps * num_envs * obs_dim * jnp.dtype(compute_dtype).itemsize
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default='Pendulum')
+    parser.add_argument('--num-envs', type=int, default=64)
+    parser.add_argument('--num-steps', type=int, default=16)
+    parser.add_argument('--num-updates', type=int, default=500)
+    parser.add_argument('--eval-every', type=int, default=50)
+    parser.add_argument('--hidden-sizes', type=int, nargs='+', default=[64, 64])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2])
+    cmd_args = parser.parse_args()
+    hidden_sizes = tuple(cmd_args.hidden_sizes)
+    dtypes = ('float32', 'bfloat16')
+
+    curves = {
+        dtype: np.array([
+            learning_curve(cmd_args.env, cmd_args.num_envs, cmd_args.num_steps, cmd_args.num_updates,
+                           cmd_args.eval_every, dtype, hidden_sizes, seed)
+            for seed in cmd_args.seeds])
+        for dtype in dtypes}
+    print(f'eval return, mean over seeds {cmd_args.seeds}')
+    print('update  ' + ''.join(f'{dtype:>12s}' for dtype in dtypes))
+    for i, update in enumerate(curves['float32'][0, :, 0]):
+        print(f'{int(update):6d}  ' + ''.join(f'{curves[dtype][:, i, 1].mean():12.1f}' for dtype in dtypes))
+
+    envs = JaxVecEnv(cmd_args.env, num=1)
+    obs_dim = envs.observation_space.shape[0]
+    for dtype in dtypes:
+        speed = steps_per_second(cmd_args.env, cmd_args.num_envs, cmd_args.num_steps, 50, dtype, hidden_sizes)
+        memory = rollout_observation_bytes(obs_dim, cmd_args.num_envs, cmd_args.num_steps, dtype)
+        print(f'{dtype:>8s}: {speed:10.0f} steps/s  rollout observations {memory / 1024:.1f} KiB')
@@ -0,0 +1,68 @@
+"""
+Overhead of `profiling.Profiler` on a training update (rollout + GAE + gradient step): disabled (the default
+no-op phases), enabled and enabled with fencing. Prints the phase table of the fenced run.
+
+    python benchmarks/bench_profiler.py --num-envs 16 --shared-memory
+"""
+import argparse
+import functools
+
+import jax
+import numpy as np
+
+from common import POINT_MASS_SLOW, make_policy_fn, timeit
+from jax_a2c.a2c import step
+from jax_a2c.env_utils import make_vec_env
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.profiling import Profiler
+from jax_a2c.utils import (RolloutBuffer, collect_experience,
+                           create_train_state, process_experience)
+
+
+def seconds_per_update(envs, num_envs: int, num_steps: int, profiler: Profiler, num_updates: int = 10) -> float:
+    model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=envs.action_space.shape[0], init_log_std=0.)
+    state = create_train_state(
+        jax.random.PRNGKey(0), model, envs, learning_rate=1e-3, decaying_lr=False, max_norm=.5, decay=.99, eps=1e-5)
+    _policy_fn = make_policy_fn(state.apply_fn)
+    buffer = RolloutBuffer.from_envs(envs, num_steps)
+    carry = dict(state=state, next_obs_and_dones=(envs.reset(), np.zeros(num_envs, dtype=bool)))
+
+    def update():
+        policy_fn = functools.partial(_policy_fn, params=carry['state'].params)
+        carry['next_obs_and_dones'], experience = collect_experience(
+            jax.random.PRNGKey(0), carry['next_obs_and_dones'], envs, num_steps=num_steps, policy_fn=policy_fn,
+            buffer=buffer, profiler=profiler)
+        profiler.env_steps(num_envs * num_steps)
+        with profiler.phase('process_experience') as phase:
+            trajectories = process_experience(experience, gamma=.99, lambda_=.95)
+            phase.fence(trajectories)
+        with profiler.phase('update') as phase:
+            carry['state'], (loss, _) = step(carry['state'], trajectories)
+            phase.fence(loss)
+        loss.block_until_ready()
+
+    update()
+    return timeit(lambda: [update() for _ in range(num_updates)]) / num_updates
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default=POINT_MASS_SLOW)
+    parser.add_argument('--num-envs', type=int, default=16)
+    parser.add_argument('--num-steps', type=int, default=32)
+    parser.add_argument('--shared-memory', action='store_true')
+    cmd_args = parser.parse_args()
+
+    envs = make_vec_env(name=cmd_args.env, num=cmd_args.num_envs, seed=0, shared_memory=cmd_args.shared_memory)
+    try:
+        baseline = None
+        for name, kwargs in (('disabled', dict(enabled=False)), ('enabled', {}), ('fenced', dict(fence=True))):
+            profiler = Profiler(envs=envs, **kwargs)
+            seconds = seconds_per_update(envs, cmd_args.num_envs, cmd_args.num_steps, profiler)
+            baseline = baseline or seconds
+            print(f'profiler {name:8s}  {1000 * seconds:8.2f} ms/update  overhead: {100 * (seconds / baseline - 1):+.1f}%')
+            summary = profiler.summary()
+            profiler.close()
+        print(summary)
+    finally:
+        envs.close()
@@ -0,0 +1,137 @@
+"""
+Trajectory recording (`jax_a2c/recording.py`): checks that a recording reads back exactly (growing files, update and
+env selection, appending to an existing recording, shape mismatches), then the cost of recording every update in the
+training loop: seconds per update (rollout, normalization, GAE, gradient step) without and with a recorder, measured
+in interleaved blocks so machine noise hits both alike.
+
+    python benchmarks/bench_recorder.py --num-envs 64 --num-updates 300
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import jax
+import numpy as np
+
+from common import POINT_MASS, make_policy_fn
+from jax_a2c.a2c import step
+from jax_a2c.env_utils import make_vec_env
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.recording import TrajectoryReader, TrajectoryRecorder
+from jax_a2c.utils import (RolloutBuffer, collect_experience,
+                           create_train_state, normalize_experience,
+                           process_experience)
+
+
+def fake_update(rng, num_steps=4, num_envs=5):
+    return (
+        rng.randn(num_steps, num_envs, 3).astype(np.float32), rng.randn(num_steps, num_envs, 2).astype(np.float32),
+        rng.randn(num_steps, num_envs).astype(np.float32), rng.randn(num_steps + 1, num_envs).astype(np.float32),
+        rng.rand(num_steps + 1, num_envs) < .1), rng.randn(num_steps * num_envs).astype(np.float32)
+
+
+def check_roundtrip(directory):
+    rng = np.random.RandomState(0)
+    # more updates than the initial file capacity, device and host arrays
+    written = {2 * i: fake_update(rng) for i in range(40)}
+    recorder = TrajectoryRecorder(directory)
+    for update, (experience, advantages) in written.items():
+        if update % 4:
+            experience, advantages = jax.device_put((experience, advantages))
+        recorder.record(update, experience, advantages)
+    recorder.close()
+
+    reader = TrajectoryReader(directory)
+    assert len(reader) == 40 and list(reader.updates) == list(written)
+    assert reader.fields == ('observations', 'actions', 'rewards', 'values', 'dones', 'advantages')
+    for update, (experience, advantages) in written.items():
+        recorded = reader.update(update)
+        for name, array in zip(reader.fields, experience + (advantages.reshape(4, 5),)):
+            np.testing.assert_array_equal(recorded[name], array)
+    envs = reader.envs(slice(1, 3))
+    np.testing.assert_array_equal(envs['observations'][5], written[10][0][0][:, 1:3])
+    np.testing.assert_array_equal(reader.envs(4)['dones'][:, :, 0], np.stack([e[4][:, 4] for e, _ in written.values()]))
+    assert isinstance(reader['rewards'], np.memmap)
+
+    # resumed runs append, a repeated update reads as its latest recording
+    recorder = TrajectoryRecorder(directory)
+    again = fake_update(rng)
+    recorder.record(78, *again)
+    recorder.close()
+    reader = TrajectoryReader(directory)
+    assert len(reader) == 41
+    np.testing.assert_array_equal(reader.update(78)['observations'], again[0][0])
+
+    recorder = TrajectoryRecorder(directory)
+    recorder.record(80, *fake_update(rng, num_envs=6))
+    try:
+        recorder.close()
+        raise AssertionError('a shape mismatch was not reported')
+    except RuntimeError:
+        pass
+
+
+def update_seconds(num_envs, num_steps, num_updates, directory=None, block=20):
+    """ Seconds per update over `num_updates`, in alternating blocks without and with a recorder """
+    envs = make_vec_env(
+        POINT_MASS, num=num_envs, seed=0, norm_obs=False, norm_r=False, shared_memory=True,
+        envs_per_worker=max(1, num_envs // 4))
+    try:
+        model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=6, init_log_std=0.)
+        state = create_train_state(
+            jax.random.PRNGKey(0), model, envs, learning_rate=1e-3, decaying_lr=False, max_norm=.5, decay=.99,
+            eps=1e-5)
+        policy_fn = make_policy_fn(model.apply)
+        buffer = RolloutBuffer.from_envs(envs, num_steps)
+        next_obs = envs.reset()
+        carry = [state, (next_obs, np.zeros(num_envs, bool)), jax.random.PRNGKey(0)]
+
+        def run_block(update, recorder):
+            state, next_obs_and_dones, prngkey = carry
+            for u in range(update, update + block):
+                prngkey, key = jax.random.split(prngkey)
+                next_obs_and_dones, experience = collect_experience(
+                    key, next_obs_and_dones, envs, num_steps, lambda k, o: policy_fn(k, o, state.params), buffer)
+                state, normalized = normalize_experience(state, experience)
+                trajectories = process_experience(normalized)
+                state, (loss, _) = step(state, trajectories)
+                if recorder is not None:
+                    recorder.record(u, experience, trajectories[3])
+            loss.block_until_ready()
+            carry[:] = state, next_obs_and_dones, prngkey
+
+        run_block(0, None)
+        recorder = TrajectoryRecorder(directory)
+        times = {False: [], True: []}
+        for i in range(num_updates // block):
+            for recording in (False, True):
+                start = time.perf_counter()
+                run_block(block * (2 * i + recording), recorder if recording else None)
+                times[recording].append((time.perf_counter() - start) / block)
+        start = time.perf_counter()
+        recorder.close()
+        close_seconds = time.perf_counter() - start
+        return np.median(times[False]), np.median(times[True]), close_seconds, TrajectoryReader(directory)
+    finally:
+        envs.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, nargs='+', default=[64])
+    parser.add_argument('--num-steps', type=int, default=32)
+    parser.add_argument('--num-updates', type=int, default=300)
+    cmd_args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        check_roundtrip(os.path.join(directory, 'check'))
+    print('recording round trip, append and mismatch checks passed')
+    for num_envs in cmd_args.num_envs:
+        with tempfile.TemporaryDirectory() as directory:
+            plain, recorded, close_seconds, reader = update_seconds(
+                num_envs, cmd_args.num_steps, cmd_args.num_updates, directory)
+            size = sum(os.path.getsize(os.path.join(directory, f'{name}.bin')) for name in reader.fields)
+            print(f'num_envs={num_envs:4d}  update without recording {1e3 * plain:7.2f} ms  with {1e3 * recorded:7.2f} ms  '
+                  f'overhead {recorded / plain - 1:+6.1%}  ({len(reader)} updates, {size / len(reader) / 1024:.0f} KiB '
+                  f'per update, close {1e3 * close_seconds:.0f} ms)')
@@ -0,0 +1,109 @@
+"""
+Env state snapshots (`env_utils.get_flat_state` / `SubprocVecEnv.restart` / `set_reset_pool`): checks that restarting
+envs from captured states reproduces them exactly, that pool resets only draw pool states and that evaluation from
+fixed start states is reproducible. Then env steps/s of a rollout with short episodes and an expensive `env.reset()`
+(`POINT_MASS_SLOW_RESET` busy-waits 5ms per reset, like scene generation or settling steps would) with regular
+resets vs resets from a pool of start states captured once.
+
+    python benchmarks/bench_reset_pool.py --num-envs 4 16
+"""
+import argparse
+
+import jax
+import numpy as np
+
+from common import POINT_MASS, POINT_MASS_SLOW_RESET, timeit
+from jax_a2c.env_utils import collect_start_states, make_vec_env
+from jax_a2c.evaluation import evaluate_episodes
+from jax_a2c.policy import DiagGaussianPolicy
+
+
+def check_restart(num_envs=4, num_steps=20):
+    rng = np.random.RandomState(0)
+    source = make_vec_env(POINT_MASS, num=num_envs, seed=0, norm_obs=False, norm_r=False)
+    target = make_vec_env(POINT_MASS, num=num_envs, seed=1, norm_obs=False, norm_r=False, shared_memory=True)
+    try:
+        source.reset()
+        target.reset()
+        for _ in range(num_steps):
+            source.step(rng.uniform(-1, 1, (num_envs, 6)))
+        states = source.get_flat_state()
+        # the stand-in's state is its observation and the steps left
+        np.testing.assert_array_equal(target.restart(states), states[:, :-1])
+        np.testing.assert_array_equal(target.get_flat_state(), states)
+        # both continue identically
+        for _ in range(num_steps):
+            # float32 like the shared memory action buffer
+            actions = rng.uniform(-1, 1, (num_envs, 6)).astype(np.float32)
+            np.testing.assert_array_equal(source.step(actions)[0], target.step(actions)[0])
+    finally:
+        source.close()
+        target.close()
+
+
+def check_reset_pool(num_envs=4, num_steps=300):
+    envs = make_vec_env(POINT_MASS_SLOW_RESET, num=num_envs, seed=0, norm_obs=False, norm_r=False)
+    try:
+        pool = np.concatenate([100 + np.arange(8)[:, None] * np.ones((8, 17)), np.full((8, 1), 30)], axis=1)
+        envs.set_reset_pool(pool, seed=0)
+        observations = envs.reset()
+        assert np.isin(observations[:, 0], pool[:, 0]).all()
+        restarts = 0
+        for _ in range(num_steps):
+            observations, _, dones, infos = envs.step(np.zeros((num_envs, 6)))
+            assert np.isin(observations[dones, 0], pool[:, 0]).all()
+            restarts += dones.sum()
+        assert restarts > 0
+        envs.set_reset_pool(None)
+        assert not np.isin(envs.reset()[:, 0], pool[:, 0]).any()
+    finally:
+        envs.close()
+
+
+def check_deterministic_eval(num_envs=4):
+    envs = make_vec_env(POINT_MASS_SLOW_RESET, num=num_envs, seed=0, norm_obs=False, norm_r=False)
+    try:
+        model = DiagGaussianPolicy(hidden_sizes=(16,), action_dim=6, init_log_std=0.)
+        params = model.init(jax.random.PRNGKey(0), np.zeros((1, 17), np.float32))['params']
+        start_states = collect_start_states(envs, num_envs)
+        with_starts = [
+            evaluate_episodes(model.apply, params, envs, num_episodes=2 * num_envs, start_states=start_states).returns
+            for _ in range(2)]
+        np.testing.assert_array_equal(*with_starts)
+        without = [evaluate_episodes(model.apply, params, envs, num_episodes=2 * num_envs).returns for _ in range(2)]
+        assert not np.array_equal(*without)
+    finally:
+        envs.close()
+
+
+def steps_per_second(num_envs: int, use_pool: bool, num_steps: int = 400) -> float:
+    envs = make_vec_env(POINT_MASS_SLOW_RESET, num=num_envs, seed=0, norm_obs=False, norm_r=False)
+    try:
+        if use_pool:
+            envs.set_reset_pool(collect_start_states(envs, 64), seed=0)
+        envs.reset()
+        actions = np.random.RandomState(0).uniform(-1, 1, (num_steps, num_envs, 6))
+
+        def rollout():
+            for t in range(num_steps):
+                envs.step(actions[t])
+        rollout()
+        return num_envs * num_steps / timeit(rollout, 3)
+    finally:
+        envs.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, nargs='+', default=[4, 16])
+    cmd_args = parser.parse_args()
+
+    check_restart()
+    check_reset_pool()
+    check_deterministic_eval()
+    print('restart, reset pool and deterministic evaluation checks passed')
+    for num_envs in cmd_args.num_envs:
+        regular = steps_per_second(num_envs, False)
+        pooled = steps_per_second(num_envs, True)
+        print(f'num_envs={num_envs:3d}  env.reset(): {regular:8.0f} steps/s  reset pool: {pooled:8.0f} steps/s  '
+              f'speedup: {pooled / regular:.2f}x')
@@ -0,0 +1,68 @@
+"""
+Wall time of one training update (rollout + GAE + gradient step) with the sequential
+`collect_experience` and the pipelined `collect_experience_pipelined` for several group counts.
+
+    python benchmarks/bench_rollout.py --num-envs 16 --num-groups 1 2 4
+"""
+import argparse
+import functools
+
+import jax
+import numpy as np
+
+from common import POINT_MASS_SLOW, make_policy_fn, timeit
+from jax_a2c.a2c import step
+from jax_a2c.env_utils import make_vec_env
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.utils import (RolloutBuffer, collect_experience,
+                           collect_experience_pipelined, create_train_state,
+                           process_experience)
+
+
+def seconds_per_update(
+        env_name: str, num_envs: int, num_steps: int, num_groups: int,
+        hidden_sizes=(64, 64), shared_memory: bool = False, num_updates: int = 5) -> float:
+    envs = make_vec_env(name=env_name, num=num_envs, seed=0, shared_memory=shared_memory, num_groups=num_groups)
+    try:
+        model = DiagGaussianPolicy(
+            hidden_sizes=hidden_sizes, action_dim=envs.action_space.shape[0], init_log_std=0.)
+        state = create_train_state(
+            jax.random.PRNGKey(0), model, envs, learning_rate=1e-3, decaying_lr=False,
+            max_norm=.5, decay=.99, eps=1e-5)
+        _policy_fn = make_policy_fn(state.apply_fn)
+        collect = collect_experience_pipelined if num_groups > 1 else collect_experience
+        buffer = RolloutBuffer.from_envs(envs, num_steps)
+        next_obs = envs.reset()
+        carry = dict(state=state, next_obs_and_dones=(next_obs, np.zeros(num_envs, dtype=bool)))
+
+        def update():
+            prngkey = jax.random.PRNGKey(0)
+            policy_fn = functools.partial(_policy_fn, params=carry['state'].params)
+            carry['next_obs_and_dones'], experience = collect(
+                prngkey, carry['next_obs_and_dones'], envs, num_steps=num_steps, policy_fn=policy_fn,
+                buffer=buffer)
+            trajectories = process_experience(experience, gamma=.99, lambda_=.95)
+            carry['state'], (loss, _) = step(carry['state'], trajectories)
+            loss.block_until_ready()
+
+        update()
+        return timeit(lambda: [update() for _ in range(num_updates)]) / num_updates
+    finally:
+        envs.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default=POINT_MASS_SLOW)
+    parser.add_argument('--num-envs', type=int, default=16)
+    parser.add_argument('--num-steps', type=int, default=32)
+    parser.add_argument('--num-groups', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--shared-memory', action='store_true')
+    cmd_args = parser.parse_args()
+
+    baseline = None
+    for num_groups in cmd_args.num_groups:
+        seconds = seconds_per_update(
+            cmd_args.env, cmd_args.num_envs, cmd_args.num_steps, num_groups, shared_memory=cmd_args.shared_memory)
+        baseline = baseline or seconds
+        print(f'num_groups={num_groups:2d}  {1000 * seconds:8.1f} ms/update  speedup: {baseline / seconds:.2f}x')
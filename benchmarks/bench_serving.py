@@ -0,0 +1,129 @@
+"""
+Load generator for `serving.PolicyServer`: `num_clients` concurrent clients, each sending its next observation as soon
+as the previous action arrived (or, with `--rate`, requests arriving at random at a fixed rate regardless of responses),
+against a server without batching (one forward pass per request, the reference) and with dynamic batching.
+Reports latency percentiles, throughput and the mean batch size.
+The server is loaded from a checkpoint written by `saving.save_state` and first checked against `deterministic_policy`.
+
+    python benchmarks/bench_serving.py --num-clients 1 8 64 --duration 3
+    python benchmarks/bench_serving.py --rate 2000 20000 --max-delay 0 1e-3
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import jax
+import numpy as np
+
+from common import timeit
+from jax_a2c.evaluation import deterministic_policy
+from jax_a2c.normalization import RunningMeanStd
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.saving import save_state
+from jax_a2c.serving import PolicyServer
+from jax_a2c.utils import create_train_state
+
+
+class _Envs:
+    def __init__(self, obs_dim):
+        self.obs_dim = obs_dim
+
+    def reset(self):
+        return np.zeros((4, self.obs_dim), np.float32)
+
+
+def write_checkpoint(path, model, obs_dim):
+    state = create_train_state(
+        jax.random.PRNGKey(0), model, _Envs(obs_dim), learning_rate=1e-3, decaying_lr=False, max_norm=.5,
+        decay=.99, eps=1e-5)
+    rng = np.random.RandomState(0)
+    obs_rms = RunningMeanStd(
+        mean=rng.randn(obs_dim).astype(np.float32), var=rng.uniform(.5, 2, obs_dim).astype(np.float32),
+        count=np.float32(1e4))
+    state = state.replace(norm_state=state.norm_state.replace(obs_rms=obs_rms))
+    save_state(path, state, {})
+    return state
+
+
+async def check_parity(server, state, obs_dim, num_requests=37):
+    observations = np.random.RandomState(1).randn(num_requests, obs_dim).astype(np.float32)
+    server.start()
+    actions = await asyncio.gather(*[server.act(obs) for obs in observations])
+    await server.close()
+    expected = deterministic_policy(state.apply_fn, state.params, observations, state.norm_state.obs_rms)
+    np.testing.assert_allclose(np.stack(actions), expected, rtol=1e-5, atol=1e-6)
+
+
+async def closed_loop(server, num_clients, duration, obs_dim):
+    server.start()
+    stop = time.perf_counter() + duration
+
+    async def client(seed):
+        rng = np.random.RandomState(seed)
+        while time.perf_counter() < stop:
+            await server.act(rng.randn(obs_dim).astype(np.float32))
+
+    # warm-up, then measure
+    await asyncio.gather(*[server.act(np.zeros(obs_dim, np.float32)) for _ in range(num_clients)])
+    server.reset_stats()
+    await asyncio.gather(*[client(seed) for seed in range(num_clients)])
+    stats = server.stats()
+    await server.close()
+    return stats
+
+
+async def open_loop(server, rate, duration, obs_dim):
+    """ Poisson arrivals at `rate` requests/s """
+    server.start()
+    await server.act(np.zeros(obs_dim, np.float32))
+    server.reset_stats()
+    rng = np.random.RandomState(0)
+    requests = []
+    start = next_arrival = time.perf_counter()
+    while next_arrival < start + duration:
+        next_arrival += rng.exponential(1 / rate)
+        await asyncio.sleep(max(next_arrival - time.perf_counter(), 0.))
+        requests.append(asyncio.ensure_future(server.act(rng.randn(obs_dim).astype(np.float32))))
+    await asyncio.gather(*requests)
+    stats = server.stats()
+    await server.close()
+    return stats
+
+
+def report(load, name, stats):
+    print(f'{load}  {name:20s}  {stats["requests_per_sec"]:9.0f} requests/s  '
+          f'p50 {stats["latency_ms_p50"]:7.2f} ms  p99 {stats["latency_ms_p99"]:7.2f} ms  '
+          f'mean batch {stats["mean_batch_size"]:6.1f}  padding {stats["padding"]:.0%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-clients', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--rate', type=float, nargs='+', default=None, help='open-loop arrival rates instead of clients')
+    parser.add_argument('--duration', type=float, default=3.)
+    parser.add_argument('--max-delay', type=float, nargs='+', default=[0.])
+    parser.add_argument('--hidden-sizes', type=int, nargs='+', default=[64, 64])
+    parser.add_argument('--obs-dim', type=int, default=17)
+    parser.add_argument('--action-dim', type=int, default=6)
+    cmd_args = parser.parse_args()
+
+    model = DiagGaussianPolicy(hidden_sizes=tuple(cmd_args.hidden_sizes), action_dim=cmd_args.action_dim, init_log_std=0.)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'checkpoint')
+        state = write_checkpoint(path, model, cmd_args.obs_dim)
+        load_seconds = timeit(lambda: PolicyServer.from_checkpoint(path, model, cmd_args.obs_dim))
+        asyncio.run(check_parity(PolicyServer.from_checkpoint(path, model, cmd_args.obs_dim), state, cmd_args.obs_dim))
+        print(f'checkpoint load + compile of all buckets: {load_seconds:.2f}s')
+
+        configurations = [('unbatched', dict(batch_sizes=(1,), max_delay=0.))] + [
+            (f'batched, delay {max_delay * 1e3:g} ms', dict(max_delay=max_delay)) for max_delay in cmd_args.max_delay]
+        if cmd_args.rate:
+            loads = [(f'rate={rate:8.0f}/s', open_loop, rate) for rate in cmd_args.rate]
+        else:
+            loads = [(f'clients={n:4d}', closed_loop, n) for n in cmd_args.num_clients]
+        for load, generate, amount in loads:
+            for name, kwargs in configurations:
+                server = PolicyServer.from_checkpoint(path, model, cmd_args.obs_dim, **kwargs)
+                report(load, name, asyncio.run(generate(server, amount, cmd_args.duration, cmd_args.obs_dim)))
@@ -0,0 +1,59 @@
+"""
+SubprocVecEnv step throughput: Pipe transport vs shared memory transport,
+for a range of environment counts and environments per worker process.
+
+    python benchmarks/bench_vec_env.py --num-envs 4 16 64 --envs-per-worker 1 4
+"""
+import argparse
+
+import numpy as np
+
+from common import POINT_MASS, timeit
+from jax_a2c.env_utils import SubprocVecEnv, make_env_fn
+
+
+def steps_per_second(
+        env_name: str, num_envs: int, num_steps: int, shared_memory: bool, envs_per_worker: int = 1) -> float:
+    envs = SubprocVecEnv(
+        [make_env_fn(name=env_name, seed=i) for i in range(num_envs)],
+        shared_memory=shared_memory, envs_per_worker=envs_per_worker)
+    try:
+        envs.reset()
+        actions = np.random.uniform(-1, 1, size=(num_steps, num_envs) + envs.action_space.shape)
+        actions = actions.astype(envs.action_space.dtype)
+
+        def rollout():
+            for step_actions in actions:
+                envs.step(step_actions)
+
+        rollout()
+        return num_envs * num_steps / timeit(rollout, repeats=3)
+    finally:
+        envs.close()
+
+
+def run(env_name: str = POINT_MASS, num_envs=(4, 16, 64), envs_per_worker=(1,), num_steps: int = 200) -> dict:
+    results = {}
+    for n in num_envs:
+        for k in envs_per_worker:
+            for transport, shared_memory in (('pipe', False), ('shared_memory', True)):
+                results[f'{transport}/num_envs={n}/envs_per_worker={k}'] = steps_per_second(
+                    env_name, n, num_steps, shared_memory, k)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default=POINT_MASS)
+    parser.add_argument('--num-envs', type=int, nargs='+', default=[4, 16, 64])
+    parser.add_argument('--envs-per-worker', type=int, nargs='+', default=[1])
+    parser.add_argument('--num-steps', type=int, default=200)
+    cmd_args = parser.parse_args()
+
+    results = run(cmd_args.env, cmd_args.num_envs, cmd_args.envs_per_worker, cmd_args.num_steps)
+    for n in cmd_args.num_envs:
+        for k in cmd_args.envs_per_worker:
+            pipe = results[f'pipe/num_envs={n}/envs_per_worker={k}']
+            shm = results[f'shared_memory/num_envs={n}/envs_per_worker={k}']
+            print(f'num_envs={n:4d} envs_per_worker={k:3d}  pipe: {pipe:10.0f} steps/s  '
+                  f'shared memory: {shm:10.0f} steps/s  speedup: {shm / pipe:.2f}x')
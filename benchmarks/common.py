@@ -0,0 +1,115 @@
+"""
+Shared helpers for the benchmark scripts: a headless stand-in environment and timing utilities.
+Benchmarks are run from the repository root, e.g. `python benchmarks/bench_vec_env.py`.
+"""
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import gym
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+for path in (ROOT, BENCHMARKS):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+# env workers are forked from a forkserver that preloads this module, so the stand-in envs are registered there too
+os.environ['PYTHONPATH'] = os.pathsep.join(
+    [ROOT, BENCHMARKS] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p])
+mp.set_forkserver_preload(['common'])
+
+POINT_MASS = 'PointMass-v0'
+POINT_MASS_SLOW = 'PointMassSlow-v0'
+POINT_MASS_VARIABLE = 'PointMassVariable-v0'
+POINT_MASS_SLOW_RESET = 'PointMassSlowReset-v0'
+
+
+def _busy_wait(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class PointMassEnv(gym.Env):
+    """
+    HalfCheetah-shaped stand-in (17-dim observations, 6-dim actions) without a simulator.
+    `step_cost` busy-waits for the given number of seconds to emulate physics time, `reset_cost` the same for resets
+    (e.g. scene generation or settling steps), with `episode_lengths=(low, high)` episodes end after a random number
+    of steps. The flat state (`env_utils.get_flat_state`) is the observation and the number of steps left.
+    """
+    def __init__(
+            self, obs_dim: int = 17, action_dim: int = 6, step_cost: float = 0., episode_lengths=None,
+            reset_cost: float = 0.):
+        self.observation_space = gym.spaces.Box(-np.inf, np.inf, shape=(obs_dim,), dtype=np.float64)
+        self.action_space = gym.spaces.Box(-1., 1., shape=(action_dim,), dtype=np.float32)
+        self.step_cost = step_cost
+        self.reset_cost = reset_cost
+        self.episode_lengths = episode_lengths
+        self._projection = np.random.RandomState(0).randn(action_dim, obs_dim) * .1
+        self._rng = np.random.RandomState()
+        self._state = np.zeros(obs_dim)
+        self._steps_left = None
+
+    def seed(self, seed=None):
+        self._rng = np.random.RandomState(seed)
+        return [seed]
+
+    def reset(self):
+        _busy_wait(self.reset_cost)
+        self._state = self._rng.randn(*self.observation_space.shape) * .1
+        if self.episode_lengths is not None:
+            self._steps_left = self._rng.randint(*self.episode_lengths)
+        return self._state.copy()
+
+    def get_flat_state(self):
+        return np.append(self._state, self._steps_left or 0)
+
+    def set_flat_state(self, flat_state):
+        self._state = np.array(flat_state[:-1])
+        if self.episode_lengths is not None:
+            self._steps_left = int(flat_state[-1])
+        return self._state.copy()
+
+    def step(self, action):
+        _busy_wait(self.step_cost)
+        action = np.clip(action, -1., 1.)
+        self._state = .99 * self._state + action @ self._projection
+        reward = float(action[0] - .1 * np.square(action).sum())
+        done = False
+        if self._steps_left is not None:
+            self._steps_left -= 1
+            done = self._steps_left <= 0
+        return self._state.copy(), reward, done, {}
+
+
+gym.register('PointMass-v0', entry_point='common:PointMassEnv', max_episode_steps=1000)
+gym.register(
+    'PointMassSlow-v0', entry_point='common:PointMassEnv', max_episode_steps=1000,
+    kwargs=dict(step_cost=1e-4))
+gym.register(
+    'PointMassVariable-v0', entry_point='common:PointMassEnv', max_episode_steps=1000,
+    kwargs=dict(step_cost=1e-4, episode_lengths=(50, 1000)))
+gym.register(
+    'PointMassSlowReset-v0', entry_point='common:PointMassEnv', max_episode_steps=1000,
+    kwargs=dict(step_cost=1e-4, episode_lengths=(20, 100), reset_cost=5e-3))
+
+
+def timeit(fn, repeats: int = 1) -> float:
+    """ Returns the best wall time of `repeats` calls of `fn`
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_policy_fn(apply_fn):
+    """ The trainer's sampling policy, `builders.make_policy_fn`
+    """
+    from jax_a2c.builders import make_policy_fn as trainer_policy_fn
+
+    return trainer_policy_fn(apply_fn)
@@ -0,0 +1,231 @@
+"""
+Regression suite over the training hot paths, headless on CPU with the stand-in env of `common.py`:
+env stepping, rollout collection, GAE / `process_experience`, the `a2c.step` update, evaluation and checkpoints.
+Results are written as JSON, `--baseline` compares them to an earlier run and exits with status 1 if a metric
+got worse by more than `--tolerance` (relative). Every metric is the best of several repeats,
+compare runs of the same machine and `--quick` setting only.
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --baseline baseline.json --output current.json
+    python benchmarks/suite.py --quick --only gae update
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from bench_checkpoint import make_state
+from bench_gae import compile_seconds, random_rollout, run_seconds
+from bench_vec_env import steps_per_second
+from common import POINT_MASS, ROOT, make_policy_fn, timeit
+from jax_a2c import evaluation
+from jax_a2c.a2c import step
+from jax_a2c.env_utils import make_vec_env
+from jax_a2c.policy import DiagGaussianPolicy
+from jax_a2c.saving import load_state, save_state
+from jax_a2c.utils import (RolloutBuffer, collect_experience,
+                           create_train_state, gae_advantages,
+                           process_experience)
+
+# metric name -> (value, unit); everything not in HIGHER_IS_BETTER is a time
+Results = Dict[str, Tuple[float, str]]
+HIGHER_IS_BETTER = {'steps/s'}
+
+
+def bench_vec_env(quick: bool) -> Results:
+    results = {}
+    for num_envs in (4,) if quick else (4, 16, 64):
+        for transport, shared_memory in (('pipe', False), ('shared_memory', True)):
+            results[f'vec_env/{transport}/num_envs={num_envs}'] = (
+                steps_per_second(POINT_MASS, num_envs, 50 if quick else 200, shared_memory), 'steps/s')
+    return results
+
+
+def bench_collect(quick: bool) -> Results:
+    results = {}
+    num_steps = 32
+    for num_envs in (4,) if quick else (4, 16):
+        envs = make_vec_env(name=POINT_MASS, num=num_envs, seed=0, norm_obs=False, norm_r=False)
+        try:
+            model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=envs.action_space.shape[0], init_log_std=0.)
+            params = model.init(jax.random.PRNGKey(0), envs.reset())['params']
+            policy_fn = functools.partial(make_policy_fn(model.apply), params=params)
+            buffer = RolloutBuffer.from_envs(envs, num_steps)
+            carry = [(envs.reset(), np.zeros(num_envs, dtype=bool))]
+
+            def collect():
+                carry[0], experience = collect_experience(
+                    jax.random.PRNGKey(0), carry[0], envs, num_steps=num_steps, policy_fn=policy_fn, buffer=buffer)
+                jax.block_until_ready(experience)
+
+            collect()
+            results[f'collect/num_envs={num_envs}/num_steps={num_steps}'] = (timeit(collect, 3 if quick else 5), 's')
+        finally:
+            envs.close()
+    return results
+
+
+def bench_gae(quick: bool) -> Results:
+    results = {}
+    num_envs = 16
+    for num_steps in (32, 256) if quick else (32, 256, 2048):
+        rollout = random_rollout(num_steps, num_envs)
+        kernel = functools.partial(gae_advantages, method='scan')
+        results[f'gae/num_steps={num_steps}/compile'] = (compile_seconds(kernel, rollout), 's')
+        results[f'gae/num_steps={num_steps}/run'] = (run_seconds(kernel, rollout, 20), 's')
+
+        rewards, masks, values = rollout
+        experience = (
+            jnp.zeros((num_steps, num_envs, 17)), jnp.zeros((num_steps, num_envs, 6)),
+            rewards, values, masks < .5)
+        start = time.perf_counter()
+        process_experience.lower(experience, .99, .95, 'scan').compile()
+        results[f'process_experience/num_steps={num_steps}/compile'] = (time.perf_counter() - start, 's')
+        results[f'process_experience/num_steps={num_steps}/run'] = (timeit(
+            lambda: jax.block_until_ready(process_experience(experience, .99, .95, 'scan')), 20), 's')
+    return results
+
+
+class _Envs:
+    def reset(self):
+        return np.zeros((1, 17), np.float32)
+
+
+def bench_update(quick: bool) -> Results:
+    results = {}
+    for hidden_sizes in ((64, 64),) if quick else ((64, 64), (256, 256)):
+        model = DiagGaussianPolicy(hidden_sizes=hidden_sizes, action_dim=6, init_log_std=0.)
+        state = create_train_state(
+            jax.random.PRNGKey(0), model, _Envs(), learning_rate=1e-4, decaying_lr=False, max_norm=.5,
+            decay=.99, eps=1e-5)
+        for batch_size in (128, 2048):
+            keys = jax.random.split(jax.random.PRNGKey(1), 4)
+            trajectories = (
+                jax.random.normal(keys[0], (batch_size, 17)), jnp.tanh(jax.random.normal(keys[1], (batch_size, 6))),
+                jax.random.normal(keys[2], (batch_size,)), jax.random.normal(keys[3], (batch_size,)))
+            jax.block_until_ready(step(state, trajectories))
+            calls = 20
+
+            def updates():
+                new_state = state
+                for _ in range(calls):
+                    new_state, _ = step(new_state, trajectories)
+                jax.block_until_ready(new_state)
+            hidden = 'x'.join(map(str, hidden_sizes))
+            results[f'update/hidden={hidden}/batch={batch_size}'] = (timeit(updates, 3) / calls, 's')
+    return results
+
+
+def bench_eval(quick: bool) -> Results:
+    num_envs = 4 if quick else 8
+    env = make_vec_env(POINT_MASS, num=num_envs, norm_obs=False, norm_r=False, seed=0)
+    try:
+        model = DiagGaussianPolicy(hidden_sizes=(64, 64), action_dim=env.action_space.shape[0], init_log_std=0.)
+        params = model.init(jax.random.PRNGKey(0), env.reset())['params']
+        evaluation.eval(model.apply, params, env)
+        seconds = timeit(lambda: evaluation.eval(model.apply, params, env), 1 if quick else 3)
+        return {f'eval/num_envs={num_envs}': (seconds, 's')}
+    finally:
+        env.close()
+
+
+def bench_checkpoint(quick: bool) -> Results:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'checkpoint')
+        for hidden_sizes in ((64, 64),) if quick else ((64, 64), (1024, 1024)):
+            state = make_state(hidden_sizes)
+            template = make_state(hidden_sizes, seed=1)
+            hidden = 'x'.join(map(str, hidden_sizes))
+            results[f'checkpoint/hidden={hidden}/save'] = (timeit(lambda: save_state(path, state, {}), 5), 's')
+            results[f'checkpoint/hidden={hidden}/load'] = (
+                timeit(lambda: jax.block_until_ready(load_state(path, template)), 5), 's')
+    return results
+
+
+SUITE: Dict[str, Callable[[bool], Results]] = dict(
+    vec_env=bench_vec_env,
+    collect=bench_collect,
+    gae=bench_gae,
+    update=bench_update,
+    eval=bench_eval,
+    checkpoint=bench_checkpoint,
+)
+
+
+def machine_info() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        time=datetime.datetime.now().isoformat(timespec='seconds'), commit=commit, python=platform.python_version(),
+        jax=jax.__version__, platform=platform.platform(), cpu_count=os.cpu_count(),
+        devices=[str(d) for d in jax.devices()])
+
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[str]:
+    """ Prints current vs baseline values and returns the names of the metrics that regressed """
+    regressions = []
+    for name, (value, unit) in results.items():
+        if name not in baseline:
+            print(f'{name:<48s}{value:14.6g} {unit:8s}  (not in the baseline)')
+            continue
+        reference = baseline[name][0]
+        # relative change, positive is worse
+        change = (reference - value) / reference if unit in HIGHER_IS_BETTER else (value - reference) / reference
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f'{name:<48s}{value:14.6g} {unit:8s} baseline {reference:12.6g}  '
+              f'{"worse" if change > 0 else "better"} by {abs(change):6.1%}' + ('  REGRESSION' if regressed else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', type=str, nargs='+', choices=list(SUITE), default=list(SUITE))
+    parser.add_argument('--quick', action='store_true', help='fewer and smaller cases, e.g. for CI')
+    parser.add_argument('--output', type=str, default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results of an earlier run to compare to')
+    parser.add_argument('--tolerance', type=float, default=.2,
+        help='relative slowdown above which a metric counts as a regression')
+    cmd_args = parser.parse_args()
+
+    results = {}
+    for name in cmd_args.only:
+        start = time.perf_counter()
+        results.update(SUITE[name](cmd_args.quick))
+        print(f'{name}: {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    if cmd_args.output:
+        with open(cmd_args.output, 'w') as handle:
+            json.dump(dict(
+                machine=machine_info(), quick=cmd_args.quick,
+                results={k: dict(value=v, unit=u) for k, (v, u) in results.items()}), handle, indent=2)
+
+    if cmd_args.baseline:
+        with open(cmd_args.baseline) as handle:
+            baseline = json.load(handle)
+        if baseline['quick'] != cmd_args.quick:
+            print('warning: the baseline was run with a different --quick setting', file=sys.stderr)
+        regressions = compare(results, {k: (v['value'], v['unit']) for k, v in baseline['results'].items()},
+                              cmd_args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) above {cmd_args.tolerance:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+    else:
+        for name, (value, unit) in results.items():
+            print(f'{name:<48s}{value:14.6g} {unit}')
@@ -1,5 +1,5 @@
 import functools
-from typing import Any, Callable, Dict, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import flax
 import jax
@@ -9,7 +9,7 @@ from jax_a2c.distributions import evaluate_actions_norm as evaluate_actions
 
 Array = Any
 
-@functools.partial(jax.jit, static_argnums=(1,5,6,7))
+@functools.partial(jax.jit, static_argnums=(1,5,6,7,8))
 def loss_fn(
     params: flax.core.frozen_dict, 
     apply_fn: Callable, 
@@ -18,11 +18,19 @@ def loss_fn(
     returns: Array, 
     value_loss_coef: float = .5, 
     entropy_coef: float = .01,
-    normalize_advantages: bool = True):
+    normalize_advantages: bool = True,
+    axis_name: Optional[str] = None):
+    """ With `axis_name` the batch is a shard of a data-parallel one, advantages are normalized with the global statistics """
     action_logprobs, values, dist_entropy, log_stds = evaluate_actions(params, apply_fn, observations, actions)
     advantages = returns - values
     if normalize_advantages:
-        advantages = (advantages - advantages.mean())/(advantages.std() + 1e-6)
+        mean = advantages.mean()
+        if axis_name is not None:
+            mean = jax.lax.pmean(mean, axis_name)
+        var = ((advantages - mean)**2).mean()
+        if axis_name is not None:
+            var = jax.lax.pmean(var, axis_name)
+        advantages = (advantages - mean)/(jnp.sqrt(var) + 1e-6)
     policy_loss = - (jax.lax.stop_gradient(advantages) * action_logprobs).mean()
     value_loss = ((returns - values)**2).mean()
     loss = value_loss_coef*value_loss + policy_loss - entropy_coef*dist_entropy
@@ -33,8 +41,9 @@ def loss_fn(
         advantages_max = jnp.abs(advantages).max(),
         min_std=jnp.exp(log_stds).min())
 
-@functools.partial(jax.jit, static_argnums=(2,3,4))
-def step(state, trajectories, value_loss_coef=.5, entropy_coef=.01, normalize_advantages=True):
+@functools.partial(jax.jit, static_argnums=(2,3,4,5))
+def step(state, trajectories, value_loss_coef=.5, entropy_coef=.01, normalize_advantages=True, axis_name=None):
+    """ Inside `pmap(..., axis_name)` gradients and losses are averaged over the devices, see `jax_a2c.data_parallel` """
     observations, actions, returns, advantages = trajectories
     (loss, loss_dict), grads = jax.value_and_grad(loss_fn, has_aux=True)(
         state.params, 
@@ -44,7 +53,13 @@ def step(state, trajectories, value_loss_coef=.5, entropy_coef=.01, normalize_ad
         returns,
         value_loss_coef=value_loss_coef,
         entropy_coef=entropy_coef,
-        normalize_advantages=normalize_advantages)
+        normalize_advantages=normalize_advantages,
+        axis_name=axis_name)
+    if axis_name is not None:
+        grads, loss = jax.lax.pmean((grads, loss), axis_name)
+        loss_dict = dict(
+            jax.lax.pmean(loss_dict, axis_name),
+            advantages_max=jax.lax.pmax(loss_dict['advantages_max'], axis_name))
     new_state = state.apply_gradients(grads=grads)
     return new_state, (loss, loss_dict)
     
\ No newline at end of file
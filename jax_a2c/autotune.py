@@ -0,0 +1,177 @@
+"""
+Calibration of the rollout layout for this machine. The transitions per update (`num_envs * num_steps`) are kept,
+so batch size and number of updates do not change, the sweep tries the ways to lay them out: num_steps within a
+factor of two of the configured one (the matching num_envs), envs per worker process and pipelined worker groups.
+Every layout trains a few updates on the real env and policy, the one with the most env steps/s is kept.
+
+Results are cached in a json file keyed by the machine (cpu model and count, pinning, jax device) and the settings
+that affect the measurement, later runs with `--autotune` reuse them instead of calibrating again.
+Layouts are compiled and measured one after the other, expect a few seconds per layout.
+"""
+import functools
+import json
+import os
+import platform
+import time
+from typing import Dict, List, Optional
+
+import jax
+import numpy as np
+
+from jax_a2c.builders import (collect_fn, make_envs, make_model,
+                              make_policy_fn, make_train_state,
+                              policy_obs_rms, update)
+from jax_a2c.utils import RolloutBuffer
+
+LAYOUT_KEYS = ('num_envs', 'num_steps', 'envs_per_worker', 'num_groups')
+
+
+def _cpu_model() -> str:
+    try:
+        with open('/proc/cpuinfo') as handle:
+            for line in handle:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def cache_key(args: dict) -> str:
+    """ The machine and the settings a calibration holds for """
+    device = jax.devices()[0]
+    return json.dumps(dict(
+        cpu_model=_cpu_model(),
+        cpu_count=os.cpu_count(),
+        worker_cpus=args['worker_cpus'],
+        device=f'{device.platform}:{device.device_kind}',
+        env_name=args['env_name'],
+        transitions=args['num_envs'] * args['num_steps'],
+        num_steps=args['num_steps'],
+        policy=args['policy'],
+        hidden_sizes=list(args['hidden_sizes']),
+        compute_dtype=args['compute_dtype'],
+        shared_memory=args['shared_memory'],
+    ), sort_keys=True)
+
+
+def candidate_layouts(args: dict, max_workers: Optional[int] = None) -> List[Dict[str, int]]:
+    """
+    Layouts of the configured transitions per update, the configured one first. Worker counts are powers of two
+    up to `max_workers` (twice the cpus the workers may use by default), groups split the workers in two.
+    """
+    transitions = args['num_envs'] * args['num_steps']
+    if max_workers is None:
+        max_workers = 2 * len(args['worker_cpus'] or os.sched_getaffinity(0))
+    configured = {key: args[key] for key in LAYOUT_KEYS}
+    layouts = [configured]
+    for num_steps in (args['num_steps'] // 2, args['num_steps'], 2 * args['num_steps']):
+        if num_steps < 1 or transitions % num_steps:
+            continue
+        num_envs = transitions // num_steps
+        num_workers = 1
+        while num_workers <= min(num_envs, max_workers):
+            if num_envs % num_workers == 0:
+                for num_groups in (1, 2):
+                    if num_workers % num_groups:
+                        continue
+                    layout = dict(
+                        num_envs=num_envs, num_steps=num_steps, envs_per_worker=num_envs // num_workers,
+                        num_groups=num_groups)
+                    if layout not in layouts:
+                        layouts.append(layout)
+            num_workers *= 2
+    return layouts
+
+
+def measure_layout(args: dict, layout: Dict[str, int], num_updates: int = 20, warmup_updates: int = 2) -> dict:
+    """
+    Trains `num_updates` updates with `layout` after `warmup_updates` (compilation) and returns env steps/s of
+    the whole loop and the mean milliseconds of a rollout and of an update (normalization, GAE, gradient step)
+    """
+    args = dict(args, **layout)
+    envs = make_envs(args, seed=args['seed'], num_groups=args['num_groups'])
+    try:
+        model = make_model(args, envs.action_space.shape[0])
+        prngkey = jax.random.PRNGKey(args['seed'])
+        state = make_train_state(args, prngkey, model, envs, train_steps=warmup_updates + num_updates)
+        _policy_fn = make_policy_fn(state.apply_fn)
+        collect = collect_fn(args)
+        buffer = RolloutBuffer.from_envs(envs, args['num_steps'])
+        next_obs = envs.reset()
+        next_obs_and_dones = (next_obs, np.zeros(args['num_envs'], bool))
+        rollout_seconds = update_seconds = 0.
+        for current_update in range(warmup_updates + num_updates):
+            if current_update == warmup_updates:
+                rollout_seconds = update_seconds = 0.
+            prngkey, _ = jax.random.split(prngkey)
+            start = time.perf_counter()
+            next_obs_and_dones, experience = collect(
+                prngkey, next_obs_and_dones, envs, num_steps=args['num_steps'],
+                policy_fn=functools.partial(_policy_fn, params=state.params, obs_rms=policy_obs_rms(args, state)),
+                buffer=buffer)
+            rollout_end = time.perf_counter()
+            state, (loss, _), _ = update(state, experience, args)
+            loss.block_until_ready()
+            rollout_seconds += rollout_end - start
+            update_seconds += time.perf_counter() - rollout_end
+    finally:
+        envs.close()
+    return dict(
+        env_steps_per_sec=num_updates * args['num_envs'] * args['num_steps'] / (rollout_seconds + update_seconds),
+        rollout_ms=1e3 * rollout_seconds / num_updates,
+        update_ms=1e3 * update_seconds / num_updates)
+
+
+def _load_cache(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def _save_result(path: str, key: str, result: dict) -> None:
+    # re-read, runs started together may calibrate other settings into the same file
+    cache = _load_cache(path)
+    cache[key] = result
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.tmp', 'w') as handle:
+        json.dump(cache, handle, indent=1)
+    os.replace(f'{path}.tmp', path)
+
+
+def format_measurements(measurements: List[dict]) -> str:
+    lines = [f'{"num_envs":>8} {"num_steps":>9} {"envs/worker":>11} {"groups":>6} {"steps/s":>9} '
+             f'{"rollout ms":>10} {"update ms":>9}']
+    for m in measurements:
+        lines.append(
+            f'{m["num_envs"]:8d} {m["num_steps"]:9d} {m["envs_per_worker"]:11d} {m["num_groups"]:6d} '
+            f'{m["env_steps_per_sec"]:9.0f} {m["rollout_ms"]:10.2f} {m["update_ms"]:9.2f}')
+    return '\n'.join(lines)
+
+
+def autotune(args: dict, cache_path: Optional[str] = None, num_updates: int = 20) -> dict:
+    """
+    `args` with the rollout layout (`LAYOUT_KEYS`) of the cached calibration for this machine and these settings,
+    calibrated first and cached in `cache_path` if there is none
+    """
+    assert args['env_backend'] == 'subproc' and args['num_seeds'] == 1 and args['num_devices'] == 1 \
+        and not args['learner_address'], '--autotune calibrates the single seed, single device trainer (`train.main`)'
+    key = cache_key(args)
+    cache_path = os.path.expanduser(cache_path) if cache_path else None
+    result = _load_cache(cache_path).get(key) if cache_path else None
+    cached = result is not None
+    if not cached:
+        measurements = []
+        for layout in candidate_layouts(args):
+            measurements.append(dict(layout, **measure_layout(args, layout, num_updates)))
+            print(f'autotune: {format_measurements(measurements[-1:]).splitlines()[1]}')
+        best = max(measurements, key=lambda m: m['env_steps_per_sec'])
+        result = dict(layout={name: best[name] for name in LAYOUT_KEYS}, measurements=measurements, created=time.time())
+        print(format_measurements(measurements))
+        if cache_path:
+            _save_result(cache_path, key, result)
+    layout = result['layout']
+    print('autotune: ' + ', '.join(f'{name}={value}' for name, value in layout.items()) +
+          (f' (cached in {cache_path})' if cached else ''))
+    return dict(args, **layout)
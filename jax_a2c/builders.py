@@ -0,0 +1,131 @@
+"""
+The pieces the training loops build from the `args` dict (args.py): env workers, the policy and its train state,
+the sampling policy and the update. Shared by the trainers (`train.py`), the actors of actor-learner training
+(`distributed.run_actor`) and the autotuner, free of the logging, checkpoint and evaluation imports of `train.py`.
+"""
+import functools
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import jax
+import jax.numpy as jnp
+
+from jax_a2c.a2c import step
+from jax_a2c.compilation import placeholder_output
+from jax_a2c.distributions import sample_action_from_normal as sample_action
+from jax_a2c.env_utils import make_vec_env
+from jax_a2c.normalization import normalize_obs
+from jax_a2c.policy import fuse_params, make_policy
+from jax_a2c.profiling import NULL_PROFILER
+from jax_a2c.utils import (collect_experience, collect_experience_pipelined,
+                           create_train_state, normalize_experience,
+                           process_experience)
+
+Array = Any
+
+
+def make_envs(args: dict, num: Optional[int] = None, **kwargs):
+    """
+    `num` (default `num_envs`) envs in worker processes with the transport and worker layout of `args`.
+    Observations and rewards are raw, the trainers normalize them on device with the statistics in the train state.
+    """
+    return make_vec_env(
+        name=args['env_name'],
+        num=args['num_envs'] if num is None else num,
+        norm_r=False,
+        norm_obs=False,
+        shared_memory=args['shared_memory'],
+        envs_per_worker=args['envs_per_worker'],
+        worker_cpus=args['worker_cpus'],
+        **kwargs)
+
+
+def make_model(args: dict, action_dim: int):
+    return make_policy(
+        args['policy'],
+        hidden_sizes=args['hidden_sizes'],
+        action_dim=action_dim,
+        init_log_std=args['init_log_std'],
+        dtype=jnp.dtype(args['compute_dtype']))
+
+
+def checkpoint_convert_fn(args: dict) -> Optional[Callable]:
+    # checkpoints of the default policy load into the fused one
+    return functools.partial(fuse_params, num_layers=len(args['hidden_sizes'])) if args['policy'] == 'fused' else None
+
+
+def make_train_state(args: dict, prngkey, model, envs, train_steps: int, num_seeds: Optional[int] = None):
+    return create_train_state(
+        prngkey,
+        model,
+        envs,
+        learning_rate=args['lr'],
+        decaying_lr=args['linear_decay'],
+        max_norm=args['max_grad_norm'],
+        decay=args['rms_beta2'],
+        eps=args['rms_eps'],
+        train_steps=train_steps,
+        num_seeds=num_seeds)
+
+
+def make_policy_fn(apply_fn: Callable) -> Callable:
+    """ The sampling policy of `collect_experience`, observations are normalized with `obs_rms` first if given """
+
+    @jax.jit
+    def policy_fn(prngkey, observation, params, obs_rms=None):
+        if obs_rms is not None:
+            observation = normalize_obs(obs_rms, observation)
+        values, (means, log_stds) = apply_fn({'params': params}, observation)
+        return values, sample_action(prngkey, means, log_stds)
+    return policy_fn
+
+
+def policy_obs_rms(args: dict, state):
+    # jax arrays are immutable, snapshots of the statistics need no copy
+    return state.norm_state.obs_rms if args['norm_obs'] else None
+
+
+def collect_fn(args: dict) -> Callable:
+    return collect_experience_pipelined if args['num_groups'] > 1 else collect_experience
+
+
+def update_kwargs(args: dict) -> Tuple[dict, dict, dict]:
+    """ Keyword arguments of `normalize_experience`, `process_experience` and `a2c.step` """
+    return (
+        dict(norm_obs=args['norm_obs'], norm_r=args['norm_r']),
+        dict(gamma=args['gamma'], lambda_=args['lambda_'], gae_method=args['gae_method']),
+        dict(
+            value_loss_coef=args['value_loss_coef'],
+            entropy_coef=args['entropy_coef'],
+            normalize_advantages=args['normalize_advantages']))
+
+
+def update(state, experience: Tuple[Array, ...], args: dict, profiler=NULL_PROFILER, normalized: bool = False):
+    """
+    `normalize_experience` (unless `normalized`), `process_experience` and `a2c.step` with the settings of `args`,
+    timed as the profiler phases `process_experience` and `update`.
+    Returns the new state, (loss, loss metrics) and the trajectories, the advantages are `trajectories[3]`.
+    """
+    norm_kwargs, process_kwargs, step_kwargs = update_kwargs(args)
+    with profiler.phase('process_experience') as phase:
+        if not normalized:
+            state, experience = normalize_experience(state, experience, **norm_kwargs)
+        trajectories = process_experience(experience=experience, **process_kwargs)
+        phase.fence(trajectories)
+    with profiler.phase('update') as phase:
+        state, (loss, loss_dict) = step(state, trajectories, **step_kwargs)
+        phase.fence(loss)
+    return state, (loss, loss_dict), trajectories
+
+
+def update_warmup(state, experience: Tuple[Array, ...], args: dict, normalized: bool = False) -> Dict[str, Callable]:
+    """ `compilation.warmup` calls that compile the functions of `update` for rollouts shaped like `experience` """
+    norm_kwargs, process_kwargs, step_kwargs = update_kwargs(args)
+    if normalized:
+        calls = {}
+    else:
+        calls = dict(normalize_experience=lambda: normalize_experience(state, experience, **norm_kwargs))
+        experience = placeholder_output(normalize_experience, state, experience, **norm_kwargs)[1]
+    return dict(
+        calls,
+        process_experience=lambda: process_experience(experience=experience, **process_kwargs),
+        step=lambda: step(state, placeholder_output(process_experience, experience, **process_kwargs), **step_kwargs))
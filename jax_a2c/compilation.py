@@ -0,0 +1,53 @@
+"""
+Trainer startup: the persistent XLA compilation cache and warm-up of the hot jitted functions.
+With the cache, repeated launches (sweeps) load executables from disk instead of recompiling them,
+warm-up compiles everything the training loop calls before it starts, concurrently where possible.
+"""
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import jax
+import jax.numpy as jnp
+
+
+def enable_compilation_cache(cache_dir: str, min_compile_time_secs: float = 0.) -> None:
+    """ Persist compiled executables in `cache_dir`, every process pointed at the same directory shares them
+    """
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+    jax.config.update('jax_compilation_cache_dir', cache_dir)
+    # jax only persists executables that took >1s to compile by default, the trainer's are mostly smaller
+    jax.config.update('jax_persistent_cache_min_compile_time_secs', min_compile_time_secs)
+
+
+def placeholder_output(fn: Callable, *args, **static_kwargs) -> Any:
+    """ Zeros shaped like the output of `fn(*args, **static_kwargs)`, only traces `fn`
+    """
+    shapes = jax.eval_shape(functools.partial(fn, **static_kwargs), *args)
+    return jax.tree_map(lambda s: jnp.zeros(s.shape, s.dtype), shapes)
+
+
+def warmup(
+        calls: Dict[str, Callable[[], Any]], max_workers: Optional[int] = None, verbose: bool = True) -> Dict[str, float]:
+    """
+    Runs every thunk of `calls` once on placeholder inputs with the shapes, dtypes and static arguments
+    of the training loop, which fills the jit caches the loop hits afterwards.
+    XLA releases the GIL while compiling, so the thunks run in a thread pool.
+    Returns the wall time of every call.
+    """
+    def timed(call):
+        start = time.perf_counter()
+        jax.block_until_ready(call())
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers or len(calls)) as pool:
+        futures = {name: pool.submit(timed, call) for name, call in calls.items()}
+        times = {name: future.result() for name, future in futures.items()}
+    if verbose:
+        print(f'Warm-up: {time.perf_counter() - start:.2f}s ('
+              + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in times.items()) + ')')
+    return times
@@ -0,0 +1,98 @@
+"""
+Data-parallel training of one run over the local devices: the `TrainState` is replicated on every device,
+environments `[i * n, (i + 1) * n)` with `n = num_envs // num_devices` belong to device `i`, which acts for them
+and processes their part of the rollout. Gradients are averaged over the devices (`a2c.step(..., axis_name=...)`),
+so the replicas stay identical and an update equals the single-device update on the whole batch.
+
+On a CPU-only machine several host devices can be emulated with
+`XLA_FLAGS=--xla_force_host_platform_device_count=N`, set before jax is imported.
+"""
+import functools
+from typing import Any, Callable, Tuple
+
+import jax
+from flax.jax_utils import replicate, unreplicate
+
+from jax_a2c.a2c import step
+from jax_a2c.distributions import sample_action_from_normal as sample_action
+from jax_a2c.multi_seed import merge_seeds, split_seeds
+from jax_a2c.normalization import normalize_obs
+from jax_a2c.utils import normalize_experience, process_experience
+
+Array = Any
+AXIS_NAME = 'devices'
+
+
+def local_devices(num_devices: int) -> list:
+    devices = jax.local_devices()
+    assert num_devices <= len(devices), (
+        f'{num_devices} devices requested, {len(devices)} available '
+        '(use XLA_FLAGS=--xla_force_host_platform_device_count=N to emulate more on CPU)')
+    return devices[:num_devices]
+
+
+def replicate_state(state: Any, num_devices: int) -> Any:
+    return replicate(state, local_devices(num_devices))
+
+
+def host_state(state: Any) -> Any:
+    """ The copy of a replicated state that lives on the first device, for evaluation and checkpoints """
+    return unreplicate(state)
+
+
+def make_policy_fn(apply_fn: Callable, num_devices: int) -> Callable:
+    """ Policy over the whole `num_envs` batch with replicated params (and observation statistics `obs_rms`, if given),
+    every device acting for its envs """
+
+    @functools.partial(jax.pmap, axis_name=AXIS_NAME, devices=local_devices(num_devices))
+    def device_policy_fn(prngkey, observations, params, obs_rms):
+        if obs_rms is not None:
+            observations = normalize_obs(obs_rms, observations)
+        values, (means, log_stds) = apply_fn({'params': params}, observations)
+        return values, sample_action(prngkey, means, log_stds)
+
+    def policy_fn(prngkey, observations, params, obs_rms=None):
+        values, actions = device_policy_fn(
+            jax.random.split(prngkey, num_devices), observations.reshape((num_devices, -1) + observations.shape[1:]),
+            params, obs_rms)
+        return merge_seeds(values), merge_seeds(actions)
+    return policy_fn
+
+
+def make_update_fn(
+        num_devices: int,
+        gamma: float,
+        lambda_: float,
+        value_loss_coef: float,
+        entropy_coef: float,
+        normalize_advantages: bool,
+        gae_method: str = 'scan',
+        norm_obs: bool = False,
+        norm_r: bool = False) -> Callable:
+    """
+    Returns `update(state, experience) -> state, (loss, loss_dict)` for a replicated `state`,
+    `experience` is the output of `collect_experience` over all environments, the losses are returned unreplicated.
+    With `norm_obs` / `norm_r` the raw rollout is first normalized, the statistics are updated with the envs of all devices.
+    """
+    @functools.partial(jax.pmap, axis_name=AXIS_NAME, devices=local_devices(num_devices))
+    def device_update(state, experience):
+        if norm_obs or norm_r:
+            state, experience = normalize_experience(state, experience, norm_obs, norm_r, AXIS_NAME)
+        trajectories = process_experience(experience, gamma=gamma, lambda_=lambda_, gae_method=gae_method)
+        return step(
+            state,
+            trajectories,
+            value_loss_coef=value_loss_coef,
+            entropy_coef=entropy_coef,
+            normalize_advantages=normalize_advantages,
+            axis_name=AXIS_NAME)
+
+    @jax.jit
+    def shard(experience):
+        # [num_steps, num_envs, ...] -> [num_devices, num_steps, num_envs // num_devices, ...]
+        return tuple(split_seeds(x, num_devices, axis=1) for x in experience)
+
+    def update(state, experience) -> Tuple[Any, Tuple[Array, dict]]:
+        state, metrics = device_update(state, shard(experience))
+        return state, unreplicate(metrics)
+    return update
@@ -0,0 +1,395 @@
+"""
+Actor-learner training over sockets. Actors (`run_actor`, processes on this machine or on other hosts) collect rollouts
+with `utils.collect_experience` and stream them to the learner (`ExperienceServer`, used by `train.main_distributed`),
+which normalizes them, runs `process_experience` and `a2c.step` in arrival order. Every rollout is answered with the
+newest params the learner published, so actors act with params that are at most one rollout old.
+
+Messages are binary frames: a fixed header (kind, tag, number of arrays, payload size) followed by a small header and
+the raw bytes of every array, written with one `sendmsg` without pickling or copying into a message buffer.
+Addresses are `HOST:PORT` (TCP) or `unix:PATH` (Unix socket, for actors on the learner's machine).
+
+By the time the learner takes a rollout the params it was collected with are a few updates old: its staleness is
+the number of learner updates since those params. A2C has no off-policy correction, so rollouts staler than
+`max_staleness` are dropped without touching the normalization statistics: they would be merged into the statistics
+the learner trains with although they come from a policy it no longer has (the discounted returns of the actor's envs
+then skip the dropped steps, which only shifts the reward scale estimate). The observations of the rollouts that are
+trained on are normalized with the statistics the actor acted with (`normalize_actor_rollout`). Staleness, dropped rollouts and the share of the time the learner spends learning
+instead of waiting for rollouts are reported by `ActorLearnerStats`.
+"""
+import functools
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from jax_a2c.normalization import (RunningMeanStd, normalize_obs,
+                                   normalize_rollout)
+
+Array = Any
+
+HELLO, ROLLOUT, PARAMS, STOP = range(4)
+# kind, tag (the actor id of HELLO, the params version of ROLLOUT and PARAMS), number of arrays, payload bytes
+_HEADER = struct.Struct('!BqIQ')
+# length of the dtype name, number of dimensions
+_ARRAY = struct.Struct('!BB')
+
+
+def _socket_address(address: str) -> Tuple[int, Any]:
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def encode_message(kind: int, tag: int, arrays: Sequence[Array]) -> List[memoryview]:
+    """ The buffers of one frame, the arrays are not copied (native byte order) """
+    parts = []
+    for array in arrays:
+        array = np.asarray(array)
+        name = array.dtype.name.encode()
+        parts.append(memoryview(
+            _ARRAY.pack(len(name), array.ndim) + name + struct.pack(f'!{array.ndim}Q', *array.shape)))
+        # as bytes, also for dtypes the buffer protocol does not know (bfloat16), copied only if not contiguous
+        parts.append(memoryview(np.ascontiguousarray(array).reshape(-1).view(np.uint8)))
+    header = _HEADER.pack(kind, tag, len(arrays), sum(part.nbytes for part in parts))
+    return [memoryview(header)] + parts
+
+
+def decode_arrays(payload: bytearray, num_arrays: int) -> List[np.ndarray]:
+    """ Arrays of a frame's payload, views of `payload` """
+    arrays = []
+    offset = 0
+    for _ in range(num_arrays):
+        name_length, ndim = _ARRAY.unpack_from(payload, offset)
+        offset += _ARRAY.size
+        dtype = jnp.dtype(bytes(payload[offset:offset + name_length]).decode())
+        offset += name_length
+        shape = struct.unpack_from(f'!{ndim}Q', payload, offset)
+        offset += 8 * ndim
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays.append(np.frombuffer(payload, np.uint8, size, offset).view(dtype).reshape(shape))
+        offset += size
+    return arrays
+
+
+def send_buffers(sock: socket.socket, buffers: Sequence[memoryview]) -> None:
+    buffers = [buffer.cast('B') for buffer in buffers if buffer.nbytes]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        # partial sends continue where they stopped
+        while sent:
+            if sent >= buffers[0].nbytes:
+                sent -= buffers[0].nbytes
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+def send_message(sock: socket.socket, kind: int, tag: int, arrays: Sequence[Array] = ()) -> None:
+    send_buffers(sock, encode_message(kind, tag, arrays))
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    data = bytearray(size)
+    view = memoryview(data)
+    while view.nbytes:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError('connection closed by the peer')
+        view = view[received:]
+    return data
+
+
+def recv_message(sock: socket.socket) -> Tuple[int, int, List[np.ndarray]]:
+    """ (kind, tag, arrays) of the next frame """
+    kind, tag, num_arrays, size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return kind, tag, decode_arrays(_recv_exactly(sock, size), num_arrays)
+
+
+def connect(address: str, timeout: float = 60.) -> socket.socket:
+    """ Connects to `address`, retrying until the learner listens or `timeout` seconds passed """
+    family, target = _socket_address(address)
+    deadline = time.perf_counter() + timeout
+    while True:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(target)
+            break
+        except (ConnectionRefusedError, FileNotFoundError):
+            sock.close()
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(.1)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def policy_arrays(params: Any, obs_rms: Any) -> List[np.ndarray]:
+    """ The leaves of what actors act with, in the order of `jax.tree_util.tree_leaves` """
+    return [np.asarray(leaf) for leaf in jax.tree_util.tree_leaves((params, obs_rms))]
+
+
+@functools.partial(jax.jit, static_argnames=('norm_obs', 'norm_r'))
+def normalize_actor_rollout(
+        norm_state: Any,
+        experience: Tuple[Array, ...],
+        obs_rms: Any,
+        norm_obs: bool = True,
+        norm_r: bool = True) -> Tuple[Any, Tuple[Array, ...]]:
+    """
+    `utils.normalize_experience` of a rollout collected with older params: the rollout is merged into `norm_state`
+    (the learner's statistics, with the discounted returns of the actor's envs), its observations are normalized with
+    `obs_rms`, the statistics published with the params the actor acted with
+    """
+    observations, actions, rewards, values, dones = experience
+    norm_state, _, rewards = normalize_rollout(
+        norm_state, observations, rewards, dones[1:], norm_obs=norm_obs, norm_r=norm_r)
+    if norm_obs:
+        observations = normalize_obs(obs_rms, observations)
+    return norm_state, (observations, actions, rewards, values, dones)
+
+
+class Rollout(NamedTuple):
+    actor: int
+    # learner updates before the params the rollout was collected with
+    version: int
+    # observations, actions, rewards, values, dones of `collect_experience` (host arrays)
+    experience: Tuple[np.ndarray, ...]
+
+
+class ExperienceServer:
+    """
+    The learner's end. Accepts actors on `address` (`HOST:0` picks a free port, see `self.address`) and queues their
+    rollouts in arrival order, at most `max_queued`: further actors wait for their reply, so the queue can not fall
+    arbitrarily far behind. Every rollout is answered with the params of the latest `publish` (only the version when
+    the actor already has them), or with STOP after `close`.
+    """
+    def __init__(self, address: str, max_queued: int = 2):
+        family, target = _socket_address(address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                os.unlink(target)
+            self._path = target
+        else:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._path = None
+        self._listener.bind(target)
+        self._listener.listen()
+        self.address = address if self._path else f'{target[0]}:{self._listener.getsockname()[1]}'
+        self._rollouts = queue.Queue(max_queued)
+        self._published = threading.Condition()
+        self._params = None
+        self._closing = False
+        self.actors = set()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def publish(self, version: int, arrays: Sequence[Array]) -> None:
+        """ Params (`policy_arrays`) for the following replies, encoded once """
+        frame = encode_message(PARAMS, version, arrays)
+        with self._published:
+            self._params = version, frame
+            self._published.notify_all()
+
+    def get(self, timeout=None) -> Rollout:
+        return self._rollouts.get(timeout=timeout)
+
+    def close(self) -> None:
+        """ Stops accepting rollouts, actors get STOP in their next reply """
+        with self._published:
+            self._closing = True
+            self._published.notify_all()
+        self._listener.close()
+        if self._path is not None and os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                # closed
+                return
+            if connection.family == socket.AF_INET:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection: socket.socket) -> None:
+        try:
+            kind, actor, _ = recv_message(connection)
+            assert kind == HELLO, f'expected HELLO, got message kind {kind}'
+            self.actors.add(actor)
+            version = None
+            while self._reply(connection, version):
+                kind, version, experience = recv_message(connection)
+                rollout = Rollout(actor, version, tuple(experience))
+                while not self._closing:
+                    try:
+                        self._rollouts.put(rollout, timeout=.1)
+                        break
+                    except queue.Full:
+                        pass
+        except ConnectionError:
+            # the actor is gone, its queued rollouts are still used
+            pass
+        finally:
+            connection.close()
+
+    def _reply(self, connection: socket.socket, version) -> bool:
+        with self._published:
+            self._published.wait_for(lambda: self._params is not None or self._closing)
+            if self._closing:
+                send_message(connection, STOP, 0)
+                return False
+            params_version, frame = self._params
+        if params_version == version:
+            send_message(connection, PARAMS, version)
+        else:
+            send_buffers(connection, frame)
+        return True
+
+
+class ActorLearnerStats:
+    """
+    Learner utilization (share of the wall time spent on rollouts instead of waiting for them), staleness of the
+    rollouts and dropped rollouts, per logging window (`window`) and for the whole run (`summary`)
+    """
+    def __init__(self):
+        self._start = self._window_start = time.perf_counter()
+        self._busy = self._window_busy = 0.
+        self._staleness = []
+        self._window_staleness = []
+        self._dropped = self._window_dropped = 0
+        self._env_steps = self._window_env_steps = 0
+        self._rollouts = defaultdict(int)
+
+    def rollout(self, rollout: Rollout, staleness: int, used: bool, busy_seconds: float) -> None:
+        self._busy += busy_seconds
+        self._window_busy += busy_seconds
+        num_steps, num_envs = rollout.experience[2].shape
+        self._env_steps += num_steps * num_envs
+        self._window_env_steps += num_steps * num_envs
+        self._rollouts[rollout.actor] += 1
+        if used:
+            self._staleness.append(staleness)
+            self._window_staleness.append(staleness)
+        else:
+            self._dropped += 1
+            self._window_dropped += 1
+
+    def window(self) -> Dict[str, float]:
+        now = time.perf_counter()
+        wall = now - self._window_start
+        record = {
+            'actor_learner/learner_utilization': self._window_busy / wall,
+            'actor_learner/env_steps_per_sec': self._window_env_steps / wall,
+            'actor_learner/dropped_rollouts': self._window_dropped}
+        if self._window_staleness:
+            record['actor_learner/staleness_mean'] = float(np.mean(self._window_staleness))
+            record['actor_learner/staleness_max'] = max(self._window_staleness)
+        self._window_start = now
+        self._window_busy = 0.
+        self._window_staleness = []
+        self._window_dropped = self._window_env_steps = 0
+        return record
+
+    def summary(self) -> str:
+        wall = time.perf_counter() - self._start
+        staleness = np.asarray(self._staleness)
+        counts = np.bincount(staleness) if len(staleness) else np.zeros(0, int)
+        return '\n'.join([
+            f'Actor-learner: {wall:.1f}s wall, {self._env_steps / wall:.0f} env steps/s, '
+            f'learner utilization {self._busy / wall:.1%}',
+            f'rollouts per actor: {dict(sorted(self._rollouts.items()))}, dropped (too stale): {self._dropped}',
+            'staleness of the used rollouts: ' + ', '.join(f'{lag}: {count}' for lag, count in enumerate(counts) if count)])
+
+
+def start_local_actors(args: dict, address: str, num_actors: int) -> List[Any]:
+    """ Actors 0..num_actors-1 as processes of this machine, they exit when the learner closes the server """
+    import multiprocessing as mp
+
+    # spawned: the learner has jax (and its threads) initialized
+    ctx = mp.get_context('spawn')
+    processes = [ctx.Process(target=run_actor, args=(args, address, actor)) for actor in range(num_actors)]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def next_rollout(server: ExperienceServer, actors: Sequence[Any] = (), poll: float = 1.) -> Rollout:
+    """ `server.get()` that raises if one of the local `actors` processes failed instead of waiting forever """
+    while True:
+        try:
+            return server.get(timeout=poll)
+        except queue.Empty:
+            failed = [actor.name for actor in actors if actor.exitcode not in (None, 0)]
+            if failed:
+                server.close()
+                raise RuntimeError(f'actor processes {failed} failed, see their output above')
+
+
+def run_actor(args: dict, address: str, actor: int, connect_timeout: float = 60.) -> None:
+    """
+    Collects rollouts for the learner at `address` until it stops, with the env, policy and rollout settings of `args`
+    (those of the learner). `actor` must be unique among the learner's actors, it seeds the envs and the sampling.
+    """
+    from jax_a2c.builders import (collect_fn, make_envs, make_model,
+                                  make_policy_fn)
+    from jax_a2c.env_utils import pin_process, preload_worker_modules
+    from jax_a2c.utils import RolloutBuffer
+
+    if args['worker_cpus'] is not None:
+        # with --pin-cpus local actors start on the learner's cpus (inherited), move them next to the env workers
+        pin_process([args['worker_cpus'][actor % len(args['worker_cpus'])]])
+    preload_worker_modules(args['env_name'])
+    envs = make_envs(args, seed=args['seed'] + actor * args['num_envs'], num_groups=args['num_groups'])
+    if args['reset_states']:
+        getattr(envs, 'venv', envs).set_reset_pool(np.load(args['reset_states']), seed=args['seed'] + actor)
+
+    model = make_model(args, envs.action_space.shape[0])
+    next_obs = envs.reset()
+    # the structure the published leaves are put back into
+    treedef = jax.tree_util.tree_structure((
+        model.init(jax.random.PRNGKey(0), next_obs)['params'],
+        RunningMeanStd.create(next_obs.shape[1:]) if args['norm_obs'] else None))
+    _policy_fn = make_policy_fn(model.apply)
+
+    collect = collect_fn(args)
+    buffer = RolloutBuffer.from_envs(envs, args['num_steps'])
+    next_obs_and_dones = (next_obs, np.array(next_obs.shape[0]*[False]))
+    prngkey = jax.random.fold_in(jax.random.PRNGKey(args['seed']), actor + 1)
+
+    sock = connect(address, connect_timeout)
+    try:
+        send_message(sock, HELLO, actor)
+        kind, version, leaves = recv_message(sock)
+        while kind != STOP:
+            if leaves:
+                params, obs_rms = jax.device_put(jax.tree_util.tree_unflatten(treedef, leaves))
+            prngkey, key = jax.random.split(prngkey)
+            next_obs_and_dones, experience = collect(
+                key,
+                next_obs_and_dones,
+                envs,
+                num_steps=args['num_steps'],
+                policy_fn=functools.partial(_policy_fn, params=params, obs_rms=obs_rms),
+                buffer=buffer,
+                to_device=False,)
+            send_message(sock, ROLLOUT, version, experience)
+            kind, version, leaves = recv_message(sock)
+    except ConnectionError:
+        # the learner is gone
+        pass
+    finally:
+        sock.close()
+        envs.close()
@@ -8,8 +8,8 @@ def evaluate_actions_norm_with_repeats(params, apply_fn, observations, actions):
     actions.shape = 
     """
     values, (means, log_stds) = apply_fn({'params': params}, observations)
+    log_stds = jnp.broadcast_to(log_stds, means.shape)[:, None, :]
     means = means[:, None, :]
-    log_stds = log_stds[:, None, :]
     stds = jnp.exp(log_stds)
     pre_tanh_logprobs = -(actions-means)**2/(2*stds**2) - jnp.log(2*jnp.pi)/2 - log_stds
     action_logprobs = (pre_tanh_logprobs).sum(axis=-1)
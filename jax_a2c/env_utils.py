@@ -1,36 +1,179 @@
 import functools
 import multiprocessing as mp
-from typing import Iterable, List, Optional, Tuple
+import os
+import time
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
 
-import gym
 import numpy as np
-from mujoco_py import MjSimState
-from stable_baselines3.common.vec_env.vec_normalize import VecNormalize
 
+if TYPE_CHECKING:
+    from mujoco_py import MjSimState
 
-def _worker(remote, parent_remote, env_fn) -> None:
 
+_STEP = 0
+_REMOTE = 1
+# upper edges (seconds) of the bins of the step latency histogram kept by every worker, the last bin counts slower steps
+STEP_LATENCY_BINS = np.geomspace(1e-6, 10., 57)
+
+
+class _SharedBuffers:
+    """
+    Preallocated step buffers living in shared memory. The parent owns (and unlinks) the segments,
+    workers attach to them by name and write their rows in place.
+    """
+    def __init__(self, num_envs, observation_space, action_space, names=None):
+        specs = dict(
+            commands=((num_envs,), np.int8),
+            actions=((num_envs,) + action_space.shape, action_space.dtype),
+            observations=((num_envs,) + observation_space.shape, observation_space.dtype),
+            terminal_observations=((num_envs,) + observation_space.shape, observation_space.dtype),
+            rewards=((num_envs,), np.float64),
+            dones=((num_envs,), np.bool_),
+        )
+        self.owner = names is None
+        self.names = {}
+        self._segments = []
+        for key, (shape, dtype) in specs.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            if self.owner:
+                segment = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                # workers share the parent's resource tracker, so attaching does not duplicate the registration
+                segment = shared_memory.SharedMemory(name=names[key])
+            self._segments.append(segment)
+            self.names[key] = segment.name
+            setattr(self, key, np.ndarray(shape, dtype=dtype, buffer=segment.buf))
+
+    def close(self):
+        for key in self.names:
+            setattr(self, key, None)
+        for segment in self._segments:
+            try:
+                segment.close()
+            except BufferError:
+                # observation views handed out by step_wait are still referenced
+                pass
+            if self.owner:
+                segment.unlink()
+        self._segments = []
+
+
+def get_flat_state(env) -> np.array:
+    """
+    State of a gym env as one float64 vector: qpos and qvel of mujoco envs, `get_flat_state()` of envs that define it
+    """
+    unwrapped = env.unwrapped
+    if hasattr(unwrapped, 'get_flat_state'):
+        return np.asarray(unwrapped.get_flat_state(), np.float64)
+    if hasattr(unwrapped, 'sim'):
+        return np.concatenate([unwrapped.sim.data.qpos.flat, unwrapped.sim.data.qvel.flat])
+    raise NotImplementedError(f'{type(unwrapped).__name__} has no flat state, define get_flat_state/set_flat_state')
+
+
+def restart_from(env, flat_state: np.array) -> np.array:
+    """
+    Starts a new episode of `env` in `flat_state` (of `get_flat_state`) instead of `env.reset()`,
+    returns the observation of the unwrapped env
+    """
+    # episode step counters of the wrappers (TimeLimit) start over
+    wrapper = env
+    while hasattr(wrapper, 'env'):
+        if hasattr(wrapper, '_elapsed_steps'):
+            wrapper._elapsed_steps = 0
+        wrapper = wrapper.env
+    unwrapped = env.unwrapped
+    if hasattr(unwrapped, 'set_flat_state'):
+        return unwrapped.set_flat_state(flat_state)
+    num_qpos = unwrapped.model.nq
+    # MujocoEnv.set_state keeps time and actuator state and runs mj_forward
+    unwrapped.set_state(flat_state[:num_qpos], flat_state[num_qpos:])
+    return unwrapped._get_obs()
+
+
+def _worker(remote, parent_remote, env_fns, step_semaphore=None, done_semaphore=None, cpus=None) -> None:
+    """
+    Owns the environments created by `env_fns` and steps them in a loop,
+    every reply carries the batch of all of them. With `cpus` the worker only runs on those.
+    """
     parent_remote.close()
-    env = env_fn()
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    envs = [env_fn() for env_fn in env_fns]
+    buffers = None
+    rows = None
+    # with a reset pool finished episodes restart from one of its states instead of `env.reset()`
+    reset_pool, pool_rng = None, None
+
+    def reset(env):
+        if reset_pool is None:
+            return env.reset()
+        return restart_from(env, reset_pool[pool_rng.randint(len(reset_pool))])
+
+    latency_counts = np.zeros(len(STEP_LATENCY_BINS) + 1, np.int64)
     while True:
         try:
+            if buffers is not None:
+                # shared memory transport: wait for the parent's signal, steps never touch the pipe
+                step_semaphore.acquire()
+                if buffers.commands[rows.start] == _STEP:
+                    start = time.perf_counter()
+                    for row, env in zip(range(rows.start, rows.stop), envs):
+                        observation, reward, done, info = env.step(buffers.actions[row])
+                        if done:
+                            buffers.terminal_observations[row] = observation
+                            observation = reset(env)
+                        buffers.observations[row] = observation
+                        buffers.rewards[row] = reward
+                        buffers.dones[row] = done
+                    latency_counts[np.searchsorted(STEP_LATENCY_BINS, time.perf_counter() - start)] += 1
+                    done_semaphore.release()
+                    continue
             cmd, data = remote.recv()
             if cmd == "step":
-                observation, reward, done, info = env.step(data)
-                if done:
-                    info["terminal_observation"] = observation
-                    observation = env.reset()
-                remote.send((observation, reward, done, info))
+                start = time.perf_counter()
+                observations, rewards, dones, infos = [], [], [], []
+                for env, action in zip(envs, data):
+                    observation, reward, done, info = env.step(action)
+                    if done:
+                        info["terminal_observation"] = observation
+                        observation = reset(env)
+                    observations.append(observation)
+                    rewards.append(reward)
+                    dones.append(done)
+                    infos.append(info)
+                latency_counts[np.searchsorted(STEP_LATENCY_BINS, time.perf_counter() - start)] += 1
+                remote.send((np.stack(observations), np.array(rewards), np.array(dones), infos))
             elif cmd == "reset":
-                observation = env.reset()
-                remote.send(observation)
+                remote.send(np.stack([reset(env) for env in envs]))
+            elif cmd == "restart":
+                remote.send(np.stack([restart_from(env, flat_state) for env, flat_state in zip(envs, data)]))
+            elif cmd == "get_flat_state":
+                remote.send(np.stack([get_flat_state(env) for env in envs]))
+            elif cmd == "set_reset_pool":
+                reset_pool, seed = data
+                pool_rng = np.random.RandomState(seed)
+                remote.send(None)
             elif cmd == "set":
-                env.sim.set_state(data)
+                for env, env_state in zip(envs, data):
+                    env.sim.set_state(env_state)
                 remote.send(None)
             elif cmd == "get_state":
-                remote.send(env.sim.get_state())
+                remote.send([env.sim.get_state() for env in envs])
+            elif cmd == "get_step_latency":
+                remote.send(latency_counts.copy())
+                latency_counts[:] = 0
             elif cmd == "get_spaces":
-                remote.send((env.observation_space, env.action_space))
+                remote.send((envs[0].observation_space, envs[0].action_space))
+            elif cmd == "attach":
+                names, num_envs, rows = data
+                buffers = _SharedBuffers(num_envs, envs[0].observation_space, envs[0].action_space, names=names)
+                remote.send(None)
+            elif cmd == "close":
+                if buffers is not None:
+                    buffers.close()
+                remote.close()
+                break
             else:
                 raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
         except EOFError:
@@ -38,68 +181,334 @@ def _worker(remote, parent_remote, env_fn) -> None:
             break
 
 class SubprocVecEnv:
+    """
+    Runs the environments in worker processes, `envs_per_worker` environments per process.
+    Each worker steps its environments in a loop and answers with one batch, so a step costs
+    one round trip per worker instead of one per environment.
 
-    def __init__(self, env_fns, start_method=None):
+    With `shared_memory=True` actions, observations, rewards and dones are exchanged through
+    preallocated shared arrays and workers are signalled with semaphores, so a step pickles nothing.
+    In this mode `step_wait` returns a view of the shared observation buffer which is only valid
+    until the next `step_async`/`reset`, and `infos` only carry `terminal_observation`.
+
+    With `worker_cpus` every worker is pinned to one of these cpus, round robin (see `split_cpus`).
+    """
+
+    def __init__(self, env_fns, start_method=None, shared_memory=False, envs_per_worker=1, worker_cpus=None):
 
         self.waiting = False
         self.closed = False
-        n_envs = len(env_fns)
+        self.num_envs = len(env_fns)
         if start_method is None:
             forkserver_available = "forkserver" in mp.get_all_start_methods()
             start_method = "forkserver" if forkserver_available else "spawn"
         ctx = mp.get_context(start_method)
 
-        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        # contiguous rows of the batch owned by every worker
+        self._rows = [
+            slice(start, min(start + envs_per_worker, self.num_envs))
+            for start in range(0, self.num_envs, envs_per_worker)]
+        self.num_workers = len(self._rows)
+
+        self.shared_memory = shared_memory
+        if shared_memory:
+            self._step_semaphores = [ctx.Semaphore(0) for _ in range(self.num_workers)]
+            self._done_semaphores = [ctx.Semaphore(0) for _ in range(self.num_workers)]
+        else:
+            self._step_semaphores = self._done_semaphores = [None] * self.num_workers
+
+        if worker_cpus is None:
+            cpus = [None] * self.num_workers
+        else:
+            cpus = [[worker_cpus[worker % len(worker_cpus)]] for worker in range(self.num_workers)]
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(self.num_workers)])
         self.processes = []
-        for work_remote, remote, env_fn in zip(self.work_remotes, self.remotes, env_fns):
-            args = (work_remote, remote, env_fn)
+        for work_remote, remote, rows, step_semaphore, done_semaphore, pinned in zip(
+                self.work_remotes, self.remotes, self._rows, self._step_semaphores, self._done_semaphores, cpus):
+            args = (work_remote, remote, env_fns[rows], step_semaphore, done_semaphore, pinned)
             process = ctx.Process(target=_worker, args=args, daemon=True)
             process.start()
             self.processes.append(process)
             work_remote.close()
-        self.num_envs = len(self.processes)
         self.remotes[0].send(("get_spaces", None))
         self.observation_space, self.action_space = self.remotes[0].recv()
 
+        self._buffers = None
+        if shared_memory:
+            self._buffers = _SharedBuffers(self.num_envs, self.observation_space, self.action_space)
+            for remote, rows in zip(self.remotes, self._rows):
+                remote.send(("attach", (self._buffers.names, self.num_envs, rows)))
+            [remote.recv() for remote in self.remotes]
+
+    def _send(self, worker, cmd, data) -> None:
+        self.remotes[worker].send((cmd, data))
+        if self._buffers is not None:
+            # wake the worker up so that it reads the command from its pipe
+            self._buffers.commands[self._rows[worker]] = _REMOTE
+            self._step_semaphores[worker].release()
+
+    def _env_rows(self, workers: range) -> slice:
+        return slice(self._rows[workers.start].start, self._rows[workers.stop - 1].stop)
+
+    def _step_async(self, actions, workers: range) -> None:
+        actions = np.asarray(actions)
+        env_rows = self._env_rows(workers)
+        if self._buffers is not None:
+            self._buffers.actions[env_rows] = actions
+            self._buffers.commands[env_rows] = _STEP
+            for worker in workers:
+                self._step_semaphores[worker].release()
+        else:
+            for worker in workers:
+                rows = self._rows[worker]
+                self.remotes[worker].send(("step", actions[rows.start - env_rows.start:rows.stop - env_rows.start]))
+
+    def _step_wait(self, workers: range) -> Tuple[np.array]:
+        if self._buffers is not None:
+            env_rows = self._env_rows(workers)
+            for worker in workers:
+                self._wait_done(worker)
+            dones = self._buffers.dones[env_rows].copy()
+            terminal_observations = self._buffers.terminal_observations[env_rows]
+            infos = [
+                {"terminal_observation": terminal_observations[i].copy()} if done else {}
+                for i, done in enumerate(dones)]
+            return self._buffers.observations[env_rows], self._buffers.rewards[env_rows].copy(), dones, infos
+        results = [self.remotes[worker].recv() for worker in workers]
+        obs, rews, dones, infos = zip(*results)
+        return _flatten_obs(obs), np.concatenate(rews), np.concatenate(dones), sum(infos, [])
+
+    def _wait_done(self, worker: int, poll: float = 1.) -> None:
+        # a worker that died (e.g. its env raised) never signals, fail like the pipe transport instead of hanging
+        while not self._done_semaphores[worker].acquire(timeout=poll):
+            if not self.processes[worker].is_alive():
+                raise EOFError(f'env worker {worker} exited with code {self.processes[worker].exitcode}')
+
+    def _reset(self, workers: range) -> np.array:
+        for worker in workers:
+            self._send(worker, "reset", None)
+        obs = [self.remotes[worker].recv() for worker in workers]
+        return _flatten_obs(obs)
+
     def step_async(self, actions) -> None:
-        for remote, action in zip(self.remotes, actions):
-            remote.send(("step", action))
+        self._step_async(actions, range(self.num_workers))
         self.waiting = True
 
     def step_wait(self) -> Tuple[np.array]:
-        results = [remote.recv() for remote in self.remotes]
+        results = self._step_wait(range(self.num_workers))
         self.waiting = False
-        obs, rews, dones, infos = zip(*results)
-        return _flatten_obs(obs), np.stack(rews), np.stack(dones), infos
+        return results
 
     def reset(self) -> np.array:
-        for remote in self.remotes:
-            remote.send(("reset", None))
-        obs = [remote.recv() for remote in self.remotes]
-        return _flatten_obs(obs)
+        return self._reset(range(self.num_workers))
+
+    def split(self, num_groups: int) -> List['SubprocVecEnvGroup']:
+        """
+        Splits the workers into `num_groups` contiguous groups which can be stepped independently
+        """
+        assert self.num_workers % num_groups == 0, 'number of workers must be divisible by number of groups'
+        group_size = self.num_workers // num_groups
+        return [
+            SubprocVecEnvGroup(self, range(start, start + group_size))
+            for start in range(0, self.num_workers, group_size)]
 
     def step(self, actions: Iterable) -> Tuple[np.array]:
         self.step_async(actions)
         return self.step_wait()
-        
+
+    def step_workers(self, actions, workers: Iterable[int]) -> List[Tuple[slice, Tuple[np.array]]]:
+        """
+        Steps only the environments of `workers` (any subset), the others keep their state.
+        `actions` has a row for every environment of the batch. Returns the rows and the step results
+        of every contiguous run of stepped workers.
+        """
+        actions = np.asarray(actions)
+        runs = []
+        for worker in sorted(workers):
+            if runs and runs[-1].stop == worker:
+                runs[-1] = range(runs[-1].start, worker + 1)
+            else:
+                runs.append(range(worker, worker + 1))
+        for run in runs:
+            self._step_async(actions[self._env_rows(run)], run)
+        return [(self._env_rows(run), self._step_wait(run)) for run in runs]
+
+    def step_latency_counts(self) -> np.array:
+        """ `[num_workers, len(STEP_LATENCY_BINS) + 1]` histograms of the time every worker spent stepping
+        its environments since the last call, see `profiling.latency_percentile` """
+        for worker in range(self.num_workers):
+            self._send(worker, "get_step_latency", None)
+        return np.stack([remote.recv() for remote in self.remotes])
+
     def set_state(self, env_states: Iterable) -> None:
-        for remote, env_state in zip(self.remotes, env_states):
-            remote.send(("set", env_state))
+        env_states = list(env_states)
+        for worker, rows in enumerate(self._rows):
+            self._send(worker, "set", env_states[rows])
         [remote.recv() for remote in self.remotes]
 
     def get_state(self,):
+        for worker in range(self.num_workers):
+            self._send(worker, "get_state", None)
+        return sum([remote.recv() for remote in self.remotes], [])
+
+    def get_flat_state(self) -> np.array:
+        """ `[num_envs, state_dim]` states of all environments, see `get_flat_state` """
+        for worker in range(self.num_workers):
+            self._send(worker, "get_flat_state", None)
+        return np.concatenate([remote.recv() for remote in self.remotes])
+
+    def restart(self, flat_states: np.array) -> np.array:
+        """
+        Starts a new episode of every environment in its row of `flat_states` (`[num_envs, state_dim]`),
+        one message per worker. Returns the observations like `reset`.
+        """
+        flat_states = np.asarray(flat_states, np.float64)
+        for worker, rows in enumerate(self._rows):
+            self._send(worker, "restart", flat_states[rows])
+        return _flatten_obs([remote.recv() for remote in self.remotes])
+
+    def set_reset_pool(self, flat_states: Optional[np.array], seed: Optional[int] = None) -> None:
+        """
+        From now on `reset` and the automatic resets of finished episodes restart environments from states drawn
+        from `flat_states` (`[pool_size, state_dim]`, start or mid-episode states), `None` goes back to `env.reset()`.
+        Worker `i` draws with seed `seed + i`, so setting the same pool and seed again repeats the same starts.
+        """
+        flat_states = None if flat_states is None else np.asarray(flat_states, np.float64)
+        for worker in range(self.num_workers):
+            self._send(worker, "set_reset_pool", (flat_states, None if seed is None else seed + worker))
+        [remote.recv() for remote in self.remotes]
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.waiting:
+            self.step_wait()
+        for worker in range(self.num_workers):
+            self._send(worker, "close", None)
+        for process in self.processes:
+            process.join()
         for remote in self.remotes:
-            remote.send(("get_state", None))
-        return [remote.recv() for remote in self.remotes]
+            remote.close()
+        if self._buffers is not None:
+            self._buffers.close()
+        self.closed = True
+
     def getattr_depth_check(self, *args, **kwargs):
         return None
 
+class SubprocVecEnvGroup:
+    """
+    A contiguous subset of the workers of a `SubprocVecEnv` exposed as a vectorized env of its own
+    """
+    def __init__(self, venv: SubprocVecEnv, workers: range):
+        self.venv = venv
+        self.workers = workers
+        self.rows = venv._env_rows(workers)
+        self.num_envs = self.rows.stop - self.rows.start
+        self.observation_space = venv.observation_space
+        self.action_space = venv.action_space
+        self.waiting = False
+
+    def step_async(self, actions) -> None:
+        self.venv._step_async(actions, self.workers)
+        self.waiting = True
+
+    def step_wait(self) -> Tuple[np.array]:
+        results = self.venv._step_wait(self.workers)
+        self.waiting = False
+        return results
+
+    def reset(self) -> np.array:
+        return self.venv._reset(self.workers)
+
+    def step(self, actions: Iterable) -> Tuple[np.array]:
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self) -> None:
+        if self.waiting:
+            self.step_wait()
+
+    def getattr_depth_check(self, *args, **kwargs):
+        return None
+
+
+class GroupedVecEnv:
+    """
+    Environments split into groups that can be stepped independently, every group is wrapped into its own `VecNormalize`
+    (unless both `norm_obs` and `norm_r` are off, then the groups return raw observations and rewards).
+    With `shared_stats` all groups share the running statistics, so that stepping the whole batch with `step`
+    behaves like a single `VecNormalize(SubprocVecEnv)` and the policy can run on one group while the others
+    simulate (see `utils.collect_experience_pipelined`).
+    Without it every group normalizes on its own, e.g. one group per seed in multi-seed training.
+    """
+    def __init__(self, venv: SubprocVecEnv, num_groups: int, norm_obs=True, norm_r=True, shared_stats=True):
+        self.venv = venv
+        self.shared_stats = shared_stats
+        self.groups = self._venv_groups = venv.split(num_groups)
+        if norm_obs or norm_r:
+            from stable_baselines3.common.vec_env.vec_normalize import VecNormalize
+            self.groups = [VecNormalize(group, norm_obs=norm_obs, norm_reward=norm_r) for group in self.groups]
+            if shared_stats:
+                for group in self.groups[1:]:
+                    if norm_obs:
+                        group.obs_rms = self.groups[0].obs_rms
+                    group.ret_rms = self.groups[0].ret_rms
+        self.group_rows = [group.rows for group in self._venv_groups]
+        self.num_envs = venv.num_envs
+        self.observation_space = venv.observation_space
+        self.action_space = venv.action_space
+
+    @property
+    def training(self) -> bool:
+        return getattr(self.groups[0], 'training', True)
+
+    @training.setter
+    def training(self, training: bool) -> None:
+        for group in self.groups:
+            group.training = training
+
+    @property
+    def obs_rms(self):
+        if not self.shared_stats:
+            raise AttributeError('groups keep separate statistics, use `groups[i].obs_rms`')
+        return self.groups[0].obs_rms
+
+    @obs_rms.setter
+    def obs_rms(self, obs_rms) -> None:
+        if not self.shared_stats:
+            raise AttributeError('groups keep separate statistics, use `groups[i].obs_rms`')
+        for group in self.groups:
+            group.obs_rms = obs_rms
+
+    @property
+    def old_reward(self) -> np.array:
+        return np.concatenate([group.old_reward for group in self.groups])
+
+    def reset(self) -> np.array:
+        return np.concatenate([group.reset() for group in self.groups])
+
+    def step(self, actions: Iterable) -> Tuple[np.array]:
+        for group, rows in zip(self.groups, self.group_rows):
+            group.step_async(actions[rows])
+        obs, rews, dones, infos = zip(*[group.step_wait() for group in self.groups])
+        return np.concatenate(obs), np.concatenate(rews), np.concatenate(dones), sum(map(list, infos), [])
+
+    def close(self) -> None:
+        for group in self._venv_groups:
+            group.close()
+        self.venv.close()
+
+
 def _flatten_obs(obs: List[np.array]) -> np.array:
-    stacked = np.stack(obs)
+    stacked = np.concatenate(obs)
     return stacked
 
 
-def create_env(name: str = 'HalfCheetah-v3', env_state: Optional[MjSimState] = None, seed=None):
+def create_env(name: str = 'HalfCheetah-v3', env_state: Optional['MjSimState'] = None, seed=None):
+    # gym (and the simulator behind the env) is imported by the worker that builds the env
+    import gym
     env = gym.make(name)
     env.reset()
     if env_state:
@@ -108,18 +517,87 @@ def create_env(name: str = 'HalfCheetah-v3', env_state: Optional[MjSimState] = N
         env.seed(seed)
     return env
 
-def make_env_fn(name: str = 'HalfCheetah-v3', env_state: Optional[MjSimState] = None, seed=None):
+def collect_start_states(venv: SubprocVecEnv, num_states: int) -> np.array:
+    """ `[num_states, state_dim]` initial states of fresh episodes (`env.reset()`), for `set_reset_pool` """
+    states = []
+    while sum(map(len, states)) < num_states:
+        venv.reset()
+        states.append(venv.get_flat_state())
+    return np.concatenate(states)[:num_states]
+
+
+def split_cpus(learner_cpus: int = 1) -> Optional[Tuple[List[int], List[int]]]:
+    """
+    Splits the cpus this process may run on into `learner_cpus` for the trainer (its XLA threads)
+    and the rest for env workers, None when there are not enough cpus to give both their own.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) <= learner_cpus:
+        return None
+    return cpus[:learner_cpus], cpus[learner_cpus:]
+
+
+def pin_process(cpus: Iterable[int]) -> None:
+    """
+    Restricts every thread of this process to `cpus`, threads started later inherit it. Call before jax is imported,
+    XLA sizes its thread pools by the cpus available when the backend starts.
+    """
+    cpus = list(cpus)
+    for thread in os.listdir('/proc/self/task'):
+        try:
+            os.sched_setaffinity(int(thread), cpus)
+        except ProcessLookupError:
+            # the thread ended meanwhile
+            pass
+
+
+def worker_modules(name: str) -> List[str]:
+    """ What an env worker imports: this module and the module that defines the gym env `name` """
+    import gym
+    entry_point = gym.spec(name).entry_point
+    modules = [__name__, 'gym']
+    if isinstance(entry_point, str):
+        modules.append(entry_point.split(':')[0])
+    return modules
+
+
+def preload_worker_modules(name: str) -> None:
+    """
+    Workers started with forkserver (the default of `SubprocVecEnv`) are forked from a server process that only
+    preloads the `__main__` module, every worker then imports gym and the env itself. Call before creating the envs
+    to preload `worker_modules(name)` too, so every worker is forked with them already imported.
+    `__main__` is imported by the server (and by every worker, if it is not preloaded) regardless, keep it light:
+    `run_a2c_train.py` imports the trainer under `if __name__ == '__main__'` only.
+    """
+    mp.set_forkserver_preload(['__main__'] + worker_modules(name))
+
+
+def make_env_fn(name: str = 'HalfCheetah-v3', env_state: Optional['MjSimState'] = None, seed=None):
     env_fn = functools.partial(create_env, name=name, env_state=env_state, seed=seed)
     return env_fn
 
 def make_vec_env(
     name: str = 'HalfCheetahEnv', 
-    env_state: Optional[MjSimState] = None, 
+    env_state: Optional['MjSimState'] = None, 
     num: int = 4, norm_r=True, 
     norm_obs=True, 
-    seed=None):
+    seed=None,
+    shared_memory=False,
+    envs_per_worker=1,
+    num_groups=1,
+    shared_stats=True,
+    worker_cpus=None):
     if seed is None:
         env_func_list = [make_env_fn(name=name, env_state=env_state, seed=seed) for _ in range(num)]
     else:
         env_func_list = [make_env_fn(name=name, env_state=env_state, seed=seed+i) for i in range(num)]
-    return VecNormalize(SubprocVecEnv(env_func_list), norm_obs=norm_obs, norm_reward=norm_r)
+    venv = SubprocVecEnv(
+        env_func_list, shared_memory=shared_memory, envs_per_worker=envs_per_worker, worker_cpus=worker_cpus)
+    if num_groups > 1:
+        return GroupedVecEnv(venv, num_groups, norm_obs=norm_obs, norm_r=norm_r, shared_stats=shared_stats)
+    if not (norm_obs or norm_r):
+        # the trainer normalizes on device with the statistics in its `TrainState` (`utils.normalize_experience`)
+        return venv
+    # imported here, stable_baselines3 is only needed for host-side normalization
+    from stable_baselines3.common.vec_env.vec_normalize import VecNormalize
+    return VecNormalize(venv, norm_obs=norm_obs, norm_reward=norm_r)
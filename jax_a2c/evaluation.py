@@ -1,30 +1,187 @@
-from typing import Callable
+import functools
+import queue
+import threading
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
 
 import flax
 import jax
-import jax.numpy as jnp
 import numpy as np
 
 import jax_a2c.env_utils
+from jax_a2c.normalization import RunningMeanStd, normalize_obs
+
+
+@functools.partial(jax.jit, static_argnums=(0,))
+def deterministic_policy(
+        apply_fn: Callable, params: flax.core.frozen_dict, observation, obs_rms: Optional[RunningMeanStd] = None):
+    # module level, so every evaluation reuses the executable compiled for the first one
+    if obs_rms is not None:
+        observation = normalize_obs(obs_rms, observation)
+    values, (action_means, action_log_stds) = apply_fn({'params': params}, observation)
+    return action_means
+
+class EvalResult(NamedTuple):
+    mean: float
+    ci_low: float
+    ci_high: float
+    returns: np.ndarray  # return of every finished episode
+    lengths: np.ndarray
+
+
+def confidence_interval(returns: np.ndarray, z: float = 1.96) -> Tuple[float, float]:
+    """ Normal approximation of the confidence interval of the mean return, 95% by default """
+    mean = returns.mean()
+    if len(returns) < 2:
+        return mean, mean
+    half_width = z * returns.std(ddof=1) / np.sqrt(len(returns))
+    return mean - half_width, mean + half_width
+
+
+def _stream_episodes(apply_fn, params, env, num_episodes, max_steps, obs_rms, start_states=None):
+    env.training = False
+    num_envs = env.num_envs
+    # with a SubprocVecEnv (under a VecNormalize or not) only the workers that still run episodes are stepped
+    venv = env if isinstance(env, jax_a2c.env_utils.SubprocVecEnv) else getattr(env, 'venv', None)
+    venv = venv if isinstance(venv, jax_a2c.env_utils.SubprocVecEnv) else None
+    normalize = env.normalize_obs if venv is not env else lambda obs: obs
+
+    if start_states is None:
+        observations = np.array(env.reset())
+    else:
+        # env i starts from state i, episodes after the first ones from states drawn with a fixed seed
+        venv.set_reset_pool(start_states, seed=0)
+        observations = np.array(normalize(venv.restart(start_states[np.arange(num_envs) % len(start_states)])))
+    rewards = np.zeros(num_envs)
+    dones = np.zeros(num_envs, dtype=bool)
+    returns = np.zeros(num_envs)
+    lengths = np.zeros(num_envs, dtype=np.int64)
+    active = np.arange(num_envs) < num_episodes
+    started = int(active.sum())
+    episode_returns = np.zeros(num_episodes)
+    episode_lengths = np.zeros(num_episodes, dtype=np.int64)
+    finished = 0
+
+    while active.any():
+        actions = np.asarray(deterministic_policy(apply_fn, params, observations, obs_rms))
+        if venv is not None:
+            workers = [worker for worker, rows in enumerate(venv._rows) if active[rows].any()]
+            for rows, (obs, step_rewards, step_dones, _) in venv.step_workers(actions, workers):
+                observations[rows] = normalize(obs)
+                rewards[rows] = step_rewards
+                dones[rows] = step_dones
+        else:
+            observations[:], _, dones[:], _ = env.step(actions)
+            rewards[:] = env.old_reward
+
+        returns += np.where(active, rewards, 0.)
+        lengths += active
+        for i in np.flatnonzero(active & (dones | (lengths >= max_steps))):
+            episode_returns[finished] = returns[i]
+            episode_lengths[finished] = lengths[i]
+            finished += 1
+            returns[i] = lengths[i] = 0
+            # finished envs were reset by their worker and can run another episode, cut ones can not
+            if dones[i] and started < num_episodes:
+                started += 1
+            else:
+                active[i] = False
+    if start_states is not None:
+        venv.set_reset_pool(None)
+    return observations, episode_returns[:finished], episode_lengths[:finished]
+
+
+def evaluate_episodes(
+    apply_fn: Callable, 
+    params: flax.core.frozen_dict, 
+    env: jax_a2c.env_utils.SubprocVecEnv,
+    num_episodes: Optional[int] = None,
+    max_steps: int = 1000,
+    obs_rms: Optional[RunningMeanStd] = None,
+    start_states: Optional[np.ndarray] = None) -> EvalResult:
+    """
+    Deterministic evaluation of `num_episodes` episodes (one per env by default). Returns are accumulated
+    in fixed arrays as the rewards arrive and envs that finished their share of episodes are not stepped anymore.
+    An env runs further episodes while fewer than `num_episodes` have been started, episodes are cut at `max_steps`.
+    With `obs_rms` the policy normalizes the raw observations of `env` with these statistics.
+    With `start_states` (flat states, see `env_utils.SubprocVecEnv.restart`) episodes start from these states,
+    so every evaluation sees the same starts.
+    """
+    num_episodes = env.num_envs if num_episodes is None else num_episodes
+    _, returns, lengths = _stream_episodes(apply_fn, params, env, num_episodes, max_steps, obs_rms, start_states)
+    return EvalResult(float(returns.mean()), *map(float, confidence_interval(returns)), returns=returns, lengths=lengths)
 
 
 def eval(
     apply_fn: Callable, 
     params: flax.core.frozen_dict, 
-    env: jax_a2c.env_utils.SubprocVecEnv):
-    apply_fn = jax.jit(apply_fn)
-    env.training = False
-    observation = env.reset()
-    total_reward = []
-    cumdones = jnp.zeros(shape=(observation.shape[0],))
-    dones = [np.array(observation.shape[0]*[False])]
-    for _ in range(1000):
-        values, (action_means, action_log_stds) = apply_fn({'params': params}, observation)
-        observation, reward, done, info = env.step(action_means)
-        cumdones += done
-        total_reward.append(env.old_reward) 
-        dones.append(done)
-        if cumdones.all():
-            break
-    masks = jnp.cumprod(1-jnp.array(dones), axis=0)[:-1]
-    return observation, (jnp.array(total_reward)*masks).sum(axis=0).mean().item()
+    env: jax_a2c.env_utils.SubprocVecEnv,
+    obs_rms: Optional[RunningMeanStd] = None):
+    observation, returns, _ = _stream_episodes(apply_fn, params, env, env.num_envs, max_steps=1000, obs_rms=obs_rms)
+    return observation, returns.mean().item()
+
+
+class AsyncEvaluator:
+    """
+    Runs `evaluate_fn(*snapshot)` on snapshots (params, normalization statistics, ...) in a background thread,
+    so training does not wait for evaluation episodes. Only the latest snapshot is kept: if the evaluator
+    falls behind, a pending snapshot is replaced by the newer one and counted in `dropped`.
+    Env stepping waits on worker pipes and jax releases the GIL, so a thread is enough.
+    """
+    def __init__(self, evaluate_fn: Callable):
+        self.evaluate_fn = evaluate_fn
+        self.dropped = 0
+        self._snapshots = queue.Queue(maxsize=1)
+        self._results = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            snapshot = self._snapshots.get()
+            if snapshot is None:
+                return
+            update, args = snapshot
+            try:
+                self._results.put((update, self.evaluate_fn(*args)))
+            except Exception as error:
+                self._error = error
+                return
+
+    def submit(self, update: int, *args) -> None:
+        """ Queues `args` taken at training update `update`, they must not be mutated by the trainer afterwards
+        """
+        self._raise_error()
+        while True:
+            try:
+                self._snapshots.put_nowait((update, args))
+                return
+            except queue.Full:
+                try:
+                    self._snapshots.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def results(self) -> List[Tuple[int, Any]]:
+        """ (update, score) of every evaluation finished since the last call, never blocks
+        """
+        self._raise_error()
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self) -> List[Tuple[int, Any]]:
+        """ Finishes the pending snapshot, stops the thread and returns the remaining results
+        """
+        if self._thread.is_alive():
+            self._snapshots.put(None)
+            self._thread.join()
+        return self.results()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError('evaluation failed') from self._error
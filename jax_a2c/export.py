@@ -0,0 +1,120 @@
+"""
+Exports the actor of a training checkpoint (written by `saving.save_state`) for inference: the actor tower,
+action log stds and observation statistics go into a small .npz read by `inference.load_exported` with NumPy only,
+the critic and the optimizer state are dropped. The layout (separate, fused or shared-trunk, see `policy.py`)
+and the layer sizes are read from the parameters, so no model config is needed.
+Optionally the forward pass, params included, is also serialized with `jax.export` (StableHLO) for runtimes
+that execute it without this package; `load_stablehlo` calls it back from jax.
+
+    python -m jax_a2c.export checkpoints/model-1000 policy.npz --stablehlo policy.stablehlo
+"""
+import argparse
+from typing import Any, Callable, List, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from jax_a2c.inference import ExportedPolicy, load_exported, save_exported
+from jax_a2c.normalization import CLIP_OBS, EPSILON
+from jax_a2c.policy import LOG_SIG_MAX, LOG_SIG_MIN
+from jax_a2c.saving import read_checkpoint
+
+Array = Any
+
+
+def _dense(layer) -> Tuple[np.ndarray, np.ndarray]:
+    return np.array(layer['kernel'], np.float32), np.array(layer['bias'], np.float32)
+
+
+def actor_layers(params: dict) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """ (kernel, bias) of the hidden layers of the actor tower, for every layout of `policy.make_policy` """
+    if 'Trunk_0' in params:
+        return [_dense(params[f'Trunk_{i}']) for i in range(sum(k.startswith('Trunk_') for k in params))]
+    if 'Towers_0' in params:
+        # actor half of the side by side kernels, then Actor_1..
+        kernel, bias = _dense(params['Towers_0'])
+        h_size = kernel.shape[1] // 2
+        num_layers = 1 + sum(k.startswith('Actor_') and k != 'Actor_means' for k in params)
+        return [(kernel[:, h_size:], bias[h_size:])] + [_dense(params[f'Actor_{i}']) for i in range(1, num_layers)]
+    # DiagGaussianPolicy: the critic tower owns Dense_0..Dense_{n-1}, the actor Dense_n..Dense_{2n-1}
+    num_layers = sum(k.startswith('Dense_') for k in params) // 2
+    return [_dense(params[f'Dense_{num_layers + i}']) for i in range(num_layers)]
+
+
+def export_policy(checkpoint: str, norm_obs: bool = True) -> ExportedPolicy:
+    """ The actor of `checkpoint`, `norm_obs` must match the training setting """
+    _, state_dict = read_checkpoint(checkpoint)
+    params = state_dict['params']
+    obs_mean = obs_var = None
+    if norm_obs:
+        if 'norm_state' not in state_dict:
+            raise ValueError(f'{checkpoint} has no observation statistics (written before they were part of the '
+                             'train state), export it with norm_obs=False')
+        obs_rms = state_dict['norm_state']['obs_rms']
+        obs_mean, obs_var = np.array(obs_rms['mean'], np.float32), np.array(obs_rms['var'], np.float32)
+    return ExportedPolicy(
+        layers=actor_layers(params),
+        means=_dense(params['Actor_means']),
+        log_stds=np.clip(np.array(params['Action_log_stds'], np.float32), LOG_SIG_MIN, LOG_SIG_MAX),
+        obs_mean=obs_mean, obs_var=obs_var, clip_obs=CLIP_OBS, epsilon=EPSILON, step=int(state_dict['step']))
+
+
+def _jax_export():
+    """ (export, serialize, deserialize, call) of `jax.export`, or of `jax.experimental.export` before jax 0.4.30 """
+    try:
+        from jax import export
+        return export.export, lambda exported: exported.serialize(), export.deserialize, lambda exported: exported.call
+    except ImportError:
+        from jax.experimental.export import export, serialization
+        return export.export, serialization.serialize, serialization.deserialize, export.call_exported
+
+
+def _symbolic_batch():
+    try:
+        from jax.export import symbolic_shape
+    except ImportError:
+        from jax.experimental.export.export import symbolic_shape
+    return symbolic_shape('batch')[0]
+
+
+def export_stablehlo(policy: ExportedPolicy, path: str) -> None:
+    """ Serializes `policy.forward` with the params as constants, for observation batches of any size """
+    def forward(observations):
+        x = observations
+        if policy.obs_mean is not None:
+            x = jnp.clip((x - policy.obs_mean) / jnp.sqrt(policy.obs_var + policy.epsilon),
+                         -policy.clip_obs, policy.clip_obs)
+        for kernel, bias in policy.layers:
+            x = jnp.tanh(x @ kernel + bias)
+        kernel, bias = policy.means
+        return x @ kernel + bias
+
+    export, serialize, _, _ = _jax_export()
+    exported = export(jax.jit(forward))(jax.ShapeDtypeStruct((_symbolic_batch(), policy.obs_dim), jnp.float32))
+    with open(path, 'wb') as handle:
+        handle.write(serialize(exported))
+
+
+def load_stablehlo(path: str) -> Callable[[Array], Array]:
+    _, _, deserialize, call = _jax_export()
+    with open(path, 'rb') as handle:
+        exported = deserialize(bytearray(handle.read()))
+    return jax.jit(call(exported))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export the actor of a checkpoint for NumPy-only inference')
+    parser.add_argument('checkpoint', type=str, help='checkpoint file written by training (`--save`)')
+    parser.add_argument('output', type=str, help='.npz file read by `jax_a2c.inference.load_exported`')
+    parser.add_argument('--no-norm-obs', dest='norm_obs', action='store_false',
+        help='the policy was trained without observation normalization')
+    parser.add_argument('--stablehlo', type=str, default=None, help='also write a serialized jax.export artifact')
+    cmd_args = parser.parse_args()
+
+    policy = export_policy(cmd_args.checkpoint, cmd_args.norm_obs)
+    save_exported(cmd_args.output, policy)
+    if cmd_args.stablehlo:
+        export_stablehlo(load_exported(cmd_args.output), cmd_args.stablehlo)
+    print(f'exported step {policy.step}: obs_dim {policy.obs_dim}, action_dim {policy.action_dim}, '
+          f'hidden {[k.shape[1] for k, _ in policy.layers]}, normalized observations: {policy.obs_mean is not None}')
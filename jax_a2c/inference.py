@@ -0,0 +1,89 @@
+"""
+Deterministic actions of an exported policy (see `export.py`) with NumPy only: importing this module and loading
+an artifact needs neither jax, flax nor optax, and no optimizer state is read.
+"""
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+class ExportedPolicy:
+    """
+    Actor tower of a `DiagGaussianPolicy` (any `policy.POLICIES` layout) and the observation statistics it was trained
+    with. `forward` normalizes raw observations like `normalization.normalize_obs` and returns the action means,
+    computed in float32 (policies trained with a bfloat16 compute dtype differ by the bfloat16 rounding).
+    """
+    def __init__(
+            self,
+            layers: List[Tuple[np.ndarray, np.ndarray]],
+            means: Tuple[np.ndarray, np.ndarray],
+            log_stds: np.ndarray,
+            obs_mean: Optional[np.ndarray] = None,
+            obs_var: Optional[np.ndarray] = None,
+            clip_obs: float = 10.,
+            epsilon: float = 1e-8,
+            step: int = 0):
+        self.layers = [(np.asarray(k, np.float32), np.asarray(b, np.float32)) for k, b in layers]
+        self.means = tuple(np.asarray(x, np.float32) for x in means)
+        self.log_stds = np.asarray(log_stds, np.float32)
+        self.obs_mean = None if obs_mean is None else np.asarray(obs_mean, np.float32)
+        self.obs_var = None if obs_var is None else np.asarray(obs_var, np.float32)
+        self.clip_obs = clip_obs
+        self.epsilon = epsilon
+        self.step = step
+        self._obs_std = None if obs_var is None else np.sqrt(self.obs_var + np.float32(epsilon))
+
+    @property
+    def obs_dim(self) -> int:
+        return self.layers[0][0].shape[0] if self.layers else self.means[0].shape[0]
+
+    @property
+    def action_dim(self) -> int:
+        return self.means[0].shape[1]
+
+    def forward(self, observations: np.ndarray) -> np.ndarray:
+        """ Action means for raw observations of shape [..., obs_dim] """
+        x = np.asarray(observations, np.float32)
+        if self.obs_mean is not None:
+            x = np.clip((x - self.obs_mean) / self._obs_std, -self.clip_obs, self.clip_obs)
+        for kernel, bias in self.layers:
+            x = np.tanh(x @ kernel + bias)
+        kernel, bias = self.means
+        return x @ kernel + bias
+
+    __call__ = forward
+
+
+def save_exported(path: str, policy: ExportedPolicy) -> None:
+    """ Writes `policy` as an uncompressed .npz, readable without pickle """
+    meta = dict(
+        version=FORMAT_VERSION, num_layers=len(policy.layers), normalized=policy.obs_mean is not None,
+        clip_obs=policy.clip_obs, epsilon=policy.epsilon, step=policy.step)
+    arrays = {'meta': np.asarray(json.dumps(meta)), 'means/kernel': policy.means[0], 'means/bias': policy.means[1],
+              'log_stds': policy.log_stds}
+    for i, (kernel, bias) in enumerate(policy.layers):
+        arrays[f'layers/{i}/kernel'], arrays[f'layers/{i}/bias'] = kernel, bias
+    if policy.obs_mean is not None:
+        arrays['obs/mean'], arrays['obs/var'] = policy.obs_mean, policy.obs_var
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        np.savez(handle, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_exported(path: str) -> ExportedPolicy:
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        if meta['version'] > FORMAT_VERSION:
+            raise ValueError(f'{path} has format version {meta["version"]}, this version reads up to {FORMAT_VERSION}')
+        return ExportedPolicy(
+            layers=[(data[f'layers/{i}/kernel'], data[f'layers/{i}/bias']) for i in range(meta['num_layers'])],
+            means=(data['means/kernel'], data['means/bias']),
+            log_stds=data['log_stds'],
+            obs_mean=data['obs/mean'] if meta['normalized'] else None,
+            obs_var=data['obs/var'] if meta['normalized'] else None,
+            clip_obs=meta['clip_obs'], epsilon=meta['epsilon'], step=meta['step'])
@@ -0,0 +1,194 @@
+"""
+Pure-JAX environments. Every env is a frozen dataclass (hashable, so it can be a static argument of `jax.jit`)
+with functional `reset(prngkey) -> (env_state, obs)` and `step(env_state, action) -> (env_state, obs, reward, done)`.
+`step` resets finished episodes itself, like `env_utils._worker` does.
+"""
+import dataclasses
+import functools
+from collections import namedtuple
+from typing import Any, Tuple
+
+import flax
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from jax_a2c.normalization import (NormalizationState, normalize_reset,
+                                   normalize_step)
+
+Array = Any
+PRNGKey = Any
+
+Space = namedtuple('Space', ['shape', 'dtype'])
+
+
+@flax.struct.dataclass
+class EnvState:
+    physics: Array
+    time: Array
+    prngkey: PRNGKey
+
+
+@dataclasses.dataclass(frozen=True)
+class JaxEnv:
+    max_episode_steps: int = 200
+
+    observation_shape = ()
+    action_dim = 0
+
+    def init_physics(self, prngkey: PRNGKey) -> Array:
+        raise NotImplementedError
+
+    def dynamics(self, physics: Array, action: Array) -> Tuple[Array, Array]:
+        """ physics, action -> next physics, reward """
+        raise NotImplementedError
+
+    def observe(self, physics: Array) -> Array:
+        raise NotImplementedError
+
+    def reset(self, prngkey: PRNGKey) -> Tuple[EnvState, Array]:
+        prngkey, init_key = jax.random.split(prngkey)
+        physics = self.init_physics(init_key)
+        return EnvState(physics=physics, time=jnp.zeros((), jnp.int32), prngkey=prngkey), self.observe(physics)
+
+    def step(self, state: EnvState, action: Array) -> Tuple[EnvState, Array, Array, Array]:
+        physics, reward = self.dynamics(state.physics, action)
+        time = state.time + 1
+        done = time >= self.max_episode_steps
+        reset_state, reset_obs = self.reset(state.prngkey)
+        state = jax.tree_map(
+            lambda r, s: jnp.where(done, r, s),
+            reset_state,
+            EnvState(physics=physics, time=time, prngkey=reset_state.prngkey))
+        return state, self.observe(state.physics), reward, done
+
+
+@dataclasses.dataclass(frozen=True)
+class Pendulum(JaxEnv):
+    """ gym's Pendulum-v1 """
+    max_speed: float = 8.
+    max_torque: float = 2.
+    dt: float = .05
+    g: float = 10.
+    m: float = 1.
+    l: float = 1.
+
+    observation_shape = (3,)
+    action_dim = 1
+
+    def init_physics(self, prngkey):
+        return jax.random.uniform(prngkey, (2,), minval=jnp.array([-jnp.pi, -1.]), maxval=jnp.array([jnp.pi, 1.]))
+
+    def dynamics(self, physics, action):
+        th, thdot = physics
+        u = jnp.clip(action[0], -self.max_torque, self.max_torque)
+        angle = ((th + jnp.pi) % (2 * jnp.pi)) - jnp.pi
+        cost = angle**2 + .1 * thdot**2 + .001 * u**2
+        thdot = thdot + (3 * self.g / (2 * self.l) * jnp.sin(th) + 3. / (self.m * self.l**2) * u) * self.dt
+        thdot = jnp.clip(thdot, -self.max_speed, self.max_speed)
+        th = th + thdot * self.dt
+        return jnp.stack([th, thdot]), -cost
+
+    def observe(self, physics):
+        th, thdot = physics
+        return jnp.stack([jnp.cos(th), jnp.sin(th), thdot])
+
+
+@dataclasses.dataclass(frozen=True)
+class PointMass(JaxEnv):
+    """ 2D point mass pushed towards the origin """
+    dt: float = .05
+    damping: float = .1
+
+    observation_shape = (4,)
+    action_dim = 2
+
+    def init_physics(self, prngkey):
+        return jnp.concatenate([jax.random.uniform(prngkey, (2,), minval=-1., maxval=1.), jnp.zeros(2)])
+
+    def dynamics(self, physics, action):
+        position, velocity = physics[:2], physics[2:]
+        action = jnp.clip(action, -1., 1.)
+        velocity = (1 - self.damping) * velocity + action * self.dt
+        position = position + velocity * self.dt
+        reward = -jnp.linalg.norm(position) - .01 * (action**2).sum()
+        return jnp.concatenate([position, velocity]), reward
+
+    def observe(self, physics):
+        return physics
+
+
+JAX_ENVS = dict(Pendulum=Pendulum, PointMass=PointMass)
+
+
+def make_jax_env(name: str) -> JaxEnv:
+    if name not in JAX_ENVS:
+        raise ValueError(f'Unknown jax environment `{name}`, available: {sorted(JAX_ENVS)}')
+    return JAX_ENVS[name]()
+
+
+@functools.partial(jax.jit, static_argnums=(0, 2))
+def vec_reset(env: JaxEnv, prngkey: PRNGKey, num_envs: int) -> Tuple[EnvState, Array]:
+    return jax.vmap(env.reset)(jax.random.split(prngkey, num_envs))
+
+
+@functools.partial(jax.jit, static_argnums=(0,))
+def vec_step(env: JaxEnv, state: EnvState, actions: Array) -> Tuple[EnvState, Array, Array, Array]:
+    return jax.vmap(env.step)(state, actions)
+
+
+@functools.partial(jax.jit, static_argnums=(0, 4, 5, 6))
+def _normalized_step(env, env_state, norm_state, actions, training, norm_obs, norm_r):
+    env_state, obs, rewards, dones = vec_step(env, env_state, actions)
+    norm_state, norm_obs_, norm_rewards = normalize_step(
+        norm_state, obs, rewards, dones, training=training, norm_obs=norm_obs, norm_r=norm_r)
+    return env_state, norm_state, norm_obs_, norm_rewards, rewards, dones
+
+
+class JaxVecEnv:
+    """
+    Host-side vectorized wrapper around a `JaxEnv` with the reset/step/normalize contract
+    of `VecNormalize(SubprocVecEnv)`: normalized numpy observations and rewards, `training`,
+    `obs_rms` and `old_reward`. Every step is a single jitted call.
+    """
+    def __init__(self, name: str, num: int = 4, norm_r=True, norm_obs=True, seed=None):
+        self.env = make_jax_env(name)
+        self.num_envs = num
+        self.norm_r = norm_r
+        self.norm_obs = norm_obs
+        self.training = True
+        self.observation_space = Space(shape=self.env.observation_shape, dtype=np.float32)
+        self.action_space = Space(shape=(self.env.action_dim,), dtype=np.float32)
+        self._prngkey = jax.random.PRNGKey(0 if seed is None else seed)
+        self._env_state = None
+        self._norm_state = NormalizationState.create(self.env.observation_shape, num)
+        self.old_reward = np.zeros(num, np.float32)
+
+    @property
+    def obs_rms(self):
+        return self._norm_state.obs_rms
+
+    @obs_rms.setter
+    def obs_rms(self, obs_rms) -> None:
+        self._norm_state = self._norm_state.replace(obs_rms=obs_rms)
+
+    @property
+    def ret_rms(self):
+        return self._norm_state.ret_rms
+
+    def reset(self) -> np.array:
+        self._prngkey, reset_key = jax.random.split(self._prngkey)
+        self._env_state, obs = vec_reset(self.env, reset_key, self.num_envs)
+        self._norm_state, obs = normalize_reset(
+            self._norm_state, obs, training=self.training, norm_obs=self.norm_obs)
+        return np.asarray(obs)
+
+    def step(self, actions) -> Tuple[np.array]:
+        self._env_state, self._norm_state, obs, rewards, raw_rewards, dones = _normalized_step(
+            self.env, self._env_state, self._norm_state, jnp.asarray(actions),
+            self.training, self.norm_obs, self.norm_r)
+        self.old_reward = np.asarray(raw_rewards)
+        return np.asarray(obs), np.asarray(rewards), np.asarray(dones), [{} for _ in range(self.num_envs)]
+
+    def close(self) -> None:
+        pass
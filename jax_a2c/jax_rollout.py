@@ -0,0 +1,156 @@
+"""
+Whole-update compilation for pure-JAX environments (see `jax_envs`): rollout, normalization,
+GAE and the gradient step of many updates run inside one `jax.lax.scan`,
+there is no host round trip per environment step or per update.
+"""
+import functools
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+import flax
+import jax
+import jax.numpy as jnp
+from flax.training.train_state import TrainState
+
+from jax_a2c.a2c import step
+from jax_a2c.distributions import sample_action_from_normal as sample_action
+from jax_a2c.jax_envs import EnvState, JaxEnv, vec_reset, vec_step
+from jax_a2c.normalization import (NormalizationState, RunningMeanStd,
+                                   normalize_obs, normalize_reset,
+                                   normalize_step)
+from jax_a2c.utils import process_experience
+
+Array = Any
+PRNGKey = Any
+
+
+class RolloutConfig(NamedTuple):
+    num_steps: int
+    gamma: float = .99
+    lambda_: float = .95
+    gae_method: str = 'scan'
+    value_loss_coef: float = .5
+    entropy_coef: float = .01
+    normalize_advantages: bool = True
+    norm_obs: bool = True
+    norm_r: bool = True
+    compute_dtype: str = 'float32'  # dtype the rollout observations are stored in
+
+
+@flax.struct.dataclass
+class RunnerState:
+    train_state: TrainState
+    env_state: EnvState
+    norm_state: NormalizationState
+    observations: Array  # normalized observations the policy acts on next
+    dones: Array
+    episode_returns: Array  # raw return of the episodes in progress
+    prngkey: PRNGKey
+
+
+def init_runner(
+        prngkey: PRNGKey, env: JaxEnv, train_state: TrainState, num_envs: int, norm_obs: bool = True,
+        norm_state: Optional[NormalizationState] = None) -> RunnerState:
+    """ `norm_state` continues from earlier statistics, e.g. `train_state.norm_state` of a checkpoint """
+    prngkey, reset_key = jax.random.split(prngkey)
+    env_state, observations = vec_reset(env, reset_key, num_envs)
+    if norm_state is None:
+        norm_state = NormalizationState.create(env.observation_shape, num_envs)
+    norm_state, observations = normalize_reset(norm_state, observations, norm_obs=norm_obs)
+    return RunnerState(
+        train_state=train_state,
+        env_state=env_state,
+        norm_state=norm_state,
+        observations=observations,
+        dones=jnp.zeros((num_envs,), bool),
+        episode_returns=jnp.zeros((num_envs,)),
+        prngkey=prngkey)
+
+
+def collect_experience(runner: RunnerState, env: JaxEnv, config: RolloutConfig) -> Tuple[RunnerState, Tuple, dict]:
+    """ jax counterpart of `utils.collect_experience`, returns the experience in the same layout
+    """
+    train_state = runner.train_state
+
+    def policy_fn(prngkey, observations):
+        values, (means, log_stds) = train_state.apply_fn({'params': train_state.params}, observations)
+        return values[..., 0], sample_action(prngkey, means, log_stds)
+
+    def env_step(runner, prngkey):
+        values, actions = policy_fn(prngkey, runner.observations)
+        env_state, next_observations, raw_rewards, dones = vec_step(env, runner.env_state, actions)
+        norm_state, next_observations, rewards = normalize_step(
+            runner.norm_state, next_observations, raw_rewards, dones,
+            norm_obs=config.norm_obs, norm_r=config.norm_r)
+        episode_returns = runner.episode_returns + raw_rewards
+        transition = (
+            runner.observations.astype(config.compute_dtype), actions, rewards, values, dones,
+            jnp.where(dones, episode_returns, 0.))
+        runner = runner.replace(
+            env_state=env_state,
+            norm_state=norm_state,
+            observations=next_observations,
+            dones=dones,
+            episode_returns=jnp.where(dones, 0., episode_returns))
+        return runner, transition
+
+    prngkey, rollout_key, value_key = jax.random.split(runner.prngkey, 3)
+    first_dones = runner.dones
+    runner, transitions = jax.lax.scan(env_step, runner, jax.random.split(rollout_key, config.num_steps))
+    observations, actions, rewards, values, dones, finished_returns = transitions
+    last_values, _ = policy_fn(value_key, runner.observations)
+
+    experience = (
+        observations,
+        actions,
+        rewards,
+        jnp.concatenate([values, last_values[None]]),
+        jnp.concatenate([first_dones[None], dones]))
+    episodes = dict(episode_return_sum=finished_returns.sum(), episodes=dones.sum())
+    return runner.replace(prngkey=prngkey), experience, episodes
+
+
+def update(runner: RunnerState, env: JaxEnv, config: RolloutConfig) -> Tuple[RunnerState, dict]:
+    """ One training update: rollout, GAE and gradient step """
+    runner, experience, episodes = collect_experience(runner, env, config)
+    trajectories = process_experience(
+        experience, gamma=config.gamma, lambda_=config.lambda_, gae_method=config.gae_method)
+    train_state, (loss, loss_dict) = step(
+        runner.train_state,
+        trajectories,
+        value_loss_coef=config.value_loss_coef,
+        entropy_coef=config.entropy_coef,
+        normalize_advantages=config.normalize_advantages)
+    return runner.replace(train_state=train_state), dict(loss=loss, **loss_dict, **episodes)
+
+
+@functools.partial(jax.jit, static_argnums=(1, 2, 3))
+def train(runner: RunnerState, env: JaxEnv, config: RolloutConfig, num_updates: int) -> Tuple[RunnerState, dict]:
+    """ `num_updates` updates compiled into a single scan, metrics are stacked along the first axis """
+    return jax.lax.scan(lambda runner, _: update(runner, env, config), runner, None, length=num_updates)
+
+
+@functools.partial(jax.jit, static_argnums=(0, 1, 5, 6))
+def evaluate(
+        apply_fn: Callable,
+        env: JaxEnv,
+        params: flax.core.frozen_dict,
+        obs_rms: RunningMeanStd,
+        prngkey: PRNGKey,
+        num_envs: int,
+        norm_obs: bool = True) -> Array:
+    """ Mean return of one deterministic episode in each of `num_envs` fresh environments """
+    env_state, observations = vec_reset(env, prngkey, num_envs)
+
+    def env_step(carry, _):
+        env_state, observations, alive, returns = carry
+        if norm_obs:
+            observations = normalize_obs(obs_rms, observations)
+        _, (action_means, _) = apply_fn({'params': params}, observations)
+        env_state, observations, rewards, dones = vec_step(env, env_state, action_means)
+        returns = returns + alive * rewards
+        alive = alive * jnp.logical_not(dones)
+        return (env_state, observations, alive, returns), None
+
+    carry = (env_state, observations, jnp.ones((num_envs,)), jnp.zeros((num_envs,)))
+    (_, _, _, returns), _ = jax.lax.scan(env_step, carry, None, length=env.max_episode_steps)
+    return returns.mean()
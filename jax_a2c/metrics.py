@@ -0,0 +1,148 @@
+"""
+Training metrics without syncing the training loop: `MetricsAccumulator` reduces the per-update losses on device
+over a logging window, `MetricsLogger` pulls the reduced values to host and writes them to the sinks
+in a background thread. A sink is any object with `write(step, record)` and `close()`.
+"""
+import csv
+import functools
+import json
+import math
+import queue
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+Array = Any
+
+
+@functools.partial(jax.jit, static_argnums=(1,))
+def _reduce(window: List[Dict[str, Array]], reductions: Tuple[Tuple[str, str], ...]) -> Dict[str, Array]:
+    reductions = dict(reductions)
+    reduce = dict(mean=jnp.mean, max=jnp.max, min=jnp.min)
+    return {k: reduce[reductions.get(k, 'mean')](jnp.stack([m[k] for m in window]), axis=0) for k in window[0]}
+
+
+class MetricsAccumulator:
+    """
+    Means (or `reductions={'name': 'max' | 'min'}`) of device metrics over the updates since the last `flush`.
+    The values stay on device: `add` only keeps references and `flush` reduces the window in one device call,
+    nothing is transferred to host.
+    """
+    def __init__(self, reductions: Optional[Dict[str, str]] = None):
+        self.reductions = tuple(sorted((reductions or {}).items()))
+        self._window = []
+
+    @property
+    def count(self) -> int:
+        return len(self._window)
+
+    def add(self, metrics: Dict[str, Array]) -> None:
+        self._window.append(metrics)
+
+    def flush(self) -> Dict[str, Array]:
+        """ Reduced metrics of the window as device arrays, the accumulator starts a new window """
+        if not self._window:
+            return {}
+        metrics = _reduce(self._window, self.reductions)
+        self._window = []
+        return metrics
+
+
+class MetricsLogger:
+    """
+    Feeds records `{name: number or device scalar}` to `sinks` from a background thread: the thread waits for
+    the device values, converts them to floats and writes them, so `log` never blocks the training loop.
+    NaN values mark missing metrics and are left out of the record.
+    """
+    def __init__(self, sinks: List[Any]):
+        self.sinks = sinks
+        self._records = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._records.get()
+            if item is None:
+                return
+            step, record = item
+            try:
+                record = {k: np.asarray(v).item() for k, v in jax.device_get(record).items()}
+                record = {k: v for k, v in record.items() if not (isinstance(v, float) and math.isnan(v))}
+                for sink in self.sinks:
+                    sink.write(step, record)
+            except Exception as error:
+                self._error = error
+                return
+
+    def log(self, step: int, record: Dict[str, Any]) -> None:
+        self._raise_error()
+        self._records.put((step, record))
+
+    def close(self) -> None:
+        """ Writes the queued records and closes the sinks """
+        if self._thread.is_alive():
+            self._records.put(None)
+            self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError('logging metrics failed') from self._error
+
+
+class WandbSink:
+    """ Every record is one wandb step, the run must be initialized by the caller """
+    def write(self, step: int, record: Dict[str, float]) -> None:
+        import wandb
+        wandb.log(record)
+
+    def close(self) -> None:
+        pass
+
+
+class CSVSink:
+    """ Long format `step,name,value`, one row per metric, so records with different names share one file """
+    def __init__(self, path: str):
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(('step', 'name', 'value'))
+
+    def write(self, step: int, record: Dict[str, float]) -> None:
+        self._writer.writerows((step, k, v) for k, v in record.items())
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JSONLSink:
+    """ One json object `{"step": ..., name: value, ...}` per record """
+    def __init__(self, path: str):
+        self._file = open(path, 'a')
+
+    def write(self, step: int, record: Dict[str, float]) -> None:
+        self._file.write(json.dumps(dict(step=step, **record)) + '\n')
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class MemorySink:
+    """ Keeps `(step, record)` pairs in `records` """
+    def __init__(self):
+        self.records = []
+
+    def write(self, step: int, record: Dict[str, float]) -> None:
+        self.records.append((step, record))
+
+    def close(self) -> None:
+        pass
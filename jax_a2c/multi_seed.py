@@ -0,0 +1,91 @@
+"""
+Training several seeds in one process: the `TrainState`s of all seeds are stacked along a leading axis
+(`create_train_state(..., num_seeds=N)`) and the policy, `process_experience` and `a2c.step` are vmapped over it,
+so all seeds share one compiled program. The rollout runs on `num_seeds * num_envs` environments,
+environments `[i * num_envs, (i + 1) * num_envs)` belong to seed `i`.
+"""
+import functools
+from typing import Any, Callable, List, Tuple
+
+import jax
+import jax.numpy as jnp
+
+from jax_a2c.a2c import step
+from jax_a2c.distributions import sample_action_from_normal as sample_action
+from jax_a2c.normalization import normalize_obs
+from jax_a2c.utils import normalize_experience, process_experience
+
+Array = Any
+PRNGKey = Any
+
+
+def seed_slice(tree: Any, seed: int) -> Any:
+    """ The part of a stacked pytree (states, metrics) that belongs to `seed` """
+    return jax.tree_map(lambda x: x[seed], tree)
+
+
+def stack_seeds(trees: List[Any]) -> Any:
+    return jax.tree_map(lambda *xs: jnp.stack(xs), *trees)
+
+
+def split_seeds(x: Array, num_seeds: int, axis: int = 0) -> Array:
+    """ [..., num_seeds * num_envs, ...] -> [num_seeds, ..., num_envs, ...] with the env axis at `axis` """
+    x = jnp.reshape(x, x.shape[:axis] + (num_seeds, -1) + x.shape[axis + 1:])
+    return jnp.moveaxis(x, axis, 0)
+
+
+def merge_seeds(x: Array, axis: int = 0) -> Array:
+    """ Inverse of `split_seeds` """
+    x = jnp.moveaxis(x, 0, axis)
+    return jnp.reshape(x, x.shape[:axis] + (-1,) + x.shape[axis + 2:])
+
+
+def make_policy_fn(apply_fn: Callable, num_seeds: int) -> Callable:
+    """ Policy over the whole `num_seeds * num_envs` batch, every seed acting with its own params
+    (and observation statistics `obs_rms`, if given) """
+
+    def seed_policy_fn(prngkey, observations, params, obs_rms):
+        if obs_rms is not None:
+            observations = normalize_obs(obs_rms, observations)
+        values, (means, log_stds) = apply_fn({'params': params}, observations)
+        return values, sample_action(prngkey, means, log_stds)
+
+    @jax.jit
+    def policy_fn(prngkey, observations, params, obs_rms=None):
+        values, actions = jax.vmap(seed_policy_fn)(
+            jax.random.split(prngkey, num_seeds), split_seeds(observations, num_seeds), params, obs_rms)
+        return merge_seeds(values), merge_seeds(actions)
+    return policy_fn
+
+
+def make_update_fn(
+        num_seeds: int,
+        gamma: float,
+        lambda_: float,
+        value_loss_coef: float,
+        entropy_coef: float,
+        normalize_advantages: bool,
+        gae_method: str = 'scan',
+        norm_obs: bool = False,
+        norm_r: bool = False) -> Callable:
+    """
+    Returns `update(states, experience) -> states, (loss, loss_dict)` that runs `process_experience` and `a2c.step`
+    for every seed, `experience` is the output of `collect_experience` over all environments.
+    With `norm_obs` / `norm_r` the raw rollout is first normalized with the statistics of every seed's state.
+    """
+    def seed_update(state, experience):
+        if norm_obs or norm_r:
+            state, experience = normalize_experience(state, experience, norm_obs, norm_r)
+        trajectories = process_experience(experience, gamma=gamma, lambda_=lambda_, gae_method=gae_method)
+        return step(
+            state,
+            trajectories,
+            value_loss_coef=value_loss_coef,
+            entropy_coef=entropy_coef,
+            normalize_advantages=normalize_advantages)
+
+    @jax.jit
+    def update(states, experience) -> Tuple[Any, Tuple[Array, dict]]:
+        experience = tuple(split_seeds(x, num_seeds, axis=1) for x in experience)
+        return jax.vmap(seed_update)(states, experience)
+    return update
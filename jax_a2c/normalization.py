@@ -0,0 +1,157 @@
+from typing import Any, Optional, Tuple
+
+import flax
+import jax
+import jax.numpy as jnp
+
+Array = Any
+
+# same defaults as stable_baselines3's VecNormalize
+CLIP_OBS = 10.
+CLIP_REWARD = 10.
+EPSILON = 1e-8
+RETURNS_GAMMA = .99
+
+
+@flax.struct.dataclass
+class RunningMeanStd:
+    """ Running mean and variance of a stream of batches (jax port of stable_baselines3's RunningMeanStd)
+    """
+    mean: Array
+    var: Array
+    count: Array
+
+    @classmethod
+    def create(cls, shape: Tuple[int, ...] = (), epsilon: float = 1e-4) -> 'RunningMeanStd':
+        return cls(
+            mean=jnp.zeros(shape, jnp.float32),
+            var=jnp.ones(shape, jnp.float32),
+            count=jnp.asarray(epsilon, jnp.float32))
+
+
+def update_running_mean_std(rms: RunningMeanStd, batch: Array) -> RunningMeanStd:
+    """ Merges the moments of `batch` (any number of leading batch axes) into `rms`
+    """
+    batch = jnp.reshape(batch, (-1,) + rms.mean.shape)
+    batch_mean = batch.mean(axis=0)
+    batch_var = batch.var(axis=0)
+    batch_count = batch.shape[0]
+
+    delta = batch_mean - rms.mean
+    total_count = rms.count + batch_count
+    new_mean = rms.mean + delta * batch_count / total_count
+    m_2 = rms.var * rms.count + batch_var * batch_count + delta**2 * rms.count * batch_count / total_count
+    return RunningMeanStd(mean=new_mean, var=m_2 / total_count, count=total_count)
+
+
+def normalize_obs(rms: RunningMeanStd, obs: Array, clip: float = CLIP_OBS, epsilon: float = EPSILON) -> Array:
+    return jnp.clip((obs - rms.mean) / jnp.sqrt(rms.var + epsilon), -clip, clip)
+
+
+def normalize_reward(
+        ret_rms: RunningMeanStd, rewards: Array, clip: float = CLIP_REWARD, epsilon: float = EPSILON) -> Array:
+    return jnp.clip(rewards / jnp.sqrt(ret_rms.var + epsilon), -clip, clip)
+
+
+@flax.struct.dataclass
+class NormalizationState:
+    """
+    Everything VecNormalize keeps between steps: observation statistics,
+    statistics of the discounted returns and the per-env discounted returns themselves.
+    """
+    obs_rms: RunningMeanStd
+    ret_rms: RunningMeanStd
+    returns: Array
+
+    @classmethod
+    def create(cls, obs_shape: Tuple[int, ...], num_envs: int) -> 'NormalizationState':
+        return cls(
+            obs_rms=RunningMeanStd.create(obs_shape),
+            ret_rms=RunningMeanStd.create(()),
+            returns=jnp.zeros((num_envs,), jnp.float32))
+
+
+def normalize_step(
+        state: NormalizationState,
+        obs: Array,
+        rewards: Array,
+        dones: Array,
+        training: bool = True,
+        norm_obs: bool = True,
+        norm_r: bool = True,
+        gamma: float = RETURNS_GAMMA) -> Tuple[NormalizationState, Array, Array]:
+    """ One VecNormalize.step_wait: updates the statistics (if training) and normalizes obs and rewards
+    """
+    obs_rms, ret_rms, returns = state.obs_rms, state.ret_rms, state.returns
+    if training and norm_obs:
+        obs_rms = update_running_mean_std(obs_rms, obs)
+    if training:
+        returns = returns * gamma + rewards
+        ret_rms = update_running_mean_std(ret_rms, returns)
+    if norm_obs:
+        obs = normalize_obs(obs_rms, obs)
+    if norm_r:
+        rewards = normalize_reward(ret_rms, rewards)
+    returns = jnp.where(dones, 0., returns)
+    return NormalizationState(obs_rms=obs_rms, ret_rms=ret_rms, returns=returns), obs, rewards
+
+
+def normalize_reset(
+        state: NormalizationState,
+        obs: Array,
+        training: bool = True,
+        norm_obs: bool = True) -> Tuple[NormalizationState, Array]:
+    """ VecNormalize.reset: clears the discounted returns and normalizes the first observations
+    """
+    obs_rms = state.obs_rms
+    if training and norm_obs:
+        obs_rms = update_running_mean_std(obs_rms, obs)
+    if norm_obs:
+        obs = normalize_obs(obs_rms, obs)
+    state = NormalizationState(obs_rms=obs_rms, ret_rms=state.ret_rms, returns=jnp.zeros_like(state.returns))
+    return state, obs
+
+
+
+def discounted_returns(returns: Array, rewards: Array, dones: Array, gamma: float = RETURNS_GAMMA) -> Tuple[Array, Array]:
+    """ The per-env discounted returns VecNormalize tracks, over a rollout `[num_steps, num_envs]`:
+    (returns after the rollout, returns at every step) """
+    def body(returns, inputs):
+        step_rewards, step_dones = inputs
+        returns = returns * gamma + step_rewards
+        return jnp.where(step_dones, 0., returns), returns
+    return jax.lax.scan(body, returns, (rewards, dones))
+
+
+def normalize_rollout(
+        state: NormalizationState,
+        observations: Array,
+        rewards: Array,
+        dones: Array,
+        norm_obs: bool = True,
+        norm_r: bool = True,
+        gamma: float = RETURNS_GAMMA,
+        axis_name: Optional[str] = None) -> Tuple[NormalizationState, Array, Array]:
+    """
+    `normalize_step` for a whole rollout `[num_steps, num_envs, ...]` at once: observations are normalized with the
+    statistics before the rollout (the ones the policy acted with), the statistics are then updated with the whole batch
+    and rewards are scaled with the updated return statistics. `dones[t]` ends the episode after step `t`.
+    Inside `pmap(..., axis_name)` the arrays are the device's share of the envs (`state` covers all of them),
+    the statistics are updated with the envs of all devices.
+    """
+    if norm_obs:
+        normalized_obs = normalize_obs(state.obs_rms, observations)
+    else:
+        normalized_obs = observations
+    if axis_name is not None:
+        num_envs = rewards.shape[1]
+        observations, rewards, dones = (
+            jax.lax.all_gather(x, axis_name, axis=1, tiled=True) for x in (observations, rewards, dones))
+    obs_rms = update_running_mean_std(state.obs_rms, observations) if norm_obs else state.obs_rms
+    returns, step_returns = discounted_returns(state.returns, rewards, dones, gamma)
+    ret_rms = update_running_mean_std(state.ret_rms, step_returns)
+    if norm_r:
+        rewards = normalize_reward(ret_rms, rewards)
+    if axis_name is not None:
+        rewards = jax.lax.dynamic_slice_in_dim(rewards, jax.lax.axis_index(axis_name) * num_envs, num_envs, axis=1)
+    return NormalizationState(obs_rms=obs_rms, ret_rms=ret_rms, returns=returns), normalized_obs, rewards
@@ -1,13 +1,15 @@
-from typing import Tuple
+import functools
+from typing import Any, Callable, Tuple
 
 import flax.linen as nn
 import jax
 import jax.numpy as jnp
+from flax.core import FrozenDict, freeze, unfreeze
 
 LOG_SIG_MAX = 2
 LOG_SIG_MIN = -20
 
-def constant_initializer(bias, dtype=jnp.float_):
+def constant_initializer(bias, dtype=jnp.float32):
     def init(key, shape, dtype=dtype):
         return jnp.ones(shape, jax.dtypes.canonicalize_dtype(dtype)) * bias
     return init
@@ -15,30 +17,142 @@ def constant_initializer(bias, dtype=jnp.float_):
 class DiagGaussianPolicy(nn.Module):
     """ Simple MLP-based policy,
     returns: critic's values, (actions' means, actions' log stds)
+    Layers compute in `dtype` (e.g. bfloat16), parameters and outputs are float32,
+    so log probs and entropies downstream are reduced in float32.
     """
     hidden_sizes: Tuple[int]
     action_dim: int
     init_log_std: float
+    dtype: Any = jnp.float32
     @nn.compact
     def __call__(self, inp):
         x = inp
         for h_size in self.hidden_sizes:
-            x = nn.Dense(features=h_size, kernel_init=nn.initializers.orthogonal(scale=jnp.sqrt(2)))(x)
+            x = nn.Dense(features=h_size, kernel_init=nn.initializers.orthogonal(scale=jnp.sqrt(2)), dtype=self.dtype)(x)
             x = nn.tanh(x)
         values = nn.Dense(
             features=1, 
             kernel_init=nn.initializers.orthogonal(scale=jnp.sqrt(2)), 
+            dtype=self.dtype,
             name='Critic_values')(x)
 
         x = inp
         for h_size in self.hidden_sizes:
-            x = nn.Dense(features=h_size, kernel_init=nn.initializers.orthogonal(scale=jnp.sqrt(2)))(x)
+            x = nn.Dense(features=h_size, kernel_init=nn.initializers.orthogonal(scale=jnp.sqrt(2)), dtype=self.dtype)(x)
             x = nn.tanh(x)
         action_means = nn.Dense(
             features=self.action_dim, name='Actor_means', 
-            kernel_init=nn.initializers.orthogonal())(x)
+            kernel_init=nn.initializers.orthogonal(), dtype=self.dtype)(x)
+        values, action_means = values.astype(jnp.float32), action_means.astype(jnp.float32)
         action_log_stds = self.param('Action_log_stds', constant_initializer(self.init_log_std), (self.action_dim,))
         action_log_stds = jnp.asarray(action_log_stds)
         action_log_stds = jnp.repeat(action_log_stds.reshape(1,-1), axis=0, repeats=x.shape[0])
         action_log_stds = jnp.clip(action_log_stds, a_min=LOG_SIG_MIN, a_max=LOG_SIG_MAX)
-        return values, (action_means, action_log_stds)
\ No newline at end of file
+        return values, (action_means, action_log_stds)
+
+class _DenseParams(nn.Module):
+    """ Kernel and bias of a dense layer, the caller applies them """
+    features: int
+    kernel_init: Callable = nn.initializers.lecun_normal()
+    @nn.compact
+    def __call__(self, in_features):
+        kernel = self.param('kernel', self.kernel_init, (in_features, self.features))
+        bias = self.param('bias', nn.initializers.zeros, (self.features,))
+        return kernel, bias
+
+class FusedDiagGaussianPolicy(nn.Module):
+    """ `DiagGaussianPolicy` tuned for small-batch inference: the first layers of the critic and the actor towers
+    read the same input, so they run as one matmul with concatenated kernels. Deeper layers stay per tower,
+    a block-diagonal matmul doubles the work and was slower on XLA:CPU (see benchmarks/bench_policy.py).
+    With `shared_trunk` both heads sit on one tower and run as one matmul too.
+    Action log stds are returned with shape (action_dim,) and broadcast against the means where they are used.
+    Layers compute in `dtype`, parameters and outputs are float32 like in `DiagGaussianPolicy`.
+    `fuse_params` converts `DiagGaussianPolicy` parameters (and checkpoints) to the separate towers layout.
+    """
+    hidden_sizes: Tuple[int]
+    action_dim: int
+    init_log_std: float
+    shared_trunk: bool = False
+    dtype: Any = jnp.float32
+    @nn.compact
+    def __call__(self, inp):
+        hidden_init = nn.initializers.orthogonal(scale=jnp.sqrt(2))
+        in_features = inp.shape[-1]
+        inp = inp.astype(self.dtype)
+        dense = functools.partial(_dense, dtype=self.dtype)
+        if self.shared_trunk:
+            x = inp
+            for i, h_size in enumerate(self.hidden_sizes):
+                kernel, bias = _DenseParams(h_size, hidden_init, name=f'Trunk_{i}')(in_features)
+                x = nn.tanh(dense(x, kernel, bias))
+                in_features = h_size
+            critic_x = actor_x = x
+        else:
+            critic_x = actor_x = inp
+            for i, h_size in enumerate(self.hidden_sizes):
+                if i == 0:
+                    # kernels of both towers stored side by side: [in, 2 * h_size]
+                    kernel, bias = _DenseParams(2 * h_size, hidden_init, name='Towers_0')(in_features)
+                    x = nn.tanh(dense(inp, kernel, bias))
+                    critic_x, actor_x = x[..., :h_size], x[..., h_size:]
+                else:
+                    critic_kernel, critic_bias = _DenseParams(h_size, hidden_init, name=f'Critic_{i}')(in_features)
+                    actor_kernel, actor_bias = _DenseParams(h_size, hidden_init, name=f'Actor_{i}')(in_features)
+                    critic_x = nn.tanh(dense(critic_x, critic_kernel, critic_bias))
+                    actor_x = nn.tanh(dense(actor_x, actor_kernel, actor_bias))
+                in_features = h_size
+
+        value_kernel, value_bias = _DenseParams(1, hidden_init, name='Critic_values')(in_features)
+        means_kernel, means_bias = _DenseParams(self.action_dim, nn.initializers.orthogonal(), name='Actor_means')(in_features)
+        if self.shared_trunk or not self.hidden_sizes:
+            x = dense(
+                critic_x,
+                jnp.concatenate([value_kernel, means_kernel], axis=1),
+                jnp.concatenate([value_bias, means_bias]))
+            values, action_means = x[..., :1], x[..., 1:]
+        else:
+            values = dense(critic_x, value_kernel, value_bias)
+            action_means = dense(actor_x, means_kernel, means_bias)
+        values, action_means = values.astype(jnp.float32), action_means.astype(jnp.float32)
+
+        action_log_stds = self.param('Action_log_stds', constant_initializer(self.init_log_std), (self.action_dim,))
+        action_log_stds = jnp.clip(action_log_stds, a_min=LOG_SIG_MIN, a_max=LOG_SIG_MAX)
+        return values, (action_means, action_log_stds)
+
+def _dense(x, kernel, bias, dtype):
+    return x @ kernel.astype(dtype) + bias.astype(dtype)
+
+def fuse_params(tree: Any, num_layers: int) -> Any:
+    """ Maps `DiagGaussianPolicy` parameters onto `FusedDiagGaussianPolicy(shared_trunk=False)` ones,
+    outputs are the same. Works on any tree that holds parameter trees (optimizer statistics, checkpoint state dicts),
+    parameter trees that are already fused are left as they are.
+    """
+    if isinstance(tree, FrozenDict):
+        return freeze(fuse_params(unfreeze(tree), num_layers))
+    if not isinstance(tree, dict):
+        return tree
+    if 'Critic_values' not in tree:
+        return {k: fuse_params(v, num_layers) for k, v in tree.items()}
+    if 'Dense_0' not in tree:
+        return tree
+    fused = {k: tree[k] for k in ('Critic_values', 'Actor_means', 'Action_log_stds')}
+    # the critic tower is built first, so it owns Dense_0..Dense_{n-1}
+    for i in range(num_layers):
+        critic, actor = tree[f'Dense_{i}'], tree[f'Dense_{num_layers + i}']
+        if i == 0:
+            fused['Towers_0'] = {k: jnp.concatenate([critic[k], actor[k]], axis=-1) for k in ('kernel', 'bias')}
+        else:
+            fused[f'Critic_{i}'], fused[f'Actor_{i}'] = critic, actor
+    return fused
+
+POLICIES = ('separate', 'fused', 'shared-trunk')
+
+def make_policy(
+        kind: str, hidden_sizes: Tuple[int], action_dim: int, init_log_std: float, dtype: Any = jnp.float32) -> nn.Module:
+    if kind == 'separate':
+        return DiagGaussianPolicy(hidden_sizes=hidden_sizes, action_dim=action_dim, init_log_std=init_log_std, dtype=dtype)
+    if kind in ('fused', 'shared-trunk'):
+        return FusedDiagGaussianPolicy(
+            hidden_sizes=hidden_sizes, action_dim=action_dim, init_log_std=init_log_std,
+            shared_trunk=kind == 'shared-trunk', dtype=dtype)
+    raise ValueError(f'Unknown policy `{kind}`, available: {POLICIES}')
@@ -0,0 +1,195 @@
+"""
+Where the training time goes: named phase timers, env steps/sec, step latency histograms of the env workers
+and XLA compilations, reported per logging window (`Profiler.window`) and as a table at exit (`Profiler.summary`).
+
+JAX dispatches asynchronously, so without fencing a phase that only launches device work measures the dispatch
+and the device time shows up in the first phase that waits for the result. With `fence=True` a phase blocks on
+the values passed to `fence` before it stops its timer, which attributes device time correctly but removes the
+overlap of host and device work, so throughput is lower than without profiling.
+Compilations are reported as the `xla_compile` phase, their time is also part of the phase that triggered them.
+"""
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+import jax
+import numpy as np
+
+from jax_a2c.env_utils import STEP_LATENCY_BINS, SubprocVecEnv
+
+COMPILE_EVENT = '/jax/core/compile/backend_compile_duration'
+
+_listening_profilers = []
+
+
+def _on_event_duration(event: str, duration: float, **kwargs) -> None:
+    if event == COMPILE_EVENT:
+        for profiler in _listening_profilers:
+            profiler._record_compile(duration)
+
+
+def latency_percentile(counts: np.array, q: float) -> float:
+    """ Upper bin edge (seconds) below which `q` percent of the steps counted in a latency histogram fall """
+    total = counts.sum()
+    if total == 0:
+        return float('nan')
+    edges = np.append(STEP_LATENCY_BINS, np.inf)
+    return float(edges[np.searchsorted(np.cumsum(counts), q / 100 * total)])
+
+
+class _Phase:
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self._values = []
+
+    def fence(self, *values) -> None:
+        """ Values the phase waits for before it stops its timer, when the profiler fences """
+        if self.profiler.fences:
+            self._values.extend(values)
+
+    def __enter__(self) -> '_Phase':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._values:
+            jax.block_until_ready(self._values)
+        self.profiler._record(self.name, time.perf_counter() - self._start)
+
+
+class _NullPhase:
+    def fence(self, *values) -> None:
+        pass
+
+    def __enter__(self) -> '_NullPhase':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Profiler:
+    """
+    `with profiler.phase('update') as phase: ...; phase.fence(outputs)` times a phase of the training loop.
+    A disabled profiler hands out a shared no-op phase, so the instrumentation can stay in place.
+    With `envs` the step latencies of its `SubprocVecEnv` workers are collected, with `trace_dir` and
+    `trace_updates=(start, stop)` a `jax.profiler` trace of updates `[start, stop)` is written.
+    """
+    def __init__(
+            self,
+            enabled: bool = True,
+            fence: bool = False,
+            envs: Any = None,
+            trace_dir: Optional[str] = None,
+            trace_updates: Optional[Tuple[int, int]] = None):
+        self.enabled = enabled
+        self.fences = enabled and fence
+        self.venv = _find_subproc_vec_env(envs) if enabled else None
+        self.trace_dir = trace_dir
+        self.trace_updates = trace_updates
+        self._tracing = False
+        self._start = self._window_start = time.perf_counter()
+        self._totals = defaultdict(lambda: [0, 0.])  # name -> [count, seconds]
+        self._window = defaultdict(lambda: [0, 0.])
+        self._env_steps = self._window_env_steps = 0
+        self._latency_counts = None
+        if enabled:
+            if not _listening_profilers:
+                jax.monitoring.register_event_duration_secs_listener(_on_event_duration)
+            _listening_profilers.append(self)
+
+    def phase(self, name: str):
+        return _Phase(self, name) if self.enabled else _NULL_PHASE
+
+    def _record(self, name: str, seconds: float) -> None:
+        for stats in (self._totals[name], self._window[name]):
+            stats[0] += 1
+            stats[1] += seconds
+
+    def _record_compile(self, seconds: float) -> None:
+        self._record('xla_compile', seconds)
+
+    def env_steps(self, num_steps: int) -> None:
+        self._env_steps += num_steps
+        self._window_env_steps += num_steps
+
+    def begin_update(self, update: int) -> None:
+        """ Starts and stops the trace window """
+        if self.trace_dir is None or self.trace_updates is None:
+            return
+        start, stop = self.trace_updates
+        if update == start and not self._tracing:
+            jax.profiler.start_trace(self.trace_dir)
+            self._tracing = True
+        elif update == stop and self._tracing:
+            jax.profiler.stop_trace()
+            self._tracing = False
+
+    def _collect_latencies(self) -> Optional[np.array]:
+        if self.venv is None:
+            return None
+        counts = self.venv.step_latency_counts()
+        self._latency_counts = counts if self._latency_counts is None else self._latency_counts + counts
+        return counts
+
+    def window(self) -> Dict[str, float]:
+        """ Metrics since the last call: mean milliseconds per phase call and their share of the wall time,
+        env steps/sec, worker step latency percentiles and compilations """
+        if not self.enabled:
+            return {}
+        now = time.perf_counter()
+        wall = now - self._window_start
+        record = {'profile/env_steps_per_sec': self._window_env_steps / wall}
+        for name, (count, seconds) in self._window.items():
+            record[f'profile/{name}_ms'] = 1e3 * seconds / count
+            record[f'profile/{name}_share'] = seconds / wall
+        record['profile/xla_compiles'] = self._window['xla_compile'][0]
+        counts = self._collect_latencies()
+        if counts is not None:
+            record['profile/worker_step_ms_p50'] = 1e3 * latency_percentile(counts.sum(0), 50)
+            record['profile/worker_step_ms_p99'] = 1e3 * latency_percentile(counts.sum(0), 99)
+            record['profile/slowest_worker_step_ms_p50'] = 1e3 * max(latency_percentile(c, 50) for c in counts)
+        self._window.clear()
+        self._window_env_steps = 0
+        self._window_start = now
+        return record
+
+    def summary(self) -> str:
+        """ Table of the whole run """
+        if not self.enabled:
+            return ''
+        wall = time.perf_counter() - self._start
+        lines = [
+            f'Profile: {wall:.1f}s wall, {self._env_steps / wall:.0f} env steps/s'
+            + (' (phases fenced)' if self.fences else ' (phases not fenced: jax work is timed where it is waited for)'),
+            f'{"phase":<20s}{"calls":>8s}{"total s":>10s}{"mean ms":>10s}{"share":>8s}']
+        for name, (count, seconds) in sorted(self._totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f'{name:<20s}{count:8d}{seconds:10.2f}{1e3 * seconds / count:10.3f}{seconds / wall:8.1%}')
+        self._collect_latencies()
+        if self._latency_counts is not None:
+            lines.append(f'{"worker step latency":<20s}{"steps":>8s}{"p50 ms":>10s}{"p90 ms":>10s}{"p99 ms":>10s}')
+            for worker, counts in enumerate(self._latency_counts):
+                percentiles = [1e3 * latency_percentile(counts, q) for q in (50, 90, 99)]
+                lines.append(f'{f"worker {worker}":<20s}{counts.sum():8d}' + ''.join(f'{p:10.3f}' for p in percentiles))
+        return '\n'.join(lines)
+
+    def close(self) -> None:
+        if self._tracing:
+            jax.profiler.stop_trace()
+            self._tracing = False
+        if self in _listening_profilers:
+            _listening_profilers.remove(self)
+
+
+def _find_subproc_vec_env(envs: Any) -> Optional[SubprocVecEnv]:
+    while envs is not None and not isinstance(envs, SubprocVecEnv):
+        envs = getattr(envs, 'venv', None)
+    return envs
+
+
+# stands in where no profiler is passed
+NULL_PROFILER = Profiler(enabled=False)
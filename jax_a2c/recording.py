@@ -0,0 +1,212 @@
+"""
+Raw rollouts on disk for debugging and offline analysis. `TrajectoryRecorder.record` takes the experience of an update
+(`utils.collect_experience`: observations, actions, raw rewards, values, dones) and optionally the advantages of
+`process_experience`, and only keeps references: a background thread transfers them to host and appends them to
+one memory-mapped column file per field. Every column row is one update (`[num_steps(+1), num_envs, ...]`),
+the files grow by doubling and `updates.bin` indexes which update every row holds.
+
+    directory/meta.json       fields, dtypes and row shapes, number of rows written
+    directory/{field}.bin     raw rows, C order
+    directory/updates.bin     int64 update of every row
+
+`TrajectoryReader` memory-maps the columns read-only, so selecting updates or envs reads only what is accessed.
+Recording into a directory that already holds a recording appends to it (e.g. after resuming from a checkpoint).
+"""
+import json
+import os
+import queue
+import threading
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+Array = Any
+
+EXPERIENCE_FIELDS = ('observations', 'actions', 'rewards', 'values', 'dones')
+FORMAT_VERSION = 1
+META = 'meta.json'
+INDEX = 'updates'
+
+
+class _Column:
+    """ Rows of a fixed dtype and shape in a memory-mapped file that grows by doubling """
+    def __init__(self, path: str, dtype, row_shape: Tuple[int, ...], length: int = 0, capacity: int = 16):
+        self.path = path
+        self.dtype = jnp.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.length = length
+        self.row_bytes = int(np.prod(self.row_shape)) * self.dtype.itemsize
+        self.rows = None
+        self._map(max(capacity, length, 1))
+
+    def _map(self, capacity: int) -> None:
+        if self.rows is not None:
+            self.rows.flush()
+            self.rows = None
+        with open(self.path, 'ab') as handle:
+            handle.truncate(capacity * self.row_bytes)
+        self.rows = np.memmap(self.path, self.dtype, 'r+', shape=(capacity,) + self.row_shape)
+
+    def append(self, row: np.ndarray) -> None:
+        if self.length == len(self.rows):
+            self._map(2 * len(self.rows))
+        self.rows[self.length] = row
+        self.length += 1
+
+    def close(self) -> None:
+        """ Flushes and cuts the file to the written rows """
+        self.rows.flush()
+        self.rows = None
+        with open(self.path, 'ab') as handle:
+            handle.truncate(self.length * self.row_bytes)
+
+
+def _read_meta(directory: str) -> Optional[dict]:
+    path = os.path.join(directory, META)
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+
+class TrajectoryRecorder:
+    """
+    Appends the rollouts passed to `record` to the recording in `directory` from a background thread.
+    `record` returns immediately unless `max_pending` updates are still waiting for the disk, then it waits
+    (rollouts are never dropped). Call `close` at the end, the files are usable after every written update.
+    """
+    def __init__(self, directory: str, max_pending: int = 8):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._columns = None
+        meta = _read_meta(directory)
+        if meta is not None:
+            # appending to an earlier recording
+            self._columns = {
+                name: _Column(self._path(name), dtype, shape, meta['num_rows'])
+                for name, (dtype, shape) in meta['fields'].items()}
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f'{name}.bin')
+
+    def record(self, update: int, experience: Sequence[Array], advantages: Optional[Array] = None) -> None:
+        """
+        `experience` as returned by `collect_experience`, `advantages` as returned by `process_experience`
+        (flat, reshaped like the rewards). Device arrays are only referenced, they must not be donated afterwards.
+        """
+        self._raise_error()
+        arrays = dict(zip(EXPERIENCE_FIELDS, experience))
+        if advantages is not None:
+            arrays['advantages'] = advantages
+        self._pending.put((update, arrays))
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            update, arrays = item
+            try:
+                # a list, pytrees of dicts come back with sorted keys
+                host = jax.device_get(list(arrays.values()))
+                self._write(update, {name: np.asarray(array) for name, array in zip(arrays, host)})
+            except Exception as error:
+                self._error = error
+                return
+
+    def _write(self, update: int, arrays: Dict[str, np.ndarray]) -> None:
+        if 'advantages' in arrays:
+            arrays['advantages'] = arrays['advantages'].reshape(arrays['rewards'].shape)
+        arrays[INDEX] = np.asarray(update, np.int64)
+        if self._columns is None:
+            self._columns = {
+                name: _Column(self._path(name), array.dtype, array.shape) for name, array in arrays.items()}
+        if set(arrays) != set(self._columns):
+            raise ValueError(f'recorded fields {sorted(arrays)} differ from the recording {sorted(self._columns)}')
+        for name, array in arrays.items():
+            column = self._columns[name]
+            if array.shape != column.row_shape or array.dtype != column.dtype:
+                raise ValueError(
+                    f'{name}: {array.dtype}{list(array.shape)} does not match the recording '
+                    f'{column.dtype}{list(column.row_shape)}')
+            column.append(array)
+        self._write_meta()
+
+    def _write_meta(self) -> None:
+        meta = dict(
+            version=FORMAT_VERSION,
+            num_rows=self._columns[INDEX].length,
+            fields={name: (column.dtype.name, column.row_shape) for name, column in self._columns.items()})
+        path = os.path.join(self.directory, META)
+        with open(f'{path}.tmp', 'w') as handle:
+            json.dump(meta, handle)
+        os.replace(f'{path}.tmp', path)
+
+    def close(self) -> None:
+        """ Writes the pending updates and cuts the files to their length """
+        if self._thread.is_alive():
+            self._pending.put(None)
+            self._thread.join()
+        if self._columns is not None:
+            for column in self._columns.values():
+                if column.rows is not None:
+                    column.close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError('recording trajectories failed') from self._error
+
+
+class TrajectoryReader:
+    """
+    Read-only view of a recording. `reader['rewards']` is a lazy `[num_rows, num_steps, num_envs]` memmap,
+    `reader.update(u)` the fields of update `u`, `reader.envs(rows)` every field restricted to some envs.
+    Only the rows listed in meta.json are mapped, so a recording can be read while it is written.
+    """
+    def __init__(self, directory: str):
+        meta = _read_meta(directory)
+        if meta is None:
+            raise FileNotFoundError(f'no recording in {directory}')
+        if meta['version'] > FORMAT_VERSION:
+            raise ValueError(f'{directory} was recorded with format version {meta["version"]}, '
+                             f'this version reads up to {FORMAT_VERSION}')
+        self.directory = directory
+        self.num_rows = meta['num_rows']
+        self._columns = {}
+        for name, (dtype, shape) in meta['fields'].items():
+            self._columns[name] = np.memmap(
+                os.path.join(directory, f'{name}.bin'), jnp.dtype(dtype), 'r', shape=(self.num_rows,) + tuple(shape))
+        self.updates = np.array(self._columns.pop(INDEX))
+        self._positions = {update: position for position, update in enumerate(self.updates)}
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return tuple(self._columns)
+
+    @property
+    def num_envs(self) -> int:
+        return self._columns['rewards'].shape[2]
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self._columns[field]
+
+    def update(self, update: int) -> Dict[str, np.ndarray]:
+        """ Fields of one recorded update, the latest one if it was recorded twice (resumed runs) """
+        position = self._positions[update]
+        return {name: column[position] for name, column in self._columns.items()}
+
+    def envs(self, envs) -> Dict[str, np.ndarray]:
+        """ Every field `[num_rows, num_steps(+1), len(envs), ...]` for an env index, slice or list """
+        if isinstance(envs, int):
+            envs = slice(envs, envs + 1)
+        return {name: column[:, :, envs] for name, column in self._columns.items()}
@@ -1,35 +1,181 @@
-from ctypes import Union
-from typing import Optional, Tuple
-from flax.training.train_state import TrainState
-import flax
+import glob
+import json
 import os
 import pickle
+import queue
+import re
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+
+import flax
 import jax
 import jax.numpy as jnp
-from flax.core import freeze
-from copy import deepcopy
+import numpy as np
+from flax.traverse_util import empty_node, flatten_dict, unflatten_dict
 
-from optax._src.base import EmptyState
-from optax._src.transform import ScaleByAdamState, ScaleByScheduleState
+# any flax struct, usually `utils.TrainState`; flax.training.train_state is not imported here, it pulls in optax
+TrainState = Any
 
+# Checkpoint layout: MAGIC | header length (uint64) | json header | arrays, every one at an ALIGNMENT-aligned offset
+# (relative to the aligned end of the header).
+# The header holds `additional`, python scalars of the state dict and (key, dtype, shape, offset) of every array,
+# so a checkpoint is loaded by memory-mapping the file without parsing or copying the arrays.
+MAGIC = b'A2CCKPT\x01'
+ALIGNMENT = 64
 
-def save_state(path: str, state: TrainState, additional: dict):
-    # pickling state dictionary. 
-    # State has all information about current train state: weights, optimizer stats and current step
-    state_dict = flax.serialization.to_state_dict(state)
-    with open(path, 'wb') as handle:
-        pickle.dump((additional, state_dict), handle, protocol=pickle.HIGHEST_PROTOCOL)
 
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
 
-def load_state(path: str, state: TrainState) -> Tuple[TrainState, dict]:
+
+def save_state(path: str, state: TrainState, additional: dict):
     """
-    loading state from pickled dictionary. In python 3.7 (and below?) use pickle5 library
+    Writes the state dictionary of `state` (weights, optimizer stats and current step) to `path`.
+    The file is written next to `path` and renamed over it, so a crash mid-write leaves the previous file intact.
     """
+    flat = flatten_dict(flax.serialization.to_state_dict(state), keep_empty_nodes=True)
+    arrays, scalars, empty = [], [], []
+    for key, value in flat.items():
+        if value is empty_node:
+            empty.append(key)
+        elif isinstance(value, (bool, int, float)):
+            scalars.append((key, value))
+        else:
+            arrays.append((key, np.asarray(jax.device_get(value))))
+
+    header = dict(additional=additional, scalars=scalars, empty=empty, arrays=[])
+    offset = 0
+    for key, array in arrays:
+        header['arrays'].append((key, array.dtype.name, array.shape, offset))
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
 
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(MAGIC)
+        handle.write(np.uint64(len(header_bytes)).tobytes())
+        handle.write(header_bytes)
+        for (_, array), (_, _, _, offset) in zip(arrays, header['arrays']):
+            handle.seek(data_start + offset)
+            handle.write(np.ascontiguousarray(array).data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: str) -> Tuple[dict, dict]:
+    """ (additional, state dict), arrays of the state dict are read-only views of the memory-mapped file """
     with open(path, 'rb') as handle:
-        additional, state_dict = pickle.load(handle)
-    state_dict = jax.tree_map(jnp.array, state_dict)
+        magic = handle.read(len(MAGIC))
+        if magic != MAGIC:
+            # checkpoints written before the binary layout: pickled (additional, state dict)
+            handle.seek(0)
+            return pickle.load(handle)
+        header_len = int(np.frombuffer(handle.read(8), np.uint64)[0])
+        header = json.loads(handle.read(header_len))
+    data_start = _align(len(MAGIC) + 8 + header_len)
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    flat = {}
+    for key, dtype, shape, offset in header['arrays']:
+        dtype = jnp.dtype(dtype)
+        count = int(np.prod(shape))
+        flat[tuple(key)] = np.frombuffer(buffer, dtype, count, data_start + offset).reshape(shape)
+    for key, value in header['scalars']:
+        flat[tuple(key)] = value
+    for key in header['empty']:
+        flat[tuple(key)] = empty_node
+    return header['additional'], unflatten_dict(flat)
+
+
+def load_state(path: str, state: TrainState, convert_fn: Optional[Callable] = None) -> Tuple[TrainState, dict]:
+    """
+    loading state saved by `save_state`, pickled checkpoints of earlier versions are loaded too.
+    `convert_fn` maps the loaded state dict onto the layout of `state`, e.g. `policy.fuse_params`
+    """
+    additional, state_dict = read_checkpoint(path)
+    if convert_fn is not None:
+        state_dict = convert_fn(state_dict)
+    if 'norm_state' not in state_dict and hasattr(state, 'norm_state'):
+        # checkpoints written before the normalization statistics were part of the state start with fresh ones
+        state_dict['norm_state'] = flax.serialization.to_state_dict(state.norm_state)
+    state_dict = jax.tree_map(jnp.asarray, state_dict)
     state_dict['step'] = state_dict['step'].item()
     state = flax.serialization.from_state_dict(state, state_dict)
-    
+
     return state, additional
+
+
+def checkpoint_path(prefix: str, step: int) -> str:
+    return f'{prefix}-{step}'
+
+
+def list_checkpoints(prefix: str) -> List[Tuple[int, str]]:
+    """ (step, path) of the checkpoints written by `CheckpointManager(prefix)`, oldest first """
+    pattern = re.compile(re.escape(os.path.basename(prefix)) + r'-(\d+)')
+    checkpoints = []
+    for path in glob.glob(glob.escape(prefix) + '-*'):
+        match = pattern.fullmatch(os.path.basename(path))
+        if match:
+            checkpoints.append((int(match.group(1)), path))
+    return sorted(checkpoints)
+
+
+def latest_checkpoint(path: str) -> Optional[str]:
+    """ `path` itself if it is a checkpoint file, otherwise the newest checkpoint of the `path` prefix """
+    if os.path.isfile(path):
+        return path
+    checkpoints = list_checkpoints(path)
+    return checkpoints[-1][1] if checkpoints else None
+
+
+class CheckpointManager:
+    """
+    Saves checkpoints `{prefix}-{step}` in a background thread and keeps the newest `keep` of them.
+    `save` only keeps a reference to the state (jax arrays are immutable), the transfer to host and the write
+    happen in the thread, so the training loop does not wait for the disk. Every checkpoint is written: if the
+    previous one is still being written when the next is pending, `save` waits (at most one state waits in memory).
+    """
+    def __init__(self, prefix: str, keep: int = 3):
+        assert keep >= 1
+        self.prefix = prefix
+        self.keep = keep
+        self._pending = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            step, state, additional = item
+            try:
+                save_state(checkpoint_path(self.prefix, step), state, additional)
+                for _, path in list_checkpoints(self.prefix)[:-self.keep]:
+                    os.remove(path)
+            except Exception as error:
+                self._error = error
+                return
+
+    def save(self, step: int, state: TrainState, additional: dict) -> None:
+        self._raise_error()
+        while True:
+            try:
+                self._pending.put((step, state, additional), timeout=1.)
+                return
+            except queue.Full:
+                # the writer is busy, unless it failed
+                self._raise_error()
+
+    def close(self) -> None:
+        """ Waits for the pending checkpoint to be written and stops the thread """
+        if self._thread.is_alive():
+            self._pending.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError('saving a checkpoint failed') from self._error
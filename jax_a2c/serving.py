@@ -0,0 +1,182 @@
+"""
+Serving a trained policy to many concurrent clients: `PolicyServer.act` is an asyncio API that returns the deterministic
+action (the mean, like `evaluation.eval`) for one raw observation. Requests are coalesced into batches: the requests
+that arrived while the previous batch was computed form the next one, with `max_delay > 0` a batch also waits up to
+`max_delay` seconds after its first request for more (up to the largest bucket size). Batches are padded to the next
+bucket size, so every batch runs one forward pass compiled ahead of time for its bucket.
+"""
+import asyncio
+import concurrent.futures
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import flax
+import jax
+import numpy as np
+
+from jax_a2c.evaluation import deterministic_policy
+from jax_a2c.normalization import NormalizationState, RunningMeanStd
+from jax_a2c.saving import load_state
+
+Array = Any
+ModelClass = Any
+
+DEFAULT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+@flax.struct.dataclass
+class PolicySnapshot:
+    """ The part of a training checkpoint the policy needs """
+    step: int
+    params: Any
+    norm_state: NormalizationState
+
+
+def load_policy(
+        path: str, model: ModelClass, obs_dim: int, norm_obs: bool = True,
+        convert_fn: Optional[Callable] = None) -> Tuple[Any, Optional[RunningMeanStd]]:
+    """
+    (params, observation statistics or `None` without `norm_obs`) of a checkpoint written by `saving.save_state`,
+    `model` must match the trained one and `norm_obs` the training setting
+    """
+    observations = np.zeros((1, obs_dim), np.float32)
+    template = PolicySnapshot(
+        step=0,
+        params=model.init(jax.random.PRNGKey(0), observations)['params'],
+        norm_state=NormalizationState.create((obs_dim,), 1))
+
+    def to_snapshot(state_dict):
+        # the optimizer state is left out
+        if convert_fn is not None:
+            state_dict = convert_fn(state_dict)
+        if norm_obs and 'norm_state' not in state_dict:
+            # `load_state` would fill in fresh statistics and the server would act on unnormalized observations
+            raise ValueError(f'{path} has no observation statistics (written before they were part of the '
+                             'train state), serve it with norm_obs=False')
+        return {k: state_dict[k] for k in ('step', 'params', 'norm_state') if k in state_dict}
+
+    snapshot, _ = load_state(path, template, to_snapshot)
+    return snapshot.params, snapshot.norm_state.obs_rms if norm_obs else None
+
+
+class PolicyServer:
+    """
+    `await server.act(observation)` from any number of tasks of the event loop the server was started in.
+    Forward passes run in a worker thread, so requests keep being collected while a batch is computed.
+    Latencies (arrival to result) and batch sizes are recorded for `stats`.
+    """
+    def __init__(
+            self,
+            apply_fn: Callable,
+            params: Any,
+            obs_dim: int,
+            obs_rms: Optional[RunningMeanStd] = None,
+            batch_sizes: Sequence[int] = DEFAULT_BUCKETS,
+            max_delay: float = 0.):
+        self.obs_dim = obs_dim
+        self.batch_sizes = tuple(sorted(batch_sizes))
+        self.max_batch_size = self.batch_sizes[-1]
+        self.max_delay = max_delay
+        self._params = jax.device_put(params)
+        self._obs_rms = jax.device_put(obs_rms)
+        # one executable per bucket, compiled before the first request
+        self._forward = {
+            size: deterministic_policy.lower(
+                apply_fn, self._params, np.zeros((size, obs_dim), np.float32), self._obs_rms).compile()
+            for size in self.batch_sizes}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._task = None
+        self.reset_stats()
+
+    @classmethod
+    def from_checkpoint(
+            cls, path: str, model: ModelClass, obs_dim: int, norm_obs: bool = True,
+            convert_fn: Optional[Callable] = None, **kwargs) -> 'PolicyServer':
+        params, obs_rms = load_policy(path, model, obs_dim, norm_obs, convert_fn)
+        return cls(model.apply, params, obs_dim, obs_rms, **kwargs)
+
+    def start(self) -> None:
+        """ Starts the batching task, call from a coroutine """
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        """ Serves the queued requests and stops """
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        self._executor.shutdown()
+
+    async def act(self, observation: np.array) -> np.array:
+        """ Deterministic action for one raw observation """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((time.perf_counter(), np.asarray(observation, np.float32), future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            request = await self._queue.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = request[0] + self.max_delay
+            while len(batch) < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    request = self._queue.get_nowait()
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+            try:
+                actions = await loop.run_in_executor(self._executor, self._compute, [r[1] for r in batch])
+            except Exception as error:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            done = time.perf_counter()
+            for (arrival, _, future), action in zip(batch, actions):
+                # requests cancelled by their client are computed anyway
+                if not future.done():
+                    future.set_result(action)
+                self._latencies.append(done - arrival)
+            self._batch_sizes.append(len(batch))
+
+    def _compute(self, observations) -> np.array:
+        size = next(s for s in self.batch_sizes if s >= len(observations))
+        padded = np.zeros((size, self.obs_dim), np.float32)
+        padded[:len(observations)] = observations
+        return np.asarray(self._forward[size](self._params, padded, self._obs_rms))[:len(observations)]
+
+    def reset_stats(self) -> None:
+        self._latencies = []
+        self._batch_sizes = []
+        self._stats_start = time.perf_counter()
+
+    def stats(self) -> Dict[str, float]:
+        """ Latency percentiles (ms), throughput and batching since the last `reset_stats` """
+        elapsed = time.perf_counter() - self._stats_start
+        latencies = np.asarray(self._latencies) * 1e3
+        if not len(latencies):
+            return dict(requests=0)
+        batch_sizes = np.asarray(self._batch_sizes)
+        padded = np.asarray([next(s for s in self.batch_sizes if s >= n) for n in batch_sizes])
+        return dict(
+            requests=len(latencies),
+            requests_per_sec=len(latencies) / elapsed,
+            latency_ms_p50=float(np.percentile(latencies, 50)),
+            latency_ms_p99=float(np.percentile(latencies, 99)),
+            mean_batch_size=float(batch_sizes.mean()),
+            padding=float(1 - batch_sizes.sum() / padded.sum()))
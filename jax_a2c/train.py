@@ -0,0 +1,578 @@
+"""
+The training loops: `main` (gym envs in worker processes), `main_multi_seed` (several seeds trained together),
+`main_distributed` (the learner of actor processes, see `distributed.py`) and `main_jax` (pure-JAX envs).
+Started by `run_a2c_train.py`, which is kept free of heavy imports.
+"""
+import functools
+import time
+from typing import Callable, Optional
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from jax_a2c import data_parallel
+from jax_a2c.builders import (checkpoint_convert_fn, collect_fn, make_envs,
+                              make_model, make_policy_fn, make_train_state,
+                              policy_obs_rms, update, update_kwargs,
+                              update_warmup)
+from jax_a2c.compilation import placeholder_output, warmup
+from jax_a2c.distributed import (ActorLearnerStats, ExperienceServer,
+                                 next_rollout, normalize_actor_rollout,
+                                 policy_arrays, start_local_actors)
+from jax_a2c.evaluation import (AsyncEvaluator, deterministic_policy,
+                                evaluate_episodes)
+from jax_a2c.jax_envs import JaxVecEnv
+from jax_a2c.jax_rollout import RolloutConfig, evaluate, init_runner, train
+from jax_a2c.metrics import (CSVSink, JSONLSink, MetricsAccumulator,
+                             MetricsLogger, WandbSink)
+from jax_a2c import multi_seed
+from jax_a2c.multi_seed import seed_slice, stack_seeds
+from jax_a2c.profiling import Profiler
+from jax_a2c.recording import TrajectoryRecorder
+from jax_a2c.utils import RolloutBuffer, collect_experience
+from jax_a2c.saving import CheckpointManager, latest_checkpoint, load_state
+
+# `a2c.step` metrics that are not averaged over a logging window
+LOSS_REDUCTIONS = dict(advantages_max='max', min_std='min')
+
+
+def init_wandb(args: dict, wandb_run_id: Optional[str]) -> Optional[str]:
+    """ Starts the wandb run, or resumes `wandb_run_id`, and returns its id. wandb is only imported here """
+    if not args['wb_flag']:
+        return wandb_run_id
+    import wandb
+    if wandb_run_id is None:
+        wandb.init(project=args['wandb_proj_name'], config=args)
+        return wandb.run.id
+    wandb.init(project=args['wandb_proj_name'], config=args, id=wandb_run_id, resume="allow")
+    return wandb_run_id
+
+
+def make_metrics_logger(args: dict) -> Optional[MetricsLogger]:
+    sinks = []
+    if args['wb_flag']:
+        sinks.append(WandbSink())
+    if args['log_csv']:
+        sinks.append(CSVSink(args['log_csv']))
+    if args['log_jsonl']:
+        sinks.append(JSONLSink(args['log_jsonl']))
+    return MetricsLogger(sinks) if sinks else None
+
+
+def load_env_states(args: dict, envs) -> Optional[np.ndarray]:
+    """ Sets the reset pool of the training envs, returns the evaluation start states (both optional) """
+    if args['reset_states']:
+        # `envs` may be grouped, the pool is set on the workers
+        getattr(envs, 'venv', envs).set_reset_pool(np.load(args['reset_states']), seed=args['seed'])
+    return np.load(args['eval_start_states']) if args['eval_start_states'] else None
+
+
+def make_profiler(args: dict, envs=None) -> Profiler:
+    trace_updates = tuple(args['profile_trace_updates']) if args['profile_trace_updates'] else None
+    return Profiler(
+        enabled=args['profile'], fence=args['profile_fence'], envs=envs,
+        trace_dir=args['profile_trace_dir'], trace_updates=trace_updates)
+
+
+
+
+def resume(args: dict, state, convert_fn: Optional[Callable] = None, num_seeds: Optional[int] = None):
+    """
+    `state` loaded from the latest checkpoint of `--load` (of every seed, with `num_seeds`) if there is one.
+    Returns the state, the wandb run id of the checkpoint and the update to continue from.
+    """
+    if not args['load']:
+        return state, None, 0
+    chkpnt = args['load']
+    if num_seeds is None:
+        path = latest_checkpoint(chkpnt)
+        if path is None:
+            print(f"Checkpoint {chkpnt} not found!")
+            return state, None, 0
+        print(f"Loading checkpoint {path}")
+        state, additional = load_state(path, state, convert_fn)
+        return state, additional['wandb_run_id'], int(state.step)
+    paths = [latest_checkpoint(f'{chkpnt}.seed{i}') for i in range(num_seeds)]
+    if any(path is None for path in paths):
+        print(f"Checkpoints {chkpnt}.seed* not found!")
+        return state, None, 0
+    print(f"Loading checkpoints {paths}")
+    loaded = [load_state(path, seed_slice(state, i), convert_fn) for i, path in enumerate(paths)]
+    states = stack_seeds([seed_state for seed_state, _ in loaded])
+    return states, loaded[0][1]['wandb_run_id'], int(states.step[0])
+
+
+
+def make_evaluate_fn(
+        args: dict, apply_fn: Callable, eval_envs, start_states: Optional[np.ndarray] = None,
+        num_seeds: Optional[int] = None) -> Callable:
+    """ `evaluate_snapshot(params, obs_rms)` on `eval_envs`, with `num_seeds` a list of the results of every seed """
+
+    def evaluate_seed(params, obs_rms):
+        return evaluate_episodes(
+            apply_fn, params, eval_envs, num_episodes=args['eval_episodes'], obs_rms=obs_rms,
+            start_states=start_states)
+
+    def evaluate_seeds(params, obs_rms):
+        return [evaluate_seed(seed_slice(params, i), seed_slice(obs_rms, i)) for i in range(num_seeds)]
+    return evaluate_seed if num_seeds is None else evaluate_seeds
+
+
+class TrainingRun:
+    """
+    What the trainers keep around their updates: metrics logging (wandb and the `--log-*` sinks), evaluation (in the
+    loop or `--async-eval`), checkpoints, trajectory recording and the profiler, closed together by `close`.
+    With `num_seeds` metrics are logged and checkpoints saved per seed (`{save}.seed{i}`).
+    `host_state` maps the trained state to the one that is evaluated and saved (data parallel training).
+    """
+
+    def __init__(
+            self,
+            args: dict,
+            wandb_run_id: Optional[str],
+            start_update: int,
+            startup_time: float,
+            evaluate_fn: Optional[Callable] = None,
+            envs=None,
+            num_seeds: Optional[int] = None,
+            host_state: Optional[Callable] = None):
+        self.args = args
+        self.start_update = start_update
+        self.startup_time = startup_time
+        self.num_seeds = num_seeds
+        self.host_state = host_state or (lambda state: state)
+        self.wandb_run_id = init_wandb(args, wandb_run_id)
+        self.logger = make_metrics_logger(args)
+        self.evaluate_fn = evaluate_fn
+        self.evaluator = AsyncEvaluator(evaluate_fn) if args['async_eval'] and evaluate_fn is not None else None
+        prefixes = [args['save']] if num_seeds is None else [f"{args['save']}.seed{i}" for i in range(num_seeds)]
+        self.checkpoints = [
+            CheckpointManager(prefix, keep=args['keep_checkpoints']) for prefix in prefixes] if args['save'] else []
+        self.recorder = TrajectoryRecorder(args['record']) if args['record'] else None
+        self.losses = MetricsAccumulator(LOSS_REDUCTIONS)
+        self.profiler = make_profiler(args, envs)
+
+    def timestep(self, current_update: int) -> int:
+        return current_update * self.args['num_envs'] * self.args['num_steps']
+
+    def evaluate(self, current_update: int, state) -> None:
+        """ Evaluates `state` every `eval_every` updates and logs the evaluations that finished """
+        if current_update % self.args['eval_every'] == 0:
+            state = self.host_state(state)
+            if self.evaluator is None:
+                with self.profiler.phase('eval'):
+                    self.log_eval(current_update, self.evaluate_fn(state.params, policy_obs_rms(self.args, state)))
+            else:
+                self.evaluator.submit(current_update, state.params, policy_obs_rms(self.args, state))
+        if self.evaluator is not None:
+            for eval_update, result in self.evaluator.results():
+                self.log_eval(eval_update, result)
+
+    def log_eval(self, current_update: int, result) -> None:
+        if self.num_seeds is None:
+            if self.logger is not None:
+                self.logger.log(current_update, {
+                    'evaluation/score': result.mean,
+                    'evaluation/score_ci_low': result.ci_low,
+                    'evaluation/score_ci_high': result.ci_high,
+                    'evaluation/update': current_update})
+            print(f'Eval return: {result.mean} [{result.ci_low:.1f}, {result.ci_high:.1f}] (update {current_update})')
+            return
+        if self.logger is not None:
+            record = {'evaluation/update': current_update}
+            for i, seed_result in enumerate(result):
+                record.update({
+                    f'seed_{i}/evaluation/score': seed_result.mean,
+                    f'seed_{i}/evaluation/score_ci_low': seed_result.ci_low,
+                    f'seed_{i}/evaluation/score_ci_high': seed_result.ci_high})
+            self.logger.log(current_update, record)
+        for i, seed_result in enumerate(result):
+            print(f'Seed {i} eval return: {seed_result.mean} '
+                  f'[{seed_result.ci_low:.1f}, {seed_result.ci_high:.1f}] (update {current_update})')
+
+    def record(self, current_update: int, experience, advantages=None) -> None:
+        if self.recorder is not None and current_update % self.args['record_every'] == 0:
+            with self.profiler.phase('record'):
+                self.recorder.record(current_update, experience, advantages)
+
+    def log_update(self, current_update: int, loss, loss_dict: dict, extra: Callable[[], dict] = dict) -> None:
+        """ Adds the losses to the logging window and logs it every `log_freq` updates, with `extra()` """
+        if current_update == self.start_update:
+            loss.block_until_ready()
+            print(f'Time to first update: {time.perf_counter() - self.startup_time:.2f}s')
+        if self.logger is None:
+            return
+        self.losses.add(dict(loss=loss, **loss_dict))
+        if (current_update + 1) % self.args['log_freq'] == 0:
+            record = {'time/timestep': self.timestep(current_update), 'time/updates': current_update}
+            if self.num_seeds is None:
+                record.update({'training/' + k: v for k, v in self.losses.flush().items()})
+            else:
+                record.update({
+                    f'seed_{i}/training/{k}': v[i] for k, v in self.losses.flush().items() for i in range(self.num_seeds)})
+            record.update(extra())
+            record.update(self.profiler.window())
+            self.logger.log(current_update, record)
+
+    def maybe_save(self, current_update: int, next_update: int, total_updates: int, state) -> None:
+        """ Saves `state` (trained up to `next_update`) if the updates since `current_update` cross a `save_every`
+        boundary, and after the last update """
+        save_every = self.args['save_every']
+        if not self.checkpoints or (
+                next_update // save_every == current_update // save_every and next_update != total_updates):
+            return
+        state = self.host_state(state)
+        additional = {}
+        additional['wandb_run_id'] = self.wandb_run_id
+        with self.profiler.phase('checkpoint'):
+            for i, checkpoints in enumerate(self.checkpoints):
+                checkpoints.save(next_update, state if self.num_seeds is None else seed_slice(state, i), additional)
+
+    def close(self) -> None:
+        for checkpoints in self.checkpoints:
+            checkpoints.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.evaluator is not None:
+            for eval_update, result in self.evaluator.close():
+                self.log_eval(eval_update, result)
+            print(f'Evaluations dropped while the evaluator was busy: {self.evaluator.dropped}')
+        if self.logger is not None:
+            self.logger.close()
+        self.profiler.close()
+        if self.profiler.enabled:
+            print(self.profiler.summary())
+
+
+def main(args: dict):
+
+    startup_time = time.perf_counter()
+    total_updates = args['num_timesteps'] // (args['num_envs'] * args['num_steps'])
+
+    envs = make_envs(args, num_groups=args['num_groups'])
+    eval_envs = make_envs(args)
+    eval_start_states = load_env_states(args, envs)
+
+    model = make_model(args, envs.action_space.shape[0])
+    prngkey = jax.random.PRNGKey(args['seed'])
+    state = make_train_state(args, prngkey, model, envs, train_steps=total_updates)
+    _policy_fn = make_policy_fn(state.apply_fn)
+
+    next_obs = envs.reset()
+    next_obs_and_dones = (next_obs, np.array(next_obs.shape[0]*[False]))
+
+    state, wandb_run_id, start_update = resume(args, state, checkpoint_convert_fn(args))
+
+    collect = collect_fn(args)
+    buffer = RolloutBuffer.from_envs(envs, args['num_steps'])
+
+    num_devices = args['num_devices']
+    if num_devices > 1:
+        # one replica of the state per device, every device acts for and learns from its share of the envs
+        assert (args['num_envs'] // args['num_groups']) % num_devices == 0, 'envs of a group must split evenly between devices'
+        norm_kwargs, process_kwargs, step_kwargs = update_kwargs(args)
+        state = data_parallel.replicate_state(state, num_devices)
+        _policy_fn = data_parallel.make_policy_fn(model.apply, num_devices)
+        update_fn = data_parallel.make_update_fn(num_devices, **process_kwargs, **step_kwargs, **norm_kwargs)
+
+    def unreplicated(state):
+        return data_parallel.host_state(state) if num_devices > 1 else state
+
+    if args['warmup']:
+        experience = buffer.to_device()
+        # the policy sees buffer rows during the rollout and raw env observations for the last values
+        rows_list = envs.group_rows if args['num_groups'] > 1 else [slice(None)]
+        policy_inputs = [buffer.observations[0, rows] for rows in rows_list] + [next_obs[rows] for rows in rows_list]
+        if num_devices > 1:
+            update_calls = dict(update=lambda: update_fn(state, experience))
+        else:
+            update_calls = update_warmup(state, experience, args)
+        warmup(dict(
+            policy=lambda: [
+                _policy_fn(prngkey, obs, params=state.params, obs_rms=policy_obs_rms(args, state))
+                for obs in policy_inputs],
+            eval=lambda: deterministic_policy(
+                state.apply_fn, unreplicated(state).params, next_obs, policy_obs_rms(args, unreplicated(state))),
+            **update_calls))
+
+    run = TrainingRun(
+        args, wandb_run_id, start_update, startup_time,
+        evaluate_fn=make_evaluate_fn(args, state.apply_fn, eval_envs, eval_start_states),
+        envs=envs,
+        host_state=unreplicated)
+    profiler = run.profiler
+
+    for current_update in range(start_update, total_updates):
+        profiler.begin_update(current_update)
+        policy_fn = functools.partial(_policy_fn, params=state.params, obs_rms=policy_obs_rms(args, state))
+        run.evaluate(current_update, state)
+
+        prngkey, _ = jax.random.split(prngkey)
+        next_obs_and_dones, experience = collect(
+            prngkey, 
+            next_obs_and_dones, 
+            envs, 
+            num_steps=args['num_steps'], 
+            policy_fn=policy_fn,
+            buffer=buffer,
+            profiler=profiler,)
+        profiler.env_steps(args['num_envs'] * args['num_steps'])
+
+        if num_devices > 1:
+            with profiler.phase('update') as phase:
+                state, (loss, loss_dict) = update_fn(state, experience)
+                phase.fence(loss)
+            advantages = None
+        else:
+            state, (loss, loss_dict), trajectories = update(state, experience, args, profiler)
+            advantages = trajectories[3]
+        run.record(current_update, experience, advantages)
+        run.log_update(current_update, loss, loss_dict)
+        run.maybe_save(current_update, current_update + 1, total_updates, state)
+
+    run.close()
+
+def main_multi_seed(args: dict):
+    """
+    `num_seeds` independent runs in one process: vmapped policy and update over stacked train states,
+    one env group (with its own normalization) per seed. Metrics and checkpoints are kept per seed.
+    """
+    startup_time = time.perf_counter()
+    num_seeds = args['num_seeds']
+    assert args['num_envs'] % args['envs_per_worker'] == 0, 'a worker can not hold envs of different seeds'
+    assert args['num_devices'] == 1, '--num-devices is not supported together with --num-seeds'
+    # the env groups are the seeds, they are collected in one batch
+    assert args['num_groups'] == 1, '--num-groups is not supported together with --num-seeds'
+    assert args['record'] is None, '--record is not supported together with --num-seeds'
+    total_updates = args['num_timesteps'] // (args['num_envs'] * args['num_steps'])
+
+    envs = make_envs(args, num=args['num_envs'] * num_seeds, num_groups=num_seeds, shared_stats=False)
+    eval_envs = make_envs(args)
+    eval_start_states = load_env_states(args, envs)
+
+    model = make_model(args, envs.action_space.shape[0])
+    prngkey = jax.random.PRNGKey(args['seed'])
+    states = make_train_state(args, prngkey, model, envs, train_steps=total_updates, num_seeds=num_seeds)
+    norm_kwargs, process_kwargs, step_kwargs = update_kwargs(args)
+    _policy_fn = multi_seed.make_policy_fn(model.apply, num_seeds)
+    update_fn = multi_seed.make_update_fn(num_seeds, **process_kwargs, **step_kwargs, **norm_kwargs)
+
+    next_obs = envs.reset()
+    next_obs_and_dones = (next_obs, np.array(next_obs.shape[0]*[False]))
+
+    states, wandb_run_id, start_update = resume(args, states, checkpoint_convert_fn(args), num_seeds)
+
+    buffer = RolloutBuffer.from_envs(envs, args['num_steps'])
+
+    if args['warmup']:
+        experience = buffer.to_device()
+        warmup(dict(
+            policy=lambda: [
+                _policy_fn(prngkey, obs, params=states.params, obs_rms=policy_obs_rms(args, states))
+                for obs in (buffer.observations[0], next_obs)],
+            update=lambda: update_fn(states, experience),
+            eval=lambda: deterministic_policy(
+                states.apply_fn, seed_slice(states.params, 0), next_obs[:args['num_envs']],
+                seed_slice(policy_obs_rms(args, states), 0)),))
+
+    run = TrainingRun(
+        args, wandb_run_id, start_update, startup_time,
+        evaluate_fn=make_evaluate_fn(args, states.apply_fn, eval_envs, eval_start_states, num_seeds),
+        envs=envs,
+        num_seeds=num_seeds)
+    profiler = run.profiler
+
+    for current_update in range(start_update, total_updates):
+        profiler.begin_update(current_update)
+        policy_fn = functools.partial(_policy_fn, params=states.params, obs_rms=policy_obs_rms(args, states))
+        run.evaluate(current_update, states)
+
+        prngkey, _ = jax.random.split(prngkey)
+        next_obs_and_dones, experience = collect_experience(
+            prngkey, 
+            next_obs_and_dones, 
+            envs, 
+            num_steps=args['num_steps'], 
+            policy_fn=policy_fn,
+            buffer=buffer,
+            profiler=profiler,)
+        profiler.env_steps(num_seeds * args['num_envs'] * args['num_steps'])
+
+        with profiler.phase('update') as phase:
+            states, (loss, loss_dict) = update_fn(states, experience)
+            phase.fence(loss)
+        run.log_update(current_update, loss, loss_dict)
+        run.maybe_save(current_update, current_update + 1, total_updates, states)
+
+    run.close()
+
+def main_distributed(args: dict):
+    """
+    The learner of actor-learner training (`jax_a2c/distributed.py`): `local_actors` actor processes are started on
+    this machine, more join from other hosts with `--actor ID --learner-address ADDRESS` and the same flags.
+    Every update trains on one rollout of one actor (`num_envs x num_steps` transitions), in arrival order.
+    """
+    assert args['num_seeds'] == 1, '--num-seeds is not supported by actor-learner training'
+    assert args['num_devices'] == 1, '--num-devices is not supported by actor-learner training'
+    startup_time = time.perf_counter()
+    total_updates = args['num_timesteps'] // (args['num_envs'] * args['num_steps'])
+
+    # only the evaluation envs run here, the training envs belong to the actors
+    eval_envs = make_envs(args)
+    eval_start_states = np.load(args['eval_start_states']) if args['eval_start_states'] else None
+
+    model = make_model(args, eval_envs.action_space.shape[0])
+    prngkey = jax.random.PRNGKey(args['seed'])
+    state = make_train_state(args, prngkey, model, eval_envs, train_steps=total_updates)
+    state, wandb_run_id, start_update = resume(args, state, checkpoint_convert_fn(args))
+
+    norm_kwargs, _, _ = update_kwargs(args)
+
+    server = ExperienceServer(args['learner_address'])
+    # actors start collecting with the initial (or loaded) params while the learner compiles
+    server.publish(start_update, policy_arrays(state.params, policy_obs_rms(args, state)))
+    # the observation statistics of the params versions that are not too stale yet, rollouts are normalized with them
+    published = {start_update: policy_obs_rms(args, state)}
+    actors = start_local_actors(args, server.address, args['local_actors'])
+    print(f"Learner listening on {server.address}, {args['local_actors']} local actors")
+
+    if args['warmup']:
+        experience = RolloutBuffer.from_envs(eval_envs, args['num_steps']).to_device()
+        normalize_args = (state.norm_state, experience, policy_obs_rms(args, state))
+        warmup(dict(
+            normalize=lambda: normalize_actor_rollout(*normalize_args, **norm_kwargs),
+            eval=lambda: deterministic_policy(
+                state.apply_fn, state.params, eval_envs.reset(), policy_obs_rms(args, state)),
+            **update_warmup(
+                state, placeholder_output(normalize_actor_rollout, *normalize_args, **norm_kwargs)[1], args,
+                normalized=True)))
+
+    run = TrainingRun(
+        args, wandb_run_id, start_update, startup_time,
+        evaluate_fn=make_evaluate_fn(args, state.apply_fn, eval_envs, eval_start_states))
+    profiler = run.profiler
+    stats = ActorLearnerStats()
+    # discounted returns of the envs of every actor, for the return normalization
+    actor_returns = {}
+
+    for current_update in range(start_update, total_updates):
+        profiler.begin_update(current_update)
+        run.evaluate(current_update, state)
+
+        # the version of the params is the number of updates
+        while True:
+            with profiler.phase('wait_rollout'):
+                rollout = next_rollout(server, actors)
+            busy_start = time.perf_counter()
+            staleness = current_update - rollout.version
+            profiler.env_steps(args['num_envs'] * args['num_steps'])
+            if staleness <= args['max_staleness']:
+                break
+            # dropped without updating the normalization statistics, see `distributed.py`
+            stats.rollout(rollout, staleness, False, time.perf_counter() - busy_start)
+
+        with profiler.phase('normalize') as phase:
+            norm_state = state.norm_state.replace(
+                returns=actor_returns.get(rollout.actor, jnp.zeros_like(state.norm_state.returns)))
+            norm_state, experience = normalize_actor_rollout(
+                norm_state, tuple(jnp.array(x) for x in rollout.experience), published[rollout.version],
+                **norm_kwargs)
+            actor_returns[rollout.actor] = norm_state.returns
+            state = state.replace(norm_state=norm_state)
+            phase.fence(experience)
+        state, (loss, loss_dict), trajectories = update(state, experience, args, profiler, normalized=True)
+        run.record(current_update, rollout.experience, trajectories[3])
+        with profiler.phase('publish'):
+            # waits for the update
+            published[current_update + 1] = policy_obs_rms(args, state)
+            published.pop(current_update - args['max_staleness'], None)
+            server.publish(current_update + 1, policy_arrays(state.params, published[current_update + 1]))
+        stats.rollout(rollout, staleness, True, time.perf_counter() - busy_start)
+
+        run.log_update(current_update, loss, loss_dict, extra=stats.window)
+        run.maybe_save(current_update, current_update + 1, total_updates, state)
+
+    server.close()
+    for actor in actors:
+        actor.join()
+    print(stats.summary())
+    run.close()
+
+def main_jax(args: dict):
+    """
+    Training on a pure-JAX environment: `eval_every` updates at a time are compiled into one scan
+    """
+    assert args['num_seeds'] == 1, '--num-seeds is not supported by the jax backend, vmap `jax_rollout.train` instead'
+    assert args['num_devices'] == 1, '--num-devices is not supported by the jax backend'
+    assert args['record'] is None, '--record is not supported by the jax backend'
+    startup_time = time.perf_counter()
+    total_updates = args['num_timesteps'] // (args['num_envs'] * args['num_steps'])
+
+    envs = JaxVecEnv(args['env_name'], num=args['num_envs'], norm_r=args['norm_r'], norm_obs=args['norm_obs'])
+
+    model = make_model(args, envs.action_space.shape[0])
+    prngkey = jax.random.PRNGKey(args['seed'])
+    state = make_train_state(args, prngkey, model, envs, train_steps=total_updates)
+    state, wandb_run_id, start_update = resume(args, state, checkpoint_convert_fn(args))
+
+    config = RolloutConfig(
+        num_steps=args['num_steps'],
+        gamma=args['gamma'],
+        lambda_=args['lambda_'],
+        gae_method=args['gae_method'],
+        value_loss_coef=args['value_loss_coef'],
+        entropy_coef=args['entropy_coef'],
+        normalize_advantages=args['normalize_advantages'],
+        norm_obs=args['norm_obs'],
+        norm_r=args['norm_r'],
+        compute_dtype=args['compute_dtype'])
+    prngkey, runner_key = jax.random.split(prngkey)
+    runner = init_runner(
+        runner_key, envs.env, state, args['num_envs'], norm_obs=args['norm_obs'], norm_state=state.norm_state)
+    # evaluation runs in the loop on the jax env, the trace window and the phases cover whole `eval_every` chunks
+    run = TrainingRun(args, wandb_run_id, start_update, startup_time)
+    logger, profiler = run.logger, run.profiler
+
+    for current_update in range(start_update, total_updates, args['eval_every']):
+        profiler.begin_update(current_update)
+        prngkey, eval_key = jax.random.split(prngkey)
+        with profiler.phase('eval'):
+            eval_return = evaluate(
+                state.apply_fn, envs.env, runner.train_state.params, runner.norm_state.obs_rms, eval_key,
+                args['num_envs'], args['norm_obs']).item()
+        if logger is not None:
+            logger.log(current_update, {'evaluation/score': eval_return, 'evaluation/update': current_update})
+        print(f'Eval return: {eval_return}')
+
+        num_updates = min(args['eval_every'], total_updates - current_update)
+        with profiler.phase('train') as phase:
+            runner, metrics = train(runner, envs.env, config, num_updates)
+            phase.fence(metrics)
+        profiler.env_steps(num_updates * args['num_envs'] * args['num_steps'])
+
+        if current_update == start_update:
+            jax.block_until_ready(metrics)
+            print(f'Time to first {num_updates} updates: {time.perf_counter() - startup_time:.2f}s')
+
+        if logger is not None:
+            # reduced on device, the logger thread waits for the values
+            episodes = metrics.pop('episodes').sum()
+            episode_return_sum = metrics.pop('episode_return_sum').sum()
+            last_update = current_update + num_updates - 1
+            record = {
+                'time/timestep': run.timestep(last_update + 1),
+                'time/updates': last_update,
+                # NaN, so left out, when no episode finished
+                'training/episode_return': episode_return_sum / jnp.where(episodes > 0, episodes, jnp.nan)}
+            record.update({'training/' + k: v.mean() for k, v in metrics.items()})
+            record.update(profiler.window())
+            logger.log(last_update, record)
+
+        # chunks are `eval_every` updates, saved after the chunks that cross a `save_every` boundary;
+        # the runner keeps the statistics next to the train state, they are saved inside it
+        run.maybe_save(
+            current_update, current_update + num_updates, total_updates,
+            runner.train_state.replace(norm_state=runner.norm_state))
+
+    run.close()
@@ -1,18 +1,29 @@
 import functools
-from typing import Any, Callable, Dict, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import jax
 import jax.numpy as jnp
 import numpy as np
 import optax
-from flax.training.train_state import TrainState
+from flax.training import train_state
 
 import jax_a2c.env_utils
+from jax_a2c.normalization import NormalizationState, normalize_rollout
+from jax_a2c.profiling import NULL_PROFILER
 
 Array = Any
 PRNGKey = Any
 ModelClass = Any
 
+
+class TrainState(train_state.TrainState):
+    """
+    flax `TrainState` with the observation and return normalization statistics of the training envs,
+    they are updated by `normalize_experience` and saved with the weights
+    """
+    norm_state: NormalizationState
+
+
 def create_train_state(
     prngkey: PRNGKey, 
     model: ModelClass,
@@ -22,11 +33,15 @@ def create_train_state(
     max_norm: float,
     decay: float,
     eps: float,
-    train_steps: int = 0) -> TrainState:
+    train_steps: int = 0,
+    num_seeds: Optional[int] = None) -> TrainState:
+    """
+    With `num_seeds` returns the states of `num_seeds` independent runs (initialized from splits of `prngkey`)
+    stacked along a new leading axis, see `jax_a2c.multi_seed`.
+    """
 
     dummy_input = envs.reset()
-    variables = model.init(prngkey, dummy_input)
-    params = variables['params']
+    num_envs = dummy_input.shape[0] // (num_seeds or 1)
 
     if decaying_lr:
         lr = optax.linear_schedule(
@@ -39,31 +54,96 @@ def create_train_state(
         optax.clip_by_global_norm(max_norm),
         optax.rmsprop(learning_rate=lr, decay=decay, eps=eps)
         )
-    state = TrainState.create(
-        apply_fn=model.apply,
-        params=params,
-        tx=tx)
 
-    return state
+    def init(prngkey):
+        variables = model.init(prngkey, dummy_input)
+        params = variables['params']
+        state = TrainState.create(
+            apply_fn=model.apply,
+            params=params,
+            tx=tx,
+            norm_state=NormalizationState.create(dummy_input.shape[1:], num_envs))
+        return state
+
+    if num_seeds is None:
+        return init(prngkey)
+    return jax.vmap(lambda key: init(key).replace(step=jnp.zeros((), jnp.int32)))(
+        jax.random.split(prngkey, num_seeds))
 
-@jax.jit
-@functools.partial(jax.vmap, in_axes=(1, 1, 1, None, None), out_axes=1)
+@functools.partial(jax.jit, static_argnames=('method',))
 def gae_advantages(
         rewards: np.ndarray,
         terminal_masks: np.ndarray,
         values: np.ndarray,
         discount: float,
-        gae_param: float):
+        gae_param: float,
+        method: str = 'scan'):
+    """
+    GAE over `[num_steps, num_envs]` arrays as the reversed linear recurrence
+    `gae[t] = delta[t] + discount * gae_param * mask[t + 1] * gae[t + 1]`.
+    `method='scan'` runs it as a `lax.scan` (a single loop body in the HLO whatever `num_steps` is),
+    `method='associative'` as a parallel prefix scan with O(log num_steps) depth, for long horizons on accelerators.
+    """
     assert rewards.shape[0] + 1 == values.shape[0]
-    advantages = []
-    gae = 0.
-    for t in reversed(range(len(rewards))):
-        value_diff = discount * values[t + 1] * terminal_masks[t + 1] - values[t]
-        delta = rewards[t] + value_diff
-        gae = delta + discount * gae_param * terminal_masks[t + 1] * gae
-        advantages.append(gae)
-    advantages = advantages[::-1]
-    return jnp.array(advantages)
+    deltas = rewards + discount * values[1:] * terminal_masks[1:] - values[:-1]
+    coefs = discount * gae_param * terminal_masks[1:] * jnp.ones_like(deltas)
+
+    if method == 'scan':
+        def gae_step(gae, delta_and_coef):
+            delta, coef = delta_and_coef
+            gae = delta + coef * gae
+            return gae, gae
+        _, advantages = jax.lax.scan(gae_step, jnp.zeros_like(deltas[0]), (deltas, coefs), reverse=True)
+        return advantages
+
+    if method == 'associative':
+        # elements are affine maps x -> coef * x + delta, combining composes the later map into the earlier one
+        def compose(later, earlier):
+            later_coef, later_delta = later
+            earlier_coef, earlier_delta = earlier
+            return earlier_coef * later_coef, earlier_coef * later_delta + earlier_delta
+        _, advantages = jax.lax.associative_scan(compose, (coefs, deltas), reverse=True)
+        return advantages
+
+    raise ValueError(f'Unknown gae method `{method}`, use `scan` or `associative`')
+
+class RolloutBuffer:
+    """
+    Fixed-shape host storage of one rollout: `num_steps x num_envs` transitions written in place every step.
+    It is allocated once and reused by every update, `to_device` transfers the whole rollout at once.
+    """
+    def __init__(
+        self, 
+        num_steps: int, 
+        num_envs: int, 
+        obs_shape: Tuple[int, ...], 
+        action_shape: Tuple[int, ...], 
+        dtype=np.float32):
+        self.num_steps = num_steps
+        self.num_envs = num_envs
+        self.observations = np.zeros((num_steps, num_envs) + tuple(obs_shape), dtype=dtype)
+        self.actions = np.zeros((num_steps, num_envs) + tuple(action_shape), dtype=dtype)
+        self.rewards = np.zeros((num_steps, num_envs), dtype=dtype)
+        self.values = np.zeros((num_steps + 1, num_envs), dtype=dtype)
+        self.dones = np.zeros((num_steps + 1, num_envs), dtype=bool)
+
+    @classmethod
+    def from_envs(
+            cls, envs: jax_a2c.env_utils.SubprocVecEnv, num_steps: int, dtype=np.float32) -> 'RolloutBuffer':
+        return cls(num_steps, envs.num_envs, envs.observation_space.shape, envs.action_space.shape, dtype=dtype)
+
+    def arrays(self) -> Tuple[np.ndarray, ...]:
+        """ The host arrays in the order of `to_device`, overwritten by the next rollout """
+        return self.observations, self.actions, self.rewards, self.values, self.dones
+
+    def to_device(self) -> Tuple[Array, ...]:
+        # jnp.array copies: on CPU device_put may alias the host memory that the next rollout overwrites
+        return (
+            jnp.array(self.observations),
+            jnp.array(self.actions),
+            jnp.array(self.rewards),
+            jnp.array(self.values),
+            jnp.array(self.dones))
 
 def collect_experience(
     prngkey: PRNGKey,
@@ -71,50 +151,127 @@ def collect_experience(
     envs: jax_a2c.env_utils.SubprocVecEnv, 
     num_steps: int, 
     policy_fn: Callable, 
+    buffer: Optional[RolloutBuffer] = None,
+    profiler: Any = NULL_PROFILER,
+    to_device: bool = True,
     )-> Tuple[Array, ...]:
-
+    """ With `to_device=False` the experience is left on the host (`buffer.arrays()`), e.g. to be sent elsewhere """
     envs.training = True
+    if buffer is None:
+        buffer = RolloutBuffer.from_envs(envs, num_steps)
 
     next_observations, dones = next_obs_and_dones
+    buffer.dones[0] = dones
 
-    observations_list = []
-    actions_list = []
-    rewards_list = []
-    values_list = []
-    dones_list = [dones]
+    for t in range(num_steps):
+        buffer.observations[t] = next_observations
+        # writing the outputs to the buffer waits for them, inference is timed in full
+        with profiler.phase('inference'):
+            _, prngkey = jax.random.split(prngkey)
+            values, actions = policy_fn(prngkey, buffer.observations[t]) 
+            buffer.actions[t] = actions
+            buffer.values[t] = values[..., 0]
+        with profiler.phase('env_step'):
+            next_observations, rewards, dones, info = envs.step(buffer.actions[t])
+        buffer.rewards[t] = rewards
+        buffer.dones[t + 1] = dones
 
-    for _ in range(num_steps):
-        observations = next_observations
+    with profiler.phase('inference'):
         _, prngkey = jax.random.split(prngkey)
-        values, actions = policy_fn(prngkey, observations) 
-        next_observations, rewards, dones, info = envs.step(actions)
-        observations_list.append(observations)
-        actions_list.append(np.array(actions))
-        rewards_list.append(rewards)
-        values_list.append(values[..., 0])
-        dones_list.append(dones)
+        values, actions = policy_fn(prngkey, next_observations) 
+        buffer.values[num_steps] = values[..., 0]
 
-    _, prngkey = jax.random.split(prngkey)
-    values, actions = policy_fn(prngkey, next_observations) 
-    values_list.append(values[..., 0])
-
-    experience =(
-        jnp.stack(observations_list),
-        jnp.stack(actions_list),
-        jnp.stack(rewards_list),
-        jnp.stack(values_list),
-        jnp.stack(dones_list))
+    if not to_device:
+        return (next_observations, dones), buffer.arrays()
+    with profiler.phase('to_device'):
+        experience = buffer.to_device()
     return (next_observations, dones), experience
 
-@functools.partial(jax.jit, static_argnums=(1,2))
+def collect_experience_pipelined(
+    prngkey: PRNGKey,
+    next_obs_and_dones: Array,
+    envs: jax_a2c.env_utils.GroupedVecEnv, 
+    num_steps: int, 
+    policy_fn: Callable, 
+    buffer: Optional[RolloutBuffer] = None,
+    profiler: Any = NULL_PROFILER,
+    to_device: bool = True,
+    )-> Tuple[Array, ...]:
+    """
+    Same contract as `collect_experience` for environments split into groups.
+    The policy runs on a group as soon as its step is back while the other groups are still simulating,
+    every group is only waited for right before its next actions are needed.
+    """
+    envs.training = True
+    if buffer is None:
+        buffer = RolloutBuffer.from_envs(envs, num_steps)
+
+    next_observations, dones = next_obs_and_dones
+    groups, group_rows = envs.groups, envs.group_rows
+    group_observations = [next_observations[rows] for rows in group_rows]
+    buffer.dones[0] = dones
+
+    for t in range(num_steps):
+        _, prngkey = jax.random.split(prngkey)
+        for g, (group, rows) in enumerate(zip(groups, group_rows)):
+            if t > 0:
+                # only the part of the group's step that did not overlap with inference of other groups
+                with profiler.phase('env_step'):
+                    group_observations[g], rewards, dones, info = group.step_wait()
+                buffer.rewards[t - 1, rows] = rewards
+                buffer.dones[t, rows] = dones
+            buffer.observations[t, rows] = group_observations[g]
+            with profiler.phase('inference'):
+                values, actions = policy_fn(jax.random.fold_in(prngkey, g), buffer.observations[t, rows])
+                buffer.actions[t, rows] = actions
+                buffer.values[t, rows] = values[..., 0]
+            group.step_async(buffer.actions[t, rows])
+
+    _, prngkey = jax.random.split(prngkey)
+    for g, (group, rows) in enumerate(zip(groups, group_rows)):
+        with profiler.phase('env_step'):
+            group_observations[g], rewards, dones, info = group.step_wait()
+        buffer.rewards[num_steps - 1, rows] = rewards
+        buffer.dones[num_steps, rows] = dones
+        with profiler.phase('inference'):
+            values, actions = policy_fn(jax.random.fold_in(prngkey, g), group_observations[g])
+            buffer.values[num_steps, rows] = values[..., 0]
+
+    next_observations = np.concatenate(group_observations)
+    if not to_device:
+        return (next_observations, buffer.dones[num_steps].copy()), buffer.arrays()
+    with profiler.phase('to_device'):
+        experience = buffer.to_device()
+    return (next_observations, buffer.dones[num_steps].copy()), experience
+
+@functools.partial(jax.jit, static_argnums=(2, 3, 4))
+def normalize_experience(
+    state: TrainState,
+    experience: Tuple[Array, ...],
+    norm_obs: bool = True,
+    norm_r: bool = True,
+    axis_name: Optional[str] = None,
+    ) -> Tuple[TrainState, Tuple[Array, ...]]:
+    """
+    Normalizes the raw observations and rewards of `collect_experience` with `state.norm_state`
+    and merges the rollout into the statistics, once per rollout instead of on the host every step
+    (see `normalization.normalize_rollout`)
+    """
+    observations, actions, rewards, values, dones = experience
+    norm_state, observations, rewards = normalize_rollout(
+        state.norm_state, observations, rewards, dones[1:], norm_obs=norm_obs, norm_r=norm_r, axis_name=axis_name)
+    return state.replace(norm_state=norm_state), (observations, actions, rewards, values, dones)
+
+@functools.partial(jax.jit, static_argnums=(1, 2, 3))
 def process_experience(
     experience: Tuple[Array, ...], 
     gamma: float = .99, 
     lambda_: float = .95,
+    gae_method: str = 'scan',
     ):
     observations, actions, rewards, values, dones = experience
     dones = jnp.logical_not(dones).astype(float)
-    advantages = gae_advantages(rewards, dones, values, gamma, lambda_)
+    advantages = gae_advantages(rewards, dones, values, gamma, lambda_, method=gae_method)
     returns = advantages + values[:-1]
     trajectories = (observations, actions, returns, advantages)
     num_agents, actor_steps = observations.shape[:2]
@@ -4,4 +4,10 @@ setup(
     name='a2c-continious-jax',
     packages=find_packages(),
     version='0.0.1',
-    install_requires=['gym', 'mujoco_py', 'flax', 'stable-baselines3', 'wandb'])
\ No newline at end of file
+    install_requires=['gym', 'mujoco_py', 'flax', 'wandb'],
+    # only for host-side normalization, `make_vec_env(norm_obs=True or norm_r=True)`
+    extras_require={
+        'vecnormalize': ['stable-baselines3'],
+        # serialization of `export.export_stablehlo` artifacts
+        'stablehlo': ['flatbuffers'],
+    })
\ No newline at end of file